@@ -37,7 +37,8 @@ class GetSentenceUseCase:
                 is_need_translation=True,  # 这需要根据实际情况设置
                 ai_review=ai_review,
                 checkingAI=False,
-                usage_history=[]
+                usage_history=[],
+                is_partial=bool(mapping.is_partial)
             )
             mapping_list.append(mapping_vo)
 
@@ -0,0 +1,263 @@
+import ast
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from langchain_core.messages import AIMessage
+
+from infrastructure.text_processing.pipeline_metrics import current_stage
+
+# 合成回复里使用的常见英文词，保证 WordNet 能找到 synset，后续阶段的调用次数接近真实情况
+_VOCABULARY = [
+    ("decide", "v"), ("important", "a"), ("study", "v"), ("people", "n"), ("change", "v"),
+    ("difficult", "a"), ("problem", "n"), ("quickly", "r"), ("friend", "n"), ("happy", "a"),
+    ("improve", "v"), ("world", "n"), ("carefully", "r"), ("teacher", "n"), ("believe", "v"),
+    ("beautiful", "a"), ("journey", "n"), ("remember", "v"), ("strong", "a"), ("finally", "r"),
+]
+_PUNCTUATION = re.compile(r'[\s，。！？、；：,.!?;:"“”‘’\'（）()《》]')
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def _prompt_text(messages) -> str:
+    if isinstance(messages, str):
+        return messages
+    return "\n".join(str(message.content) for message in messages)
+
+
+class LatencyModel:
+    """
+    模拟 LLM 的响应时间：对数正态分布，median_ms 为中位数，sigma 控制长尾；
+    可以按阶段单独设置中位数（例如第一步生成的内容多，通常更慢）
+    """
+
+    def __init__(self, median_ms: float = 800, sigma: float = 0.4,
+                 stage_median_ms: Optional[Dict[str, float]] = None, seed: Optional[int] = None):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.stage_median_ms = stage_median_ms or {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self, stage: Optional[str]) -> float:
+        median_ms = self.stage_median_ms.get(stage, self.median_ms)
+        if median_ms <= 0:
+            return 0.0
+        with self._lock:
+            return median_ms * self._random.lognormvariate(0, self.sigma) / 1000
+
+
+class RecordingLLM:
+    """包装真实的 LLM，把每次的回复按 prompt 哈希记录下来，保存后供 ReplayLLM 离线回放"""
+
+    def __init__(self, llm, recordings: Optional[Dict[str, dict]] = None):
+        self.llm = llm
+        self._lock = threading.Lock()
+        # 多个 RecordingLLM 可以共用同一个 recordings，保存到一个文件里
+        self.recordings: Dict[str, dict] = recordings if recordings is not None else {}
+
+    def invoke(self, messages, *args, **kwargs):
+        output = self.llm.invoke(messages, *args, **kwargs)
+        self._record(_prompt_text(messages), output.content)
+        return output
+
+    def chat(self, prompt):
+        response = self.llm.chat(prompt)
+        if response is not None:
+            self._record(prompt, response)
+        return response
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            recordings = dict(self.recordings)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(recordings, file, ensure_ascii=False, indent=2)
+
+    def _record(self, prompt: str, content: str) -> None:
+        with self._lock:
+            self.recordings[prompt_hash(prompt)] = {"stage": current_stage(), "content": content}
+
+
+class ReplayLLM:
+    """
+    假的 LLM 后端，同时实现 LangChain chat model 的 invoke 和 LLMAgent 的 chat：
+    按 prompt 哈希回放录制的回复，没有录制时（synthetic=True）按当前阶段生成一个格式正确的合成回复，
+    每次调用都按 LatencyModel 休眠，并按阶段统计调用次数
+    """
+
+    def __init__(self, recordings: Optional[Dict[str, dict]] = None, latency: Optional[LatencyModel] = None,
+                 synthetic: bool = True):
+        self.recordings = recordings or {}
+        self.latency = latency or LatencyModel()
+        self.synthetic = synthetic
+        self._lock = threading.Lock()
+        self.calls: Counter = Counter()
+        self.replayed = 0
+        self.synthesized = 0
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "ReplayLLM":
+        with open(path, "r", encoding="utf-8") as file:
+            return cls(json.load(file), **kwargs)
+
+    def invoke(self, messages, *args, **kwargs) -> AIMessage:
+        prompt = _prompt_text(messages)
+        content = self._respond(prompt)
+        # 按字符数粗略估计 token，让 token 统计在离线时也有数
+        input_tokens, output_tokens = len(prompt) // 2, len(content) // 2
+        return AIMessage(content=content, usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens
+        })
+
+    def chat(self, prompt: str) -> str:
+        return self._respond(prompt)
+
+    def reset_counts(self) -> None:
+        with self._lock:
+            self.calls.clear()
+            self.replayed = 0
+            self.synthesized = 0
+
+    def _respond(self, prompt: str) -> str:
+        stage = current_stage()
+        time.sleep(self.latency.sample(stage))
+        recording = self.recordings.get(prompt_hash(prompt))
+        with self._lock:
+            self.calls[stage or "unknown"] += 1
+            if recording is not None:
+                self.replayed += 1
+            elif self.synthetic:
+                self.synthesized += 1
+        if recording is not None:
+            return recording["content"]
+        if not self.synthetic:
+            raise KeyError(f"No recorded response for {stage} prompt {prompt_hash(prompt)[:12]}")
+        return synthesize(stage, prompt)
+
+
+def synthesize(stage: Optional[str], prompt: str) -> str:
+    """按阶段从 prompt 里取出输入，生成能被对应 parser 解析的回复"""
+    handler = _SYNTHESIZERS.get(stage)
+    if handler is None:
+        raise KeyError(f"No synthetic response for stage {stage}")
+    return handler(prompt)
+
+
+def _segments(sentence: str) -> List[dict]:
+    """把句子按标点分开后每两个字切成一段（每段都是原句的子串），每段确定性地对应一个常见英文词"""
+    words = []
+    for piece in _PUNCTUATION.split(sentence):
+        for start in range(0, len(piece), 2):
+            chinese = piece[start:start + 2]
+            index = int(hashlib.md5(chinese.encode("utf-8")).hexdigest(), 16) % len(_VOCABULARY)
+            english, pos = _VOCABULARY[index]
+            words.append({"english": english, "pos": pos, "chinese": chinese})
+    return words
+
+
+def _translation(words: List[dict]) -> str:
+    return " ".join(word["english"] for word in words).capitalize() + "."
+
+
+def _phase1(prompt: str) -> str:
+    sentence = re.search(r'『(.*?)』', prompt, re.S).group(1)
+    words = _segments(sentence)
+    return json.dumps({
+        "original": sentence,
+        "translation": _translation(words),
+        "words": [{"english": word["english"]} for word in words]
+    }, ensure_ascii=False)
+
+
+def _phase1_packed(prompt: str) -> str:
+    sentences = re.findall(r'"index": (\d+),\s*"sentence": ("(?:[^"\\]|\\.)*")', prompt)
+    results = []
+    for index, sentence in sentences:
+        sentence = json.loads(sentence)
+        words = _segments(sentence)
+        results.append({
+            "index": int(index),
+            "original": sentence,
+            "translation": _translation(words),
+            "words": [word["english"] for word in words]
+        })
+    return json.dumps({"sentences": results}, ensure_ascii=False)
+
+
+def _phase2(prompt: str) -> str:
+    sentence = json.loads(re.search(r'"original": ("(?:[^"\\]|\\.)*")', prompt).group(1))
+    words = _segments(sentence)
+    return json.dumps({"original": sentence, "translation": _translation(words), "words": words},
+                      ensure_ascii=False)
+
+
+def _hybrid_resolve(prompt: str) -> str:
+    # 有候选时选第一个，没有时按中文确定性地取一个常见英文词
+    spans = re.findall(r'"id": (\d+),\s*"chinese": ("(?:[^"\\]|\\.)*"),\s*"pos": "(\w)",\s*"candidates": (\[.*?\])',
+                       prompt, re.S)
+    results = []
+    for span_id, chinese, pos, candidates in spans:
+        candidates = json.loads(candidates)
+        english = candidates[0] if candidates else _segments(json.loads(chinese))[0]["english"]
+        results.append({"id": int(span_id), "english": english, "pos": pos})
+    return json.dumps({"spans": results}, ensure_ascii=False)
+
+
+def _near_duplicate_resolve(prompt: str) -> str:
+    # 修改过的片段和完整句子用同样的方式切分
+    fragments = re.findall(r'"id": (\d+),\s*"text": ("(?:[^"\\]|\\.)*")', prompt)
+    return json.dumps({"fragments": [
+        {"id": int(fragment_id), "words": _segments(json.loads(text))} for fragment_id, text in fragments
+    ]}, ensure_ascii=False)
+
+
+def _synset_batch(prompt: str) -> str:
+    # 每个词选第一个候选 synset
+    choices = re.findall(r'"id": (\d+),\s*"word": "[^"]*",\s*"synsets": \[\s*\{\s*"name": "([^"]+)"', prompt)
+    return json.dumps({"words": [
+        {"id": int(word_id), "synsets": [{"synset_name": name, "definition": ""}]} for word_id, name in choices
+    ]})
+
+
+def _synset_single(prompt: str) -> str:
+    name = re.search(r'"name": "([^"]+)"', prompt).group(1)
+    return json.dumps({"synsets": [{"synset_name": name, "definition": ""}]})
+
+
+def _transform_batch(prompt: str) -> str:
+    # 原样返回同义词，数量和顺序与输入一致
+    items = re.findall(r'"id": (\d+),.*?"words": (\[.*?\])', prompt, re.S)
+    return json.dumps({"items": [
+        {"id": int(item_id), "words_transformation": json.loads(words)} for item_id, words in items
+    ]})
+
+
+def _transform_single(prompt: str) -> str:
+    words = ast.literal_eval(re.search(r'`(\[.*?\])`', prompt, re.S).group(1))
+    return json.dumps({"words_transformation": words})
+
+
+_SYNTHESIZERS = {
+    "phase1": _phase1,
+    "phase1_packed": _phase1_packed,
+    "phase2": _phase2,
+    "hybrid_resolve": _hybrid_resolve,
+    "near_duplicate_resolve": _near_duplicate_resolve,
+    "synset_batch": _synset_batch,
+    "synset_single": _synset_single,
+    "transform_batch": _transform_batch,
+    "transform_single": _transform_single,
+    # 两级模型里快模型的阶段，prompt 与强模型相同
+    "phase1_fast": _phase1,
+    "phase2_fast": _phase2,
+    "transform_fast": _transform_batch,
+}
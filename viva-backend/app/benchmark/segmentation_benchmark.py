@@ -0,0 +1,257 @@
+"""
+分词流水线的离线基准测试：用 ReplayLLM 回放录制的回复（或按阶段生成合成回复）代替 OpenAI，
+对样例作文跑 EssayService 的分词部分（segment_essay，包括缓存、流水线和 mapping 的生成，不包括写数据库），
+报告吞吐、作文耗时的 p50/p95 和每篇作文的 LLM 调用次数
+
+在 app 目录下运行：
+    python -m benchmark.segmentation_benchmark --repeat 3 --workers 2
+    python -m benchmark.segmentation_benchmark --median-latency-ms 0            # 只看调用次数
+    python -m benchmark.segmentation_benchmark --recordings recordings.json --no-synthetic
+    python -m benchmark.segmentation_benchmark --save-baseline benchmark/baseline.json
+    python -m benchmark.segmentation_benchmark --baseline benchmark/baseline.json  # 调用次数超过基线时退出码为 1
+
+录制真实回复：设置 BENCHMARK_RECORD_TO=recordings.json 后用真实的 LLM 跑一遍（--record）
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+# 获取当前文件的目录
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# 获取项目根目录（benchmark 在项目根目录下）
+project_root = os.path.abspath(os.path.join(current_dir, '..'))
+
+# 将项目根目录添加到 Python 路径
+sys.path.insert(0, project_root)
+
+# 离线运行时不需要真实的密钥和数据库（只创建 engine，不会连接），prompt 默认用仓库里的文件
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("LLM_MODEL_NAME_FOR_BASIC_CHAT", "benchmark")
+os.environ.setdefault("DATABASE_URL", "postgresql://benchmark@localhost/benchmark")
+for _env_name, _file_name in [
+    ("SEGMENT_PROMPT_FILE1", "segment_prompt1.txt"), ("SEGMENT_PROMPT_FILE2", "segment_prompt2.txt"),
+    ("SEGMENT_PROMPT_FILE3", "segment_prompt3.txt"), ("SEGMENT_PROMPT_FILE4", "segment_prompt4.txt"),
+    ("SEGMENT_PROMPT_FILE5", "segment_prompt5.txt"), ("SEGMENT_PROMPT_FILE6", "segment_prompt6.txt"),
+    ("SEGMENT_PROMPT_FILE7", "segment_prompt7.txt"), ("SEGMENT_PROMPT_FILE8", "segment_prompt8.txt"),
+    ("WORDNET_PROMPT_FILE1", "wordnet_prompt1.txt"), ("WORDNET_PROMPT_FILE2", "wordnet_prompt2.txt"),
+]:
+    os.environ.setdefault(_env_name, os.path.join(project_root, "prompt", _file_name))
+
+from benchmark.fake_llm import LatencyModel, RecordingLLM, ReplayLLM
+from domain.services.essay_processing_service import EssayService
+from infrastructure.english.word_net import WordNetService
+from infrastructure.text_processing import pipeline_metrics
+from infrastructure.text_processing.segmentation_artifacts import SegmentationArtifacts
+from infrastructure.text_processing.segmentation_cache import SegmentationCache
+from infrastructure.text_processing.segmentation_service import SegmentationService
+
+DEFAULT_CORPUS = os.path.join(current_dir, "essays.json")
+
+
+class _MemoryCacheRepository:
+    """内存里的分词缓存；enabled=False 时永远不命中，测的是完整的流水线"""
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.rows: Dict[tuple, dict] = {}
+
+    def get_by_hashes(self, sentence_hashes: List[str], version: str) -> Dict[str, dict]:
+        return {h: self.rows[(h, version)] for h in sentence_hashes if (h, version) in self.rows}
+
+    def upsert_many(self, results: Dict[str, dict], version: str) -> None:
+        if self.enabled:
+            for sentence_hash, result in results.items():
+                self.rows[(sentence_hash, version)] = result
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def build_service(llm, cache_enabled: bool) -> EssayService:
+    """把流水线里所有的 LLM 换成 llm，其余部分（对齐、词形变化、WordNet）照常运行"""
+    segmentation_service = SegmentationService()
+    segmentation_service.chat_agent = llm
+    segmentation_service.llm = llm
+    if segmentation_service.fast_llm is not None:
+        segmentation_service.fast_llm = llm
+    # 分阶段产物存在数据库里，离线运行时不保存
+    segmentation_service.artifacts = SegmentationArtifacts(enabled=False)
+    WordNetService._llm = llm
+    return EssayService(
+        segmentation_service=segmentation_service,
+        sentence_repository=None,
+        active_mapping_repository=None,
+        essay_repository=None,
+        segmentation_cache=SegmentationCache(_MemoryCacheRepository(cache_enabled))
+    )
+
+
+def run_benchmark(essay_service: EssayService, corpus: List[dict], repeat: int, workers: int) -> dict:
+    """并发处理 corpus 里的作文 repeat 遍，返回整体和每篇作文的统计"""
+    pipeline_metrics.pipeline_metrics.reset()
+    runs = [(essay, round_index) for round_index in range(repeat) for essay in corpus]
+
+    def process(run) -> dict:
+        essay_data, round_index = run
+        started = time.perf_counter()
+        with pipeline_metrics.trace(essay_data["id"]) as trace:
+            sentences, results = essay_service.segment_essay(essay_data["content"])
+            # 和写入数据库前一样生成每个句子的 mapping
+            rows = [row for result in results if result is not None
+                    for row in essay_service._build_mapping_rows(result)]
+        return {
+            "id": essay_data["id"],
+            "round": round_index,
+            "seconds": time.perf_counter() - started,
+            "sentences": len(sentences),
+            "rows": len(rows),
+            "llm_calls": trace.summary()["llm_calls"],
+        }
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(process, runs))
+    wall_seconds = time.perf_counter() - started
+
+    latencies = [result["seconds"] for result in results]
+    sentences = sum(result["sentences"] for result in results)
+    # 每篇作文的调用次数取第一轮（后面几轮可能命中缓存）
+    calls_per_essay = {result["id"]: result["llm_calls"] for result in results if result["round"] == 0}
+    return {
+        "essays": len(results),
+        "sentences": sentences,
+        "wall_seconds": round(wall_seconds, 3),
+        "essays_per_second": round(len(results) / wall_seconds, 3) if wall_seconds else 0.0,
+        "sentences_per_second": round(sentences / wall_seconds, 3) if wall_seconds else 0.0,
+        "essay_p50_seconds": round(_percentile(latencies, 0.5), 3),
+        "essay_p95_seconds": round(_percentile(latencies, 0.95), 3),
+        "essay_max_seconds": round(max(latencies), 3) if latencies else 0.0,
+        "llm_calls": sum(result["llm_calls"] for result in results),
+        "llm_calls_per_essay": calls_per_essay,
+        "stages": pipeline_metrics.pipeline_metrics.snapshot(),
+    }
+
+
+def compare_with_baseline(report: dict, baseline: Dict[str, int], tolerance: float) -> List[str]:
+    """返回调用次数超过基线的作文"""
+    regressions = []
+    for essay_id, calls in report["llm_calls_per_essay"].items():
+        expected = baseline.get(essay_id)
+        if expected is not None and calls > expected * (1 + tolerance):
+            regressions.append(f"{essay_id}: {calls} LLM calls, baseline {expected}")
+    return regressions
+
+
+def print_report(report: dict, llm: Optional[ReplayLLM]) -> None:
+    print(f"作文数: {report['essays']}  句子数: {report['sentences']}  总耗时: {report['wall_seconds']}s")
+    print(f"吞吐: {report['essays_per_second']} 篇/s, {report['sentences_per_second']} 句/s")
+    print(f"单篇耗时: p50 {report['essay_p50_seconds']}s  p95 {report['essay_p95_seconds']}s  "
+          f"max {report['essay_max_seconds']}s")
+    if llm is not None:
+        print(f"LLM 调用: {report['llm_calls']} 次（回放 {llm.replayed}，合成 {llm.synthesized}）")
+    else:
+        print(f"LLM 调用: {report['llm_calls']} 次")
+    print("\n每篇作文的 LLM 调用次数:")
+    for essay_id, calls in report["llm_calls_per_essay"].items():
+        print(f"  {essay_id:<24}{calls}")
+    print("\n各阶段:")
+    print(f"  {'stage':<18}{'count':>7}{'calls':>7}{'retries':>9}{'parse_fail':>12}{'errors':>8}"
+          f"{'p50(s)':>9}{'p95(s)':>9}{'tokens':>10}")
+    for name, stats in report["stages"].items():
+        print(f"  {name:<18}{stats['count']:>7}{stats['llm_calls']:>7}{stats['retries']:>9}"
+              f"{stats['parse_failures']:>12}{stats['errors']:>8}{stats['p50_seconds']:>9}{stats['p95_seconds']:>9}"
+              f"{stats['prompt_tokens'] + stats['completion_tokens']:>10}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmark of the segmentation pipeline")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="作文样例 json：[{id, content}]")
+    parser.add_argument("--recordings", help="RecordingLLM 保存的回复")
+    parser.add_argument("--no-synthetic", action="store_true", help="没有录制的 prompt 直接报错，不生成合成回复")
+    parser.add_argument("--median-latency-ms", type=float, default=800)
+    parser.add_argument("--sigma", type=float, default=0.4, help="对数正态分布的 sigma，越大长尾越明显")
+    parser.add_argument("--stage-latency", action="append", default=[], metavar="STAGE=MS",
+                        help="单独设置某个阶段的中位延迟，例如 phase1=1500")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("ESSAY_WORKER_COUNT", "2")),
+                        help="同时处理的作文数")
+    parser.add_argument("--warm-cache", action="store_true", help="启用分词缓存，第二轮以后会命中")
+    parser.add_argument("--record", action="store_true",
+                        help="用真实的 LLM 运行，并把回复保存到 BENCHMARK_RECORD_TO")
+    parser.add_argument("--json", action="store_true", help="输出 json 格式的报告")
+    parser.add_argument("--save-baseline", help="把每篇作文的 LLM 调用次数保存为基线")
+    parser.add_argument("--baseline", help="与基线比较，调用次数变多时退出码为 1")
+    parser.add_argument("--tolerance", type=float, default=0.0, help="允许超过基线的比例")
+    args = parser.parse_args(argv)
+
+    with open(args.corpus, "r", encoding="utf-8") as file:
+        corpus = json.load(file)
+
+    recorder = None
+    if args.record:
+        record_to = os.getenv("BENCHMARK_RECORD_TO")
+        if not record_to:
+            parser.error("--record requires BENCHMARK_RECORD_TO")
+        essay_service = EssayService(
+            segmentation_service=SegmentationService(), sentence_repository=None,
+            active_mapping_repository=None, essay_repository=None,
+            segmentation_cache=SegmentationCache(_MemoryCacheRepository(False))
+        )
+        segmentation_service = essay_service.segmentation_service
+        segmentation_service.artifacts = SegmentationArtifacts(enabled=False)
+        recorder = RecordingLLM(segmentation_service.llm)
+        segmentation_service.llm = recorder
+        segmentation_service.chat_agent = RecordingLLM(segmentation_service.chat_agent, recorder.recordings)
+        if segmentation_service.fast_llm is not None:
+            segmentation_service.fast_llm = RecordingLLM(segmentation_service.fast_llm, recorder.recordings)
+        WordNetService._llm = RecordingLLM(WordNetService._llm, recorder.recordings)
+        llm = None
+    else:
+        latency = LatencyModel(
+            median_ms=args.median_latency_ms,
+            sigma=args.sigma,
+            stage_median_ms={name: float(ms) for name, ms in (item.split("=", 1) for item in args.stage_latency)},
+            seed=args.seed
+        )
+        if args.recordings:
+            llm = ReplayLLM.from_file(args.recordings, latency=latency, synthetic=not args.no_synthetic)
+        else:
+            llm = ReplayLLM(latency=latency, synthetic=not args.no_synthetic)
+        essay_service = build_service(llm, args.warm_cache)
+
+    report = run_benchmark(essay_service, corpus, args.repeat, args.workers)
+    if recorder is not None:
+        recorder.save(os.getenv("BENCHMARK_RECORD_TO"))
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report, llm)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as file:
+            json.dump(report["llm_calls_per_essay"], file, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            regressions = compare_with_baseline(report, json.load(file), args.tolerance)
+        if regressions:
+            print("\nLLM 调用次数超过基线:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
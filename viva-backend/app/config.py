@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -31,6 +33,8 @@ class Settings(BaseSettings):
     GOOGLE_CLIENT_ID: str
     JWT_ALGORITHM: str
     JWT_SECRET: str
+    # 可以访问 /segmentationMetrics 等管理接口的用户（逗号分隔的 google_id），为空时都不能访问
+    ADMIN_USER_IDS: str = ""
 
     # External Services
     ASSEMBLYAI_API_KEY: str
@@ -42,6 +46,61 @@ class Settings(BaseSettings):
     SEGMENT_PROMPT_FILE1: str
     SEGMENT_PROMPT_FILE2: str
     SEGMENT_PROMPT_FILE3: str
+    SEGMENT_PROMPT_FILE4: str
+    SEGMENT_PROMPT_FILE5: str
+    # 只有开启对应功能时才需要：合并请求（SEGMENT_PACK_TOKEN_BUDGET、SEGMENT_BATCH_MAX_WAIT_MS）、hybrid 模式、相似句子复用
+    SEGMENT_PROMPT_FILE6: Optional[str] = None
+    SEGMENT_PROMPT_FILE7: Optional[str] = None
+    SEGMENT_PROMPT_FILE8: Optional[str] = None
+    WORDNET_PROMPT_FILE1: str
+    WORDNET_PROMPT_FILE2: str
+
+    # Segmentation Pipeline Settings
+    # 本进程所有作文、worker 和重试共用的 LLM 并发上限
+    SEGMENT_MAX_CONCURRENCY: int = 8
+    ESSAY_WORKER_COUNT: int = 2
+    # 每个任务的进度频道在内存里保留的最近事件数，晚到的订阅者更早的句子从数据库读取
+    EVENT_HISTORY_MAX_EVENTS: int = 200
+    # 领取作文任务的租约秒数，每次更新进度时续期；过期后其他进程启动时可以重新领取
+    ESSAY_JOB_LEASE_SECONDS: float = 600
+    # 第一步多个句子合并成一次请求时每个请求的 token 预算，0 表示不合并
+    SEGMENT_PACK_TOKEN_BUDGET: int = 0
+    # 跨作文动态批处理（第一步和 synset 选择）：最多等待的毫秒数，0 表示不开启；以及每批最多的请求数
+    SEGMENT_BATCH_MAX_WAIT_MS: float = 0
+    SEGMENT_BATCH_MAX_SIZE: int = 8
+    # 两级模型：快模型名称，为空表示不开启；不超过多少个字的简单句子先交给快模型
+    SEGMENT_FAST_MODEL_NAME: Optional[str] = None
+    SEGMENT_FAST_MAX_CHARS: int = 30
+    # 分词模式：llm 为全部交给 LLM；hybrid 为 jieba + 离线汉英词典先分词，只把有歧义或词典里没有的词交给 LLM
+    SEGMENT_MODE: str = "llm"
+    # CC-CEDICT 格式的离线汉英词典文件，hybrid 模式需要
+    CEDICT_FILE: Optional[str] = None
+    # 长文档模式：超过 1500 字的文本最多允许多少个字，以及每块多少个句子（分块分词、分块写入）
+    LONG_DOCUMENT_MAX_CHARS: int = 20000
+    LONG_DOCUMENT_CHUNK_SENTENCES: int = 40
+    # 分词缓存的命中次数在内存里累加，每隔多少秒批量写回 segmentation_cache.hit_count
+    SEGMENT_CACHE_HIT_FLUSH_SECONDS: float = 30
+    # 是否保存分阶段的分词产物（segmentation_artifacts 表），失败的句子重试时从最后一个成功的阶段继续
+    SEGMENT_ARTIFACTS_ENABLED: bool = True
+    # 分阶段产物保留多少天，启动时删除更早的和第一到第三步旧版本的产物
+    SEGMENT_ARTIFACT_TTL_DAYS: float = 7
+    # 相似句子复用：和已有缓存结果的句子相似度（difflib ratio）不低于 NEAR_DUPLICATE_MIN_RATIO 时，
+    # 没有修改的词直接复用，只把修改过的片段交给 LLM；索引最多加载多少个句子
+    NEAR_DUPLICATE_ENABLED: bool = False
+    NEAR_DUPLICATE_MIN_RATIO: float = 0.8
+    NEAR_DUPLICATE_MAX_SENTENCES: int = 100000
+    # 整篇作文分词的截止时间（秒），0 表示不限时；剩余时间少于预留秒数时跳过同义词扩展和词形变换，由后台补全
+    ESSAY_DEADLINE_SECONDS: float = 0
+    ESSAY_DEADLINE_RESERVE_SECONDS: float = 5
+    # submitEssay 的 Idempotency-Key 保留多少小时，过期后同一个 key 会被当作新的请求
+    IDEMPOTENCY_KEY_TTL_HOURS: float = 24
+    # 准入控制：本进程和每个用户进行中的作文最多预计多少次 LLM 调用，超过时 submitEssay 返回 429；
+    # 还没有处理速度的统计时按每秒多少次调用估计 Retry-After
+    # 计数在每个 worker 进程的内存里，都是单个进程的上限：N 个 worker 时整体（包括单个用户）最多是 N 倍；
+    # 已经有分词缓存的句子不计入，单篇作文最多计入较小的那个上限
+    ADMISSION_MAX_INFLIGHT_CALLS: int = 2000
+    ADMISSION_MAX_USER_INFLIGHT_CALLS: int = 600
+    ADMISSION_DEFAULT_CALLS_PER_SECOND: float = 2
 
     # Other Settings
     PYTHONPATH: str
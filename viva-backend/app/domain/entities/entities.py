@@ -1,7 +1,8 @@
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Optional, List
 from sqlalchemy import Integer, String, DateTime, Boolean, ForeignKey, Text, Float
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
@@ -98,6 +99,8 @@ class ActiveMapping(Base):
     user_expression: Mapped[str] = mapped_column(String, nullable=False)
     ai_review_is_correct: Mapped[Optional[bool]] = mapped_column(Boolean)
     ai_review_expression: Mapped[Optional[str]] = mapped_column(String)
+    # 离截止时间太近、跳过了同义词扩展时为 True，ai_review_expression 只有第三步的译词，后台补全后替换
+    is_partial: Mapped[bool] = mapped_column(Boolean, default=False)
     create_time: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     update_time: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     is_deleted: Mapped[bool] = mapped_column(Boolean, default=False)
@@ -105,6 +108,76 @@ class ActiveMapping(Base):
     sentence: Mapped["Sentence"] = relationship("Sentence", back_populates="active_mappings")
 
 
+class EssayJobStatus:
+    QUEUED = 'queued'
+    PROCESSING = 'processing'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+class EssayJob(Base):
+    __tablename__ = 'essay_jobs'
+
+    job_id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    essay_id: Mapped[int] = mapped_column(Integer, ForeignKey('essays.essay_id'), nullable=False)
+    user_id: Mapped[Optional[str]] = mapped_column(String(255), ForeignKey('users.google_id'))
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default=EssayJobStatus.QUEUED)
+    total_sentences: Mapped[int] = mapped_column(Integer, default=0)
+    processed_sentences: Mapped[int] = mapped_column(Integer, default=0)
+    failed_sentences: Mapped[int] = mapped_column(Integer, default=0)
+    error: Mapped[Optional[str]] = mapped_column(Text)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    # 正在处理这个任务的 worker 和它的租约到期时间，租约过期前其他 worker 不能再领取
+    worker_id: Mapped[Optional[str]] = mapped_column(String(64))
+    lease_expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    # 各阶段的耗时、LLM 调用、token、重试和解析失败汇总
+    trace: Mapped[Optional[dict]] = mapped_column(JSONB)
+    create_time: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    update_time: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class IdempotencyKey(Base):
+    __tablename__ = 'idempotency_keys'
+
+    # 客户端在 Idempotency-Key 请求头里传入的 key，不同用户的 key 互不影响
+    user_id: Mapped[str] = mapped_column(String(255), ForeignKey('users.google_id'), primary_key=True)
+    idempotency_key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    # 请求内容（作文和图片）的哈希，同一个 key 用在不同的内容上时拒绝
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable=False)
+    # 第一次请求创建的作文和任务，创建完成前为空
+    essay_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey('essays.essay_id'))
+    job_id: Mapped[Optional[str]] = mapped_column(String(36), ForeignKey('essay_jobs.job_id'))
+    create_time: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    update_time: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class SegmentationCache(Base):
+    __tablename__ = 'segmentation_cache'
+
+    # md5(sentence)，与 sentences 表去重用的 md5 一致
+    sentence_hash: Mapped[str] = mapped_column(String(32), primary_key=True)
+    # prompt 与模型的版本号，prompt 或模型变化后旧缓存自然失效
+    version: Mapped[str] = mapped_column(String(64), primary_key=True)
+    result: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    hit_count: Mapped[int] = mapped_column(Integer, default=0)
+    create_time: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    update_time: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class SegmentationArtifact(Base):
+    __tablename__ = 'segmentation_artifacts'
+
+    # md5(sentence)，与 segmentation_cache 一致
+    sentence_hash: Mapped[str] = mapped_column(String(32), primary_key=True)
+    # 阶段：phase1、phase2、phase3、synonyms、transform
+    phase: Mapped[str] = mapped_column(String(20), primary_key=True)
+    # 该阶段及其之前所有阶段的 prompt 与模型的版本号，前面阶段的 prompt 变化后后面的阶段也随之失效
+    version: Mapped[str] = mapped_column(String(64), primary_key=True)
+    result: Mapped[Any] = mapped_column(JSONB, nullable=False)
+    create_time: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    update_time: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
 class WordReview(Base):
     __tablename__ = 'word_review'
 
@@ -24,4 +24,17 @@ class EssaySchema(BaseModel):
         from_attributes = True
 
 class EssayWithSentencesSchema(EssaySchema):
-    sentences: List[SentenceSchema] = []
\ No newline at end of file
+    sentences: List[SentenceSchema] = []
+
+class EssayJobSchema(BaseModel):
+    job_id: str
+    essay_id: int
+    status: str
+    total_sentences: int
+    processed_sentences: int
+    failed_sentences: int
+    error: Optional[str] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    create_time: datetime
+    update_time: datetime
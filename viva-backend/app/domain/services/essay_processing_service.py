@@ -1,16 +1,31 @@
 from re import S
+import asyncio
 import re
-from typing import List, Optional, Dict
+from typing import Callable, List, Optional, Dict, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
 from sqlalchemy.orm import Session
 import tempfile
 import os
 import uuid
+import hashlib
 
-from domain.entities.entities import Essay, ActiveMapping, Sentence, EssaySentence
+from domain.entities.entities import Essay, ActiveMapping, Sentence, EssaySentence, EssayJobStatus
+from infrastructure.repositories.essay_job_repository import EssayJobRepository
+from infrastructure.repositories.idempotency_key_repository import IdempotencyKeyRepository
+from infrastructure.task.task_queue import PRIORITY_BULK, get_task_queue
+from infrastructure.task.admission_controller import AdmissionController, get_admission_controller
+from infrastructure.task.event_broker import get_event_broker
 from infrastructure.repositories import sentence_repository
 from infrastructure.repositories.active_mapping_repository import ActiveMappingRepository
 from infrastructure.repositories.sentence_repository import SentenceRepository
-from infrastructure.text_processing.segmentation_service import SegmentationService
+from infrastructure.text_processing.segmentation_service import SegmentationService, SynonymExpansionResult
+from infrastructure.text_processing.segmentation_cache import SegmentationCache
+from infrastructure.text_processing.offset_aligner import offset_aligner
+from infrastructure.text_processing import pipeline_metrics
+from infrastructure.text_processing.deadline import deadline
+from infrastructure.text_processing.single_flight import sentence_flight
+from infrastructure.text_processing.near_duplicate_index import near_duplicate_index
 from infrastructure.repositories.database_manager import db_manager
 from infrastructure.repositories.essay_repository import EssayRepository
 from infrastructure.oss.AliOssAgent import OssAgent
@@ -19,16 +34,35 @@ from fastapi import UploadFile
 import logging
 
 logger = logging.getLogger(__name__)
+
+# 同一个 Idempotency-Key 占用后超过这个时间还没有创建出任务，视为上次请求中途退出，允许重新占用
+IDEMPOTENCY_PENDING_TIMEOUT = timedelta(seconds=60)
+
+
+class IdempotencyKeyInUse(Exception):
+    """相同 Idempotency-Key 的请求还在处理中"""
+
+
+class IdempotencyKeyMismatch(Exception):
+    """同一个 Idempotency-Key 用在了内容不同的请求上"""
+
+
 class EssayService:
     def __init__(self, segmentation_service: SegmentationService
                  , sentence_repository: SentenceRepository
                  , active_mapping_repository: ActiveMappingRepository
-                 , essay_repository: EssayRepository):
+                 , essay_repository: EssayRepository
+                 , segmentation_cache: Optional[SegmentationCache] = None
+                 , essay_job_repository: Optional[EssayJobRepository] = None
+                 , idempotency_key_repository: Optional[IdempotencyKeyRepository] = None):
         
         self.segmentation_service = segmentation_service
         self.sentence_repository = sentence_repository
         self.active_mapping_repository = active_mapping_repository
         self.essay_repository = essay_repository
+        self.segmentation_cache = segmentation_cache or SegmentationCache()
+        self.essay_job_repository = essay_job_repository or EssayJobRepository()
+        self.idempotency_key_repository = idempotency_key_repository or IdempotencyKeyRepository()
         #self.oss_agent = OssAgent()
 
     async def create_and_process_essay(self, content: str, image: Optional[UploadFile], user_id: str) -> Essay:
@@ -43,11 +77,332 @@ class EssayService:
             user_id=user_id
         )
         
-        # Create essay and process it within a transaction
+        # 先在事务外跑完分词流水线，再在一个短事务里写入作文、句子和 mapping
+        ticket, _ = self._admit(user_id, content=content)
+        try:
+            sentences, segmentation_results = self.segment_essay(content)
+        finally:
+            get_admission_controller().release(ticket)
+        with db_manager.session_scope() as session:
+            created_essay = self.essay_repository.create_essay(essay, session)
+            self.persist_segmentation(created_essay.essay_id, sentences, segmentation_results, session)
+            essay_id = created_essay.essay_id
+        partial = self._partial_sentences(sentences, segmentation_results)
+        if partial:
+            await get_task_queue().add_priority_task(PRIORITY_BULK, self.enrich_partial_sentences, essay_id, partial)
+        return created_essay
+
+    async def submit_essay(self, content: str, image: Optional[UploadFile], user_id: str,
+                           idempotency_key: Optional[str] = None) -> dict:
+        """
+        保存作文并把分词放进后台任务队列，立即返回任务信息，不在请求里跑 LLM 流水线；
+        超过 1500 字的文本在后台按长文档模式分块处理
+
+        带 idempotency_key 时，同一个用户用同一个 key 重复提交相同的内容直接返回第一次创建的任务
+        （返回值里 replayed 为 True），不再创建作文、不再处理；第一次请求还没创建出任务时抛出 IdempotencyKeyInUse，
+        内容不同时抛出 IdempotencyKeyMismatch
+
+        按预计成本申请容量，本进程或该用户进行中的作文太多时抛出 AdmissionRejected（接口返回 429）
+        """
+        self.segmentation_service.validate_essay(content, allow_long=True)
+        if idempotency_key:
+            existing_job = await self._reserve_idempotency_key(user_id, idempotency_key, content, image)
+            if existing_job is not None:
+                return {**existing_job, "replayed": True}
+
+        ticket = None
+        try:
+            ticket, priority = await asyncio.to_thread(self._admit, user_id, content=content)
+            image_url = await self._handle_image_upload(image) if image and image.filename else None
+
+            essay = Essay(
+                title="暂无",  # Temporary title
+                content=content,
+                image_url=image_url,
+                user_id=user_id
+            )
+            # 作文和任务在同一个事务里创建，不会留下没有任务的作文；数据库操作放到线程里，不阻塞事件循环
+            job = await asyncio.to_thread(self._create_essay_with_job, essay, user_id)
+        except Exception:
+            get_admission_controller().release(ticket)
+            if idempotency_key:
+                await asyncio.to_thread(self.idempotency_key_repository.release, user_id, idempotency_key)
+            raise
+        if idempotency_key:
+            await asyncio.to_thread(self.idempotency_key_repository.attach,
+                                    user_id, idempotency_key, job['essay_id'], job['job_id'])
+        await get_task_queue().add_priority_task(priority, self.process_essay_job, job['job_id'], ticket)
+        return job
+
+    def _create_essay_with_job(self, essay: Essay, user_id: str) -> dict:
         with db_manager.session_scope() as session:
             created_essay = self.essay_repository.create_essay(essay, session)
-            self.process_essay(created_essay, session)
-            return created_essay
+            return self.essay_job_repository.create(created_essay.essay_id, user_id, session)
+
+    def _admit(self, user_id: Optional[str], essay_id: Optional[int] = None, content: Optional[str] = None,
+               force: bool = False) -> Tuple[str, int]:
+        """
+        按作文里还没有分词缓存的句子估计 LLM 成本并申请容量，返回 (ticket, 任务优先级)；
+        重复提交已经处理过的内容不会被当作新内容限流；没有传入 content 时从数据库读出作文内容
+        """
+        if content is None:
+            with db_manager.session_scope() as session:
+                essay = session.get(Essay, essay_id)
+                content = essay.content if essay is not None else ""
+        sentences = list(dict.fromkeys(self.segmentation_service.iter_sentences(content)))
+        cached = self.segmentation_cache.contains_many(sentences, self.segmentation_service.pipeline_version())
+        misses = [sentence for sentence in sentences if sentence not in cached]
+        estimate = AdmissionController.estimate(
+            len(misses), sum(len(sentence) for sentence in misses),
+            self.segmentation_service.estimate_llm_calls(misses))
+        admission_controller = get_admission_controller()
+        return admission_controller.admit(user_id, estimate, force), admission_controller.priority(estimate)
+
+    async def _reserve_idempotency_key(self, user_id: str, idempotency_key: str, content: str,
+                                       image: Optional[UploadFile]) -> Optional[dict]:
+        """占用 key 时返回 None，由本次请求创建任务；key 已经有任务时返回该任务"""
+        fingerprint = await self._request_fingerprint(content, image)
+        existing = self.idempotency_key_repository.reserve(
+            user_id, idempotency_key, fingerprint, self._idempotency_key_ttl(), IDEMPOTENCY_PENDING_TIMEOUT)
+        if existing is None:
+            return None
+        if existing['fingerprint'] != fingerprint:
+            raise IdempotencyKeyMismatch(f"Idempotency-Key {idempotency_key} was used for a different essay")
+        job = self.essay_job_repository.get_by_id(existing['job_id']) if existing['job_id'] else None
+        if job is None:
+            raise IdempotencyKeyInUse(f"A request with Idempotency-Key {idempotency_key} is still being processed")
+        logger.info(f"Replaying essay job {job['job_id']} for Idempotency-Key {idempotency_key}")
+        return job
+
+    @staticmethod
+    async def _request_fingerprint(content: str, image: Optional[UploadFile]) -> str:
+        """作文内容和图片内容的哈希；读完图片后回到开头，后面的上传不受影响"""
+        digest = hashlib.sha256(content.encode("utf-8"))
+        if image and image.filename:
+            digest.update(b"\0")
+            digest.update(await image.read())
+            await image.seek(0)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _idempotency_key_ttl() -> timedelta:
+        return timedelta(hours=float(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24")))
+
+    def delete_expired_idempotency_keys(self) -> int:
+        deleted = self.idempotency_key_repository.delete_expired(self._idempotency_key_ttl())
+        if deleted:
+            logger.info(f"Deleted {deleted} expired idempotency keys")
+        return deleted
+
+    async def retry_job(self, job_id: str) -> dict:
+        """
+        重新排队一个失败的任务；普通作文失败时数据库里只有作文本身（句子和 mapping 在同一个事务里写入），
+        长文档可能已经写入了部分分块，重跑时这些句子命中分词缓存，写入也是幂等的，都可以安全重跑
+
+        状态用带条件的 UPDATE 从失败改为排队，同时重复的重试请求只有一个会把任务放进队列
+        """
+        job = self.essay_job_repository.get_by_id(job_id)
+        if job is None:
+            raise ValueError(f"Essay job {job_id} not found")
+        if job['status'] != EssayJobStatus.FAILED:
+            raise ValueError(f"Only failed jobs can be retried, job {job_id} is {job['status']}")
+        ticket, priority = await asyncio.to_thread(self._admit, job['user_id'], essay_id=job['essay_id'])
+        if not self.essay_job_repository.requeue_failed(job_id):
+            get_admission_controller().release(ticket)
+            raise ValueError(f"Only failed jobs can be retried, job {job_id} was already retried")
+        await get_task_queue().add_priority_task(priority, self.process_essay_job, job_id, ticket)
+        return self.essay_job_repository.get_by_id(job_id)
+
+    async def resume_unfinished_jobs(self) -> int:
+        """
+        启动时把上次进程退出时还在排队、或处理中但租约已经过期的任务重新放进队列；这些任务已经被接受过，不再检查容量
+
+        其他进程同时也可能把同一个任务放进队列，真正处理前由 process_essay_job 领取，只有一个 worker 能领取成功
+        """
+        jobs = self.essay_job_repository.get_unfinished()
+        for job in jobs:
+            ticket, priority = self._admit(job['user_id'], essay_id=job['essay_id'], force=True)
+            await get_task_queue().add_priority_task(priority, self.process_essay_job, job['job_id'], ticket)
+        if jobs:
+            logger.info(f"Resumed {len(jobs)} unfinished essay jobs")
+        return len(jobs)
+
+    def process_essay_job(self, job_id: str, admission_ticket: Optional[str] = None) -> None:
+        """
+        后台 worker 执行：处理作文并记录每个句子的进度、失败数和最终状态
+        分词期间不占用数据库连接，全部算完后才在一个短事务里写入结果；结束时释放准入时申请的容量
+
+        开始前先领取任务，任务已经被其他 worker 领取（或已经结束、不存在）时直接跳过
+        """
+        job = self.essay_job_repository.claim(job_id)
+        if job is None:
+            logger.info(f"Essay job {job_id} is not claimable (missing, finished or claimed by another worker), skipping")
+            get_admission_controller().release(admission_ticket)
+            return
+
+        event_broker = get_event_broker()
+        event_broker.open(job_id)
+        # 记录这篇作文每个阶段的耗时、token 和失败情况，随任务一起保存
+        with pipeline_metrics.trace(job_id) as trace:
+            try:
+                # 只在短事务里读出作文内容，分词期间不持有连接
+                with db_manager.session_scope() as session:
+                    essay = session.get(Essay, job['essay_id'])
+                    if essay is None:
+                        raise ValueError(f"No Essay found with ID {job['essay_id']}")
+                    content = essay.content
+                    # 上次已经写入成功、只是没来得及更新任务状态时，不再重复写入；
+                    # 长文档是分块写入的，已有句子不代表全部写完，总是重新处理
+                    long_document = self.segmentation_service.is_long_document(content)
+                    already_persisted = bool(essay.essay_sentences) and not long_document
+
+                if already_persisted:
+                    logger.info(f"Essay {job['essay_id']} already has sentences, marking job {job_id} completed")
+                elif long_document:
+                    self._process_long_document(job_id, job['essay_id'], content)
+                else:
+                    total = len(self.segmentation_service.split_into_sentences(content))
+                    self.essay_job_repository.mark_processing(job_id, total)
+                    event_broker.publish(job_id, {"event": "started", "data": {"total_sentences": total}})
+                    sentences, segmentation_results = self.segment_essay(
+                        content, on_sentence_done=self._job_progress_recorder(job_id))
+                    with db_manager.session_scope() as session:
+                        self.persist_segmentation(job['essay_id'], sentences, segmentation_results, session)
+                    # 截止时间前没来得及做同义词扩展的句子，放到队列里在后台补全
+                    partial = self._partial_sentences(sentences, segmentation_results)
+                    if partial:
+                        get_task_queue().add_task_threadsafe(
+                            PRIORITY_BULK, self.enrich_partial_sentences, job['essay_id'], partial)
+                self.essay_job_repository.mark_completed(job_id, trace.summary())
+                event_broker.publish(job_id, {"event": "done", "data": self.essay_job_repository.get_by_id(job_id)})
+            except Exception as e:
+                logger.error(f"Error processing essay job {job_id}: {str(e)}")
+                self.essay_job_repository.mark_failed(job_id, str(e), trace.summary())
+                event_broker.publish(job_id, {"event": "failed", "data": {"status": EssayJobStatus.FAILED, "error": str(e)}})
+            finally:
+                event_broker.close(job_id)
+                get_admission_controller().release(admission_ticket)
+
+    def _process_long_document(self, job_id: str, essay_id: int, content: str) -> None:
+        """
+        长文档模式：按 LONG_DOCUMENT_CHUNK_SENTENCES 个句子一块，逐块分词，每块算完就在单独的短事务里写入
+
+        写入在另一个线程里进行，和下一块的分词重叠；下一块写入前先等上一块写完，
+        所以同时在内存里的最多是一块正在分词的和一块正在写入的结果，写入慢时分词也会停下来等待
+        """
+        self.segmentation_service.validate_essay(content, allow_long=True)
+        chunk_size = int(os.getenv("LONG_DOCUMENT_CHUNK_SENTENCES", "40"))
+        total = sum(1 for _ in self.segmentation_service.iter_sentences(content))
+        self.essay_job_repository.mark_processing(job_id, total)
+        get_event_broker().publish(job_id, {"event": "started", "data": {"total_sentences": total}})
+        logger.info(f"Processing essay {essay_id} as a long document: {len(content)} chars, {total} sentences")
+
+        record_progress = self._job_progress_recorder(job_id)
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending_write: Optional[Future] = None
+            offset = 0
+            for chunk in self.segmentation_service.iter_sentence_chunks(content, chunk_size):
+                results = self.segment_with_cache(
+                    chunk, lambda index, result, offset=offset: record_progress(offset + index, result))
+                # 上一块写入失败时抛出，整个任务失败
+                if pending_write is not None:
+                    pending_write.result()
+                pending_write = writer.submit(self._persist_chunk, essay_id, chunk, results)
+                offset += len(chunk)
+            if pending_write is not None:
+                pending_write.result()
+
+    def enrich_partial_sentences(self, essay_id: int, sentences: List[str]) -> None:
+        """
+        后台补全不完整的句子：不设截止时间重新处理（前三步从分阶段产物继续，只补同义词扩展和词形变换），
+        再由 persist_segmentation 替换掉这些句子不完整的 mapping
+        """
+        with pipeline_metrics.trace(f"enrich:{essay_id}"):
+            results = self.segment_with_cache(sentences)
+        with db_manager.session_scope() as session:
+            self.persist_segmentation(essay_id, sentences, results, session)
+        logger.info(f"Enriched {sum(1 for r in results if r is not None and not r.partial)}/{len(sentences)} "
+                    f"partial sentences of essay {essay_id}")
+
+    @staticmethod
+    def _partial_sentences(sentences: List[str],
+                           segmentation_results: List[Optional[SynonymExpansionResult]]) -> List[str]:
+        """跳过了同义词扩展的句子（去重）"""
+        return list(dict.fromkeys(
+            sentence for sentence, result in zip(sentences, segmentation_results)
+            if result is not None and result.partial
+        ))
+
+    def _persist_chunk(self, essay_id: int, sentences: List[str],
+                       segmentation_results: List[Optional[SynonymExpansionResult]]) -> None:
+        with db_manager.session_scope() as session:
+            self.persist_segmentation(essay_id, sentences, segmentation_results, session)
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        return self.essay_job_repository.get_by_id(job_id)
+
+    def get_finished_job_events(self, job: dict) -> List[dict]:
+        """
+        已经结束（且内存里没有事件记录）的任务，从数据库里重建事件，和实时推送的格式一致：
+        index 按作文原文重新分句得到，和实时推送时句子在作文里的位置一致（重复的句子各自有一个事件）
+        """
+        events = []
+        if job['status'] == EssayJobStatus.COMPLETED:
+            with db_manager.session_scope() as session:
+                essay = session.get(Essay, job['essay_id'])
+                content = essay.content if essay is not None else ""
+            stored = {sentence.sentence: sentence for sentence in self.sentence_repository.get_by_essay_id(job['essay_id'])}
+            mappings_by_id = {}
+            for index, text in enumerate(self.segmentation_service.iter_sentences(content)):
+                sentence = stored.get(text)
+                if sentence is None:
+                    # 分词失败、没有写入的句子
+                    events.append({"event": "sentence", "data": {"index": index, "failed": True}})
+                    continue
+                if sentence.sentence_id not in mappings_by_id:
+                    mappings_by_id[sentence.sentence_id] = self.active_mapping_repository.get_by_sentence_id(
+                        sentence.sentence_id)
+                events.append({"event": "sentence", "data": {
+                    "index": index,
+                    "sentence": sentence.sentence,
+                    "mappings": [
+                        {
+                            "chinese": mapping.chinese,
+                            "focus_start": mapping.focus_start,
+                            "focus_end": mapping.focus_end,
+                            "ai_review_expression": mapping.ai_review_expression,
+                            "is_partial": bool(mapping.is_partial)
+                        }
+                        for mapping in sorted(mappings_by_id[sentence.sentence_id], key=lambda m: m.focus_start)
+                    ]
+                }})
+            events.append({"event": "done", "data": job})
+        else:
+            events.append({"event": "failed", "data": {"status": job['status'], "error": job['error']}})
+        return events
+
+    def _job_progress_recorder(self, job_id: str) -> Callable[[int, Optional[SynonymExpansionResult]], None]:
+        """每完成（或失败）一个句子就更新一次任务进度"""
+        progress = {"processed": 0, "failed": 0}
+
+        def record(index: int, result: Optional[SynonymExpansionResult]) -> None:
+            progress["processed"] += 1
+            if result is None:
+                progress["failed"] += 1
+                get_event_broker().publish(job_id, {"event": "sentence", "data": {"index": index, "failed": True}})
+            else:
+                # 句子一完成就推送它的 mapping，前端不用等整篇作文
+                get_event_broker().publish(job_id, {"event": "sentence", "data": {
+                    "index": index,
+                    "sentence": result.original,
+                    "mappings": self._build_mapping_rows(result)
+                }})
+            try:
+                self.essay_job_repository.update_progress(job_id, progress["processed"], progress["failed"])
+            except Exception as e:
+                logger.error(f"Error updating progress of essay job {job_id}: {str(e)}")
+
+        return record
 
     async def _handle_image_upload(self, image: Optional[UploadFile]) -> Optional[str]:
         """Handle image upload and return the URL of the uploaded image."""
@@ -74,55 +429,187 @@ class EssayService:
             logger.error(f"Error uploading image: {str(e)}")
             return None
 
-    def process_essay(self, essay: Essay, session: Session):
-        self.segmentation_service.validate_essay(essay.content)
-        
-        # 1. 分句并创建 Sentence 对象
-        sentences = self.segmentation_service.split_into_sentences(essay.content)
-        sentence_objects = []
-        
-        for sentence_text in sentences:
-            sentence = Sentence(sentence=sentence_text)
-            session.add(sentence)
-            
-            # 创建 EssaySentence 关联
-            essay_sentence = EssaySentence(essay=essay, sentence=sentence)
-            session.add(essay_sentence)
-            
-            sentence_objects.append(sentence)
-        
-        # 刷新 session 以获取生成的 ID
-        session.flush()
-        
-        # 2. 分词并创建 ActiveMapping 对象
-        for sentence in sentence_objects:
-            segmentationResult = self.segmentation_service.segment_sentence(sentence.sentence)
-            current_position = 0
-            for word_info in segmentationResult.words:
-                focus_start, focus_end = self._get_word_position(word_info, segmentationResult.original, current_position)
-                current_position = focus_end  # 更新当前位置
-                cleaned_words = [
-                    word.replace('(', '')
-                        .replace(')', '')
-                        .replace('（', '')
-                        .replace('）', '')
-                        .replace('"', '')
-                        .replace('"', '')
-                        .replace('"', '')
-                    for word in word_info.english
-                ]
+    def process_essay(self, essay: Essay, session: Session,
+                      on_sentence_done: Optional[Callable[[int, Optional[SynonymExpansionResult]], None]] = None):
+        """先算完整篇作文的分词结果，再写入 session；session 在写入前不会占用数据库连接"""
+        sentences, segmentation_results = self.segment_essay(essay.content, on_sentence_done)
+        self.persist_segmentation(essay.essay_id, sentences, segmentation_results, session)
+
+    def segment_essay(self, content: str,
+                      on_sentence_done: Optional[Callable[[int, Optional[SynonymExpansionResult]], None]] = None
+                      ) -> Tuple[List[str], List[Optional[SynonymExpansionResult]]]:
+        """
+        分句并整篇作文分词（命中缓存的句子不再调用 LLM），不涉及作文相关的表，调用期间不需要持有数据库连接
+        返回句子和按句子顺序排列的结果，失败的句子结果为 None
+
+        设置了 ESSAY_DEADLINE_SECONDS 时整篇作文在这个时间内返回：快到截止时间时跳过同义词扩展和词形变换，
+        这些句子的结果 partial 为 True
+        """
+        self.segmentation_service.validate_essay(content)
+        sentences = self.segmentation_service.split_into_sentences(content)
+        with deadline(float(os.getenv("ESSAY_DEADLINE_SECONDS", "0"))):
+            return sentences, self.segment_with_cache(sentences, on_sentence_done)
+
+    def persist_segmentation(self, essay_id: int, sentences: List[str],
+                             segmentation_results: List[Optional[SynonymExpansionResult]], session: Session) -> None:
+        """
+        在调用方的事务里写入句子、作文与句子的关联和 ActiveMapping：句子一条 upsert，关联一条 INSERT，
+        整篇作文的 mapping 一条 INSERT（很多时用 COPY），语句数不随作文长度增加
+        """
+        sentence_ids = self.sentence_repository.upsert_for_essay(essay_id, sentences, session)
+        # 其他作文里出现过、已经有 mapping 的句子不再重复写入
+        existing_ids = [sentence_id for sentence_id, inserted in sentence_ids.values() if not inserted]
+        mapped_ids = self.active_mapping_repository.get_mapped_sentence_ids(existing_ids, session)
+        # 已有的 mapping 不完整、这次得到了完整结果的句子，替换掉旧的 mapping
+        partial_ids = self.active_mapping_repository.get_partial_sentence_ids(list(mapped_ids), session)
+
+        rows = []
+        replaced_ids, replaced_rows = [], []
+        for sentence, segmentationResult in zip(sentences, segmentation_results):
+            # 分词失败的句子没有 mapping，不影响其他句子
+            if segmentationResult is None:
+                continue
+            sentence_id = sentence_ids[sentence][0]
+            if sentence_id in partial_ids and not segmentationResult.partial:
+                partial_ids.discard(sentence_id)
+                replaced_ids.append(sentence_id)
+                replaced_rows.extend(self.build_mapping_insert_rows(sentence_id, segmentationResult))
+                continue
+            # 同一篇作文里重复的句子只写一次
+            if sentence_id in mapped_ids:
+                continue
+            mapped_ids.add(sentence_id)
+            rows.extend(self.build_mapping_insert_rows(sentence_id, segmentationResult))
+        self.active_mapping_repository.insert_many(rows, session)
+        self.active_mapping_repository.replace_for_sentences(replaced_ids, replaced_rows, session)
+
+    def build_mapping_insert_rows(self, sentence_id: int, segmentationResult: SynonymExpansionResult) -> List[dict]:
+        """一个句子要写入 active_mappings 的行（ActiveMappingRepository.insert_many 的格式）"""
+        return [
+            {
+                "sentence_id": sentence_id,
+                "focus_start": row["focus_start"],
+                "focus_end": row["focus_end"],
+                "chinese": row["chinese"],
+                "user_expression": "",
+                "ai_review_is_correct": None,
+                "ai_review_expression": row["ai_review_expression"],
+                "is_partial": row["is_partial"],
+                "is_deleted": False
+            }
+            for row in self._build_mapping_rows(segmentationResult)
+        ]
+
+    def _build_mapping_rows(self, segmentationResult: SynonymExpansionResult) -> List[dict]:
+        """把一个句子的分词结果转换成 mapping 的字段"""
+        rows = []
+        current_position = 0
+        for word_info in segmentationResult.words:
+            focus_start, focus_end = self._get_word_position(word_info, segmentationResult.original, current_position)
+            current_position = focus_end  # 更新当前位置
+            cleaned_words = [
+                word.replace('(', '')
+                    .replace(')', '')
+                    .replace('（', '')
+                    .replace('）', '')
+                    .replace('"', '')
+                    .replace('"', '')
+                    .replace('"', '')
+                for word in word_info.english
+            ]
+            rows.append({
+                "chinese": word_info.chinese,
+                "focus_start": focus_start,
+                "focus_end": focus_end,
                 # 用逗号连接所有单词
-                english_str = ','.join(cleaned_words)
-                active_mapping = ActiveMapping(
-                    sentence=sentence,
-                    focus_start=focus_start,
-                    focus_end=focus_end,
-                    chinese=word_info.chinese,
-                    user_expression="",
-                    ai_review_is_correct=None,
-                    ai_review_expression=english_str
-                )
-                session.add(active_mapping)
+                "ai_review_expression": ','.join(cleaned_words),
+                "is_partial": segmentationResult.partial
+            })
+        return rows
+
+    def segment_with_cache(self, sentences: List[str],
+                            on_sentence_done: Optional[Callable[[int, Optional[SynonymExpansionResult]], None]] = None
+                            ) -> List[Optional[SynonymExpansionResult]]:
+        """
+        先查分词缓存，只有未命中的句子才走 LLM 流水线，算出来的结果写回缓存；
+        失败的句子结果为 None，每个句子完成时回调 on_sentence_done(句子在作文中的序号, 结果)
+
+        未命中的句子经过 sentence_flight：其他作文（或重试的请求）正在处理的相同句子不再重复计算，
+        算完自己的句子后等待并复用它们的结果；开启 NEAR_DUPLICATE_ENABLED 时，和已缓存句子几乎相同的句子
+        复用它没有修改的词，只把修改过的片段交给 LLM
+        """
+        version = self.segmentation_service.pipeline_version()
+        with pipeline_metrics.stage("cache_lookup"):
+            results = self.segmentation_cache.get_many(sentences, version)
+
+        positions = {}
+        for index, sentence in enumerate(sentences):
+            positions.setdefault(sentence, []).append(index)
+            if sentence in results and on_sentence_done:
+                on_sentence_done(index, results[sentence])
+
+        # 同一篇作文里重复的句子只算一次
+        misses = list(dict.fromkeys(sentence for sentence in sentences if sentence not in results))
+        logger.info(f"Segmentation cache: {len(results)} hits, {len(misses)} misses, totals {SegmentationCache.stats()}")
+        if misses:
+            claims = {sentence: sentence_flight.claim((sentence, version)) for sentence in misses}
+            owned = [sentence for sentence in misses if claims[sentence][1]]
+            shared = [sentence for sentence in misses if not claims[sentence][1]]
+
+            def miss_done(owned_index: int, result: Optional[SynonymExpansionResult]) -> None:
+                if on_sentence_done:
+                    for index in positions[owned[owned_index]]:
+                        on_sentence_done(index, result)
+
+            computed = {}
+            try:
+                if owned:
+                    neighbours = self._near_duplicate_neighbours(owned, version)
+                    computed = dict(zip(owned, self.segmentation_service.segment_sentences(owned, miss_done, neighbours)))
+                    # 不完整的结果不进缓存，否则之后命中缓存的句子永远没有同义词
+                    cacheable = {sentence: result for sentence, result in computed.items()
+                                 if result is not None and not result.partial}
+                    self.segmentation_cache.put_many(cacheable, version)
+                    if self.segmentation_service.near_duplicate:
+                        near_duplicate_index.add_many(list(cacheable), version)
+            finally:
+                # 写入缓存之后再交出结果，之后到达的相同句子直接命中缓存；流水线出错时等待方按失败处理
+                for sentence in owned:
+                    sentence_flight.resolve((sentence, version), computed.get(sentence))
+
+            if shared:
+                logger.info(f"Waiting for {len(shared)} sentences already being segmented by other requests")
+            for sentence in shared:
+                try:
+                    computed[sentence] = claims[sentence][0].result()
+                except Exception as e:
+                    logger.error(f"Shared segmentation of sentence failed: {str(e)}")
+                    computed[sentence] = None
+                if on_sentence_done:
+                    for index in positions[sentence]:
+                        on_sentence_done(index, computed[sentence])
+            results.update(computed)
+
+        return [results[sentence] for sentence in sentences]
+
+    def _near_duplicate_neighbours(self, sentences: List[str], version: str
+                                   ) -> Dict[str, Tuple[str, SynonymExpansionResult]]:
+        """在相似句子索引里为每个句子找一个已缓存、结果完整的相似句子，返回 句子 -> (相似句子, 它的分词结果)"""
+        if not self.segmentation_service.near_duplicate:
+            return {}
+        # 索引还在后台建立时按没有相似句子处理，不等待
+        if not near_duplicate_index.ensure_loaded(version):
+            return {}
+        with pipeline_metrics.stage("near_duplicate_lookup"):
+            matches = {sentence: near_duplicate_index.find(sentence) for sentence in sentences}
+            matches = {sentence: neighbour for sentence, neighbour in matches.items() if neighbour is not None}
+            if not matches:
+                return {}
+            cached = self.segmentation_cache.get_many(list(set(matches.values())), version)
+        neighbours = {sentence: (neighbour, cached[neighbour]) for sentence, neighbour in matches.items()
+                      if neighbour in cached and not cached[neighbour].partial}
+        logger.info(f"Near-duplicate index: {len(neighbours)} of {len(sentences)} sentences reuse a similar sentence")
+        return neighbours
 
     def enter_study_mode(self, essay_id: int):
         essay = self.essay_repository.get_essay_by_id(essay_id)
@@ -132,20 +619,18 @@ class EssayService:
         return "test"
 
     def process_essay_transaction(self, essay: Essay):
+        sentences, segmentation_results = self.segment_essay(essay.content)
         with db_manager.session_scope() as session:
-            self.process_essay(essay, session)
+            self.persist_segmentation(essay.essay_id, sentences, segmentation_results, session)
 
-    # 获取单词在 original_text 中的位置 todo：目前的正则方案和 ai 方案效果都不是完美的
+    # 获取单词在 original_text 中的位置：分词结果的 start/len 已经在本地对齐过，只在对不上原文时重新对齐
     def _get_word_position(self, word_info, original_text: str, current_position: int) -> tuple[int, int]:
-        # 正则方案
-        word_match = re.search(r'\d+:(\d+)', original_text[current_position:])
-        if word_match:
-            focus_start = int(word_match.group(1)) + current_position
-            focus_end = focus_start + len(word_info.chinese)
-        # AI 方案
-        else:
-            focus_start = word_info.start
-            focus_end = word_info.start + word_info.len
+        focus_start = word_info.start
+        focus_end = word_info.start + word_info.len
+        if original_text[focus_start:focus_end] != word_info.chinese:
+            position = offset_aligner.align_one(original_text, word_info.chinese, current_position)
+            if position:
+                focus_start, focus_end = position[0], position[0] + position[1]
 
         return focus_start, focus_end
 
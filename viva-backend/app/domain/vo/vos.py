@@ -25,6 +25,8 @@ class MappingVO(BaseModel):
     ai_review: Optional[AiReviewVO] = None
     checkingAI: bool = False
     usage_history: List[UsageHistory]
+    # 同义词扩展被跳过、ai_review 里只有基本译词时为 True，后台补全后会变成 False
+    is_partial: bool = False
 
 class SentenceVO(BaseModel):
     sentence: str
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# CC-CEDICT 每一行的格式：繁体 简体 [pin1 yin1] /释义1/释义2/
+_LINE = re.compile(r'^(\S+)\s+(\S+)\s+\[([^\]]*)\]\s+/(.*)/\s*$')
+
+
+class CedictService:
+    """
+    离线汉英词典（CC-CEDICT 格式），文件路径来自环境变量 CEDICT_FILE；
+    第一次使用时把整个文件读进内存，按简体和繁体词头建立索引
+    """
+    # 静态类属性
+    _entries: Dict[str, List[str]] = {}
+    _version: str = ""
+    _is_initialized: bool = False
+    _lock = threading.Lock()
+
+    @classmethod
+    def _initialize(cls) -> None:
+        """加载词典（仅在第一次使用时加载）"""
+        with cls._lock:
+            if cls._is_initialized:
+                return
+            file_path = cls._file_path()
+            if file_path is None:
+                raise FileNotFoundError("CEDICT_FILE 未设置")
+
+            entries: Dict[str, List[str]] = {}
+            try:
+                with open(file_path, 'r', encoding='utf-8') as file:
+                    for line in file:
+                        if line.startswith('#'):
+                            continue
+                        match = _LINE.match(line.strip())
+                        if not match:
+                            continue
+                        traditional, simplified, _, glosses = match.groups()
+                        glosses = [gloss.strip() for gloss in glosses.split('/') if gloss.strip()]
+                        # 同一个词头可能有多个读音，释义合并在一起
+                        entries.setdefault(simplified, []).extend(glosses)
+                        if traditional != simplified:
+                            entries.setdefault(traditional, []).extend(glosses)
+            except FileNotFoundError:
+                raise FileNotFoundError(f"词典文件未找到: {file_path}")
+
+            stat = file_path.stat()
+            cls._entries = entries
+            cls._version = hashlib.sha256(f"{file_path.name}:{stat.st_size}:{stat.st_mtime}".encode("utf-8")).hexdigest()[:12]
+            cls._is_initialized = True
+
+    @staticmethod
+    def _file_path() -> Optional[Path]:
+        path = os.getenv("CEDICT_FILE")
+        return Path(path) if path else None
+
+    @classmethod
+    def is_available(cls) -> bool:
+        """是否配置了词典文件并且文件存在"""
+        file_path = cls._file_path()
+        return file_path is not None and file_path.is_file()
+
+    @classmethod
+    def ensure_loaded(cls) -> None:
+        if not cls._is_initialized:
+            cls._initialize()
+
+    @classmethod
+    def lookup(cls, word: str) -> List[str]:
+        """查询一个中文词的全部英文释义，没有收录时返回空列表
+
+        Args:
+            word: 简体或繁体中文词
+
+        Returns:
+            List[str]: 词典里的原始释义，按词典中的顺序
+        """
+        cls.ensure_loaded()
+        return cls._entries.get(word, [])
+
+    @classmethod
+    def version(cls) -> str:
+        """词典文件的版本（文件名、大小和修改时间的哈希），用于流水线版本号"""
+        cls.ensure_loaded()
+        return cls._version
@@ -0,0 +1,209 @@
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Set
+
+from nltk.corpus import wordnet as wn
+
+from infrastructure.english.word_net import WordNetService
+
+# 词形
+BASE = "base"
+PLURAL = "plural"
+THIRD_PERSON = "third_person"
+PRESENT_PARTICIPLE = "present_participle"
+# 规则动词的过去式和过去分词相同，只从原词无法区分时用这个
+PAST = "past"
+COMPARATIVE = "comparative"
+SUPERLATIVE = "superlative"
+
+_VOWELS = "aeiou"
+
+# 常见的不可数名词，没有复数形式（informations），交给 LLM 决定怎么表达
+_MASS_NOUNS = frozenset({
+    "advice", "baggage", "bread", "clothing", "equipment", "evidence", "feedback", "furniture", "garbage",
+    "homework", "housework", "information", "knowledge", "luggage", "machinery", "money", "music", "news",
+    "patience", "permission", "pollution", "progress", "research", "rice", "scenery", "software", "stuff",
+    "traffic", "transportation", "trash", "weather", "wealth", "water", "work",
+})
+# 通常不可数的抽象名词后缀（kindness、hardware、socialism）
+_MASS_NOUN_SUFFIXES = ("ness", "ware", "ism")
+
+
+class InflectionService:
+    """
+    本地的英语词形变化：先判断原词相对于原型是什么形式（复数、过去式、-ing、比较级……），
+    再把同义词变成同样的形式。不规则变化来自 WordNet 的 exception 列表，规则变化按英语构词规则；
+    无法确定的（如不规则动词的过去式/过去分词、多音节词的辅音双写、不可数名词的复数、
+    多音节形容词和分词形容词的比较级）返回 None，交给 LLM
+    """
+    # 静态类属性：原型 -> 不规则变化形式
+    _irregular_forms: Dict[str, Dict[str, Set[str]]] = {}
+    _is_initialized: bool = False
+
+    @classmethod
+    def _initialize(cls) -> None:
+        """反转 WordNet 的 exception 列表（仅在第一次使用时加载）"""
+        if cls._is_initialized:
+            return
+        wn.ensure_loaded()
+        irregular_forms = {}
+        for pos in ('n', 'v', 'a', 'r'):
+            forms = defaultdict(set)
+            for inflected, bases in wn._exception_map[pos].items():
+                for base in bases:
+                    forms[base].add(inflected)
+            irregular_forms[pos] = dict(forms)
+        cls._irregular_forms = irregular_forms
+        cls._is_initialized = True
+
+    @classmethod
+    def is_irregular(cls, word: str, pos: str) -> bool:
+        cls._initialize()
+        return word.lower() in wn._exception_map.get(pos, {})
+
+    @classmethod
+    def detect_form(cls, word: str, pos: str) -> Optional[str]:
+        """判断原词的形式，无法判断时返回 None"""
+        cls._initialize()
+        lemma = WordNetService.get_word_lemma(word.lower(), pos)
+        word = word.lower()
+        if lemma == word:
+            return BASE
+
+        if pos == 'n':
+            return PLURAL
+        if pos == 'v':
+            if word.endswith('ing'):
+                return PRESENT_PARTICIPLE
+            if cls.inflect(lemma, pos, THIRD_PERSON) == word:
+                return THIRD_PERSON
+            if cls.is_irregular(word, pos) or word.endswith('ed'):
+                return PAST
+            return None
+        if pos == 'a':
+            if word.endswith('st'):
+                return SUPERLATIVE
+            if word.endswith('er') or cls.is_irregular(word, pos):
+                return COMPARATIVE
+            return None
+        return None
+
+    @classmethod
+    def inflect(cls, lemma: str, pos: str, form: str) -> Optional[str]:
+        """把原型变成指定形式，规则无法确定时返回 None；WordNet 的多词短语（look_after）只变化核心词"""
+        cls._initialize()
+        if form == BASE:
+            return lemma
+
+        parts = lemma.split('_')
+        if len(parts) > 1:
+            if pos == 'v':
+                head = cls.inflect(parts[0], pos, form)
+                return '_'.join([head] + parts[1:]) if head else None
+            if pos == 'n':
+                head = cls.inflect(parts[-1], pos, form)
+                return '_'.join(parts[:-1] + [head]) if head else None
+            return None
+
+        irregular = cls._irregular_forms.get(pos, {}).get(lemma.lower(), set())
+        if form == PLURAL and not irregular and cls._is_mass_noun(lemma):
+            return None
+        if form in (PLURAL, THIRD_PERSON):
+            candidates = {w for w in irregular if w.endswith('s')} if form == THIRD_PERSON else irregular
+            if len(candidates) == 1:
+                return next(iter(candidates))
+            if len(candidates) > 1:
+                return None
+            return cls._add_s(lemma)
+        if form == PRESENT_PARTICIPLE:
+            return cls._add_suffix(lemma, 'ing')
+        if form == PAST:
+            past_forms = {w for w in irregular if not w.endswith('s') and not w.endswith('ing')}
+            # 只有一个不规则形式时过去式和过去分词相同（taught），多个时无法区分（went/gone）
+            if len(past_forms) == 1:
+                return next(iter(past_forms))
+            if past_forms:
+                return None
+            # put、hit、cut 这类过去式和原形相同的动词不在 exception 列表里，t/d 结尾的无法确定是否规则
+            if re.search(r'[td]$', lemma):
+                return None
+            return cls._add_suffix(lemma, 'ed')
+        if form in (COMPARATIVE, SUPERLATIVE):
+            suffix = 'er' if form == COMPARATIVE else 'est'
+            candidates = {w for w in irregular if w.endswith('st') == (form == SUPERLATIVE)}
+            if len(candidates) == 1:
+                return next(iter(candidates))
+            if candidates:
+                return None
+            # 只有单音节和辅音加 y 结尾的双音节形容词加 -er/-est（big、happy），
+            # 其他（famous、boring、tired）用 more/most，交给 LLM
+            if cls._is_participial(lemma):
+                return None
+            syllables = cls._syllables(lemma)
+            if syllables == 1 or (syllables == 2 and re.search(r'[^aeiou]y$', lemma)):
+                return cls._add_suffix(lemma, suffix)
+            return None
+        return None
+
+    @classmethod
+    def transform_like(cls, word: str, pos: str, synonyms: List[str]) -> List[Optional[str]]:
+        """把同义词变成和 word 相同的形式，无法本地确定的位置为 None"""
+        form = cls.detect_form(word, pos)
+        if form is None:
+            return [None] * len(synonyms)
+        return [cls.inflect(synonym, pos, form) for synonym in synonyms]
+
+    @staticmethod
+    def _is_mass_noun(word: str) -> bool:
+        word = word.lower()
+        return word in _MASS_NOUNS or word.endswith(_MASS_NOUN_SUFFIXES)
+
+    @staticmethod
+    def _is_participial(word: str) -> bool:
+        """-ing、-ed 结尾的分词形容词（boring、interested），不包括 red 这类短词"""
+        word = word.lower()
+        return (word.endswith('ing') and len(word) > 4) or (word.endswith('ed') and len(word) > 3)
+
+    @staticmethod
+    def _add_s(word: str) -> str:
+        if re.search(r'(s|x|z|ch|sh)$', word):
+            return word + 'es'
+        if re.search(r'[^aeiou]y$', word):
+            return word[:-1] + 'ies'
+        return word + 's'
+
+    @classmethod
+    def _add_suffix(cls, word: str, suffix: str) -> Optional[str]:
+        """加 -ing/-ed/-er/-est，处理去 e、y 变 i 和辅音双写"""
+        if suffix == 'ing':
+            if word.endswith('ie'):
+                return word[:-2] + 'ying'
+            if word.endswith('e') and not re.search(r'(ee|ye|oe)$', word):
+                return word[:-1] + 'ing'
+        else:
+            if word.endswith('e'):
+                return word + suffix[1:]
+            if re.search(r'[^aeiou]y$', word):
+                return word[:-1] + 'i' + suffix
+
+        if re.search(r'[^aeiou][aeiou][^aeiouwxy]$', word):
+            # 单音节的辅音-元音-辅音结尾要双写（stop -> stopped），多音节取决于重音，无法确定
+            if cls._syllables(word) == 1:
+                return word + word[-1] + suffix
+            return None
+        return word + suffix
+
+    @staticmethod
+    def _syllables(word: str) -> int:
+        groups = re.findall(r'[aeiouy]+', word.lower())
+        count = len(groups)
+        if word.lower().endswith('e') and count > 1 and not word.lower().endswith('le'):
+            count -= 1
+        return max(count, 1)
+
+
+if __name__ == "__main__":
+    print(InflectionService.transform_like("playing", "v", ["run", "swim", "make"]))
+    print(InflectionService.transform_like("dogs", "n", ["cat", "box", "city", "child"]))
+    print(InflectionService.transform_like("decided", "v", ["settle", "stop", "go"]))
+    print(InflectionService.transform_like("bigger", "a", ["large", "happy", "good"]))
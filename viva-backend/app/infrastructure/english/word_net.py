@@ -2,7 +2,7 @@ import os
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from nltk.corpus import wordnet as wn
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 from collections import defaultdict
 import textwrap
 from nltk.stem import WordNetLemmatizer
@@ -12,8 +12,16 @@ from langchain.prompts import ChatPromptTemplate
 from pydantic import Field
 from pydantic import BaseModel
 import json
+import logging
+import threading
+from infrastructure.text.prompt_registry import prompt_registry, WORDNET_PROMPT1, WORDNET_PROMPT2
+from infrastructure.text_processing.pipeline_metrics import stage
+from infrastructure.text_processing.micro_batcher import MicroBatcher, batching_enabled, create_batcher
+from infrastructure.text_processing.deadline import check_optional_stage
 
 load_dotenv()
+# 获取 logger
+logger = logging.getLogger(__name__)
 
 
 class Input(BaseModel):
@@ -25,6 +33,11 @@ class Synset(BaseModel):
     definition : str = Field(description="the definition of the synset")
 class ChooseSynsetOutput(BaseModel):
     synsets : List[Synset]
+class WordSynsetChoice(BaseModel):
+    id : int = Field(description="the id of the word I give you")
+    synsets : List[Synset]
+class BatchChooseSynsetOutput(BaseModel):
+    words : List[WordSynsetChoice] = Field(description="one result for every word I give you")
 
 
 class WordNetService:
@@ -43,8 +56,17 @@ class WordNetService:
     _llm = ChatOpenAI(model = os.getenv("LLM_MODEL_NAME_FOR_BASIC_CHAT")
                                      , temperature=0.4, openai_api_key=os.getenv("OPENAI_API_KEY")) 
     _parser1 = PydanticOutputParser(pydantic_object=ChooseSynsetOutput)
+    _parser2 = PydanticOutputParser(pydantic_object=BatchChooseSynsetOutput)
+    # 跨作文合并 synset 选择请求的批处理器，第一次使用时创建
+    _synset_batcher: MicroBatcher = None
+    _batcher_lock = threading.Lock()
     
     
+    @staticmethod
+    def ensure_loaded() -> None:
+        """WordNet 语料是懒加载的，并发首次访问时可能出错，多线程使用前先加载好"""
+        wn.ensure_loaded()
+
     @staticmethod
     def get_word_lemma(word: str, pos: str = "n") -> str:
         """获取单词的原型  decided -> decide """
@@ -129,13 +151,7 @@ class WordNetService:
     def get_synonyms_by_context(word: str, pos: str = None, context: str = None) -> set:
         """根据单词和所在语境，找到对应的 synset，以及里面的 synonyms """
         synsets = wn.synsets(word, pos=pos) if pos else wn.synsets(word)
-        prompt_file = os.getenv("WORDNET_PROMPT_FILE1")
-        if not prompt_file:
-            raise ValueError("SEGMENT_PROMPT_FILE is not set in environment variables.")
-        
-        with open(prompt_file, "r") as file:
-            prompt_template = file.read()
-        prompt = ChatPromptTemplate.from_template(prompt_template)
+        prompt = prompt_registry.template(WORDNET_PROMPT1, WordNetService._parser1)
 
         # 将 synsets 信息转换为字符串
         synsets_str = json.dumps([
@@ -147,37 +163,130 @@ class WordNetService:
             for synset in synsets
         ], indent=2)
 
-        print("synsets_str: ", synsets_str)  # 用于调试
-        
+        logger.debug(f"Synsets of '{word}': {synsets_str}")
+
         messages = prompt.format_messages(
             word=word,
             context=context,
-            synsets=str(synsets_str),
-            format_instructions=WordNetService._parser1.get_format_instructions()
+            synsets=str(synsets_str)
         )
 
-        try:
-            llm_response = WordNetService._llm.invoke(messages)
-            output = WordNetService._parser1.parse(llm_response.content)
-            synonyms = set()
-            print("output: ", output)
-            for synset in output.synsets:
-                synset_name = synset.synset_name    
-                original_stem = WordNetService.get_word_stem(word)
-
-                synset = wn.synset(synset_name)
-                for lemma in synset.lemmas():
-                    synonym = lemma.name()
-                    # 如果词干相同但不是完全相同的词，则跳过
-                    if WordNetService.get_word_stem(synonym) == original_stem:
-                        continue
-                    synonyms.add(synonym)
-            
-            return synonyms
-        except Exception as e:
-            print(f"Error processing response: {e}")
-            print(f"Response content: {llm_response.content}")
-            return set()
+        with stage("synset_single") as recorder:
+            try:
+                output = recorder.invoke(WordNetService._llm, messages, WordNetService._parser1)
+                logger.debug(f"Chosen synsets of '{word}': {output}")
+                return WordNetService._synonyms_from_synsets(word, [synset.synset_name for synset in output.synsets])
+            except Exception as e:
+                logger.error(f"Error in choosing synsets for '{word}': {str(e)}")
+                recorder.fail()
+                return set()
+
+    @staticmethod
+    def get_synonyms_by_context_batch(words: List[Tuple[str, str]], context: str) -> List[set]:
+        """
+        get_synonyms_by_context 的批量版本：同一句话里的所有词共用一个语境，一次请求选出所有词的 synset；
+        开启动态批处理时，同一时刻其他作文的句子也会合并进同一个请求；
+        离请求的截止时间太近时不再调用 LLM，抛出 DeadlineExceeded
+        """
+        check_optional_stage("synonyms")
+        items = [(word, pos, context) for word, pos in words]
+        if batching_enabled():
+            return WordNetService.get_synset_batcher().submit(items)
+        return WordNetService.get_synonyms_by_contexts_batch(items)
+
+    @staticmethod
+    def get_synset_batcher() -> MicroBatcher:
+        with WordNetService._batcher_lock:
+            if WordNetService._synset_batcher is None:
+                WordNetService._synset_batcher = create_batcher(
+                    "synset", WordNetService._process_synset_batch)
+            return WordNetService._synset_batcher
+
+    @staticmethod
+    def _process_synset_batch(requests: List[List[Tuple[str, str, str]]]) -> List[List[set]]:
+        """把多个句子的词拼成一个请求，再按每个句子的词数拆回去"""
+        results = WordNetService.get_synonyms_by_contexts_batch([item for request in requests for item in request])
+        split_results = []
+        offset = 0
+        for request in requests:
+            split_results.append(results[offset:offset + len(request)])
+            offset += len(request)
+        return split_results
+
+    @staticmethod
+    def get_synonyms_by_contexts_batch(items: List[Tuple[str, str, str]]) -> List[set]:
+        """
+        批量根据语境选择 synset：items 为 (单词, 词性, 语境) 列表，相同语境的词在 prompt 里合并成一组，
+        返回与 items 一一对应的同义词集合；某个词的结果缺失或不合法时单独再调用一次 get_synonyms_by_context
+        """
+        results = [set() for _ in items]
+        groups = {}
+        candidates = {}
+        for i, (word, pos, context) in enumerate(items):
+            synsets = wn.synsets(word, pos=pos) if pos else wn.synsets(word)
+            # 没有候选 synset 的词不需要问 LLM
+            if not synsets:
+                continue
+            candidates[i] = {synset.name() for synset in synsets}
+            groups.setdefault(context, []).append({
+                "id": i,
+                "word": word,
+                "synsets": [
+                    {
+                        "name": synset.name(),
+                        "definition": synset.definition(),
+                        "lemmas": [lemma.name() for lemma in synset.lemmas()]
+                    }
+                    for synset in synsets
+                ]
+            })
+        if not candidates:
+            return results
+
+        groups_str = json.dumps([{"context": context, "words": words} for context, words in groups.items()],
+                                ensure_ascii=False, indent=2)
+        prompt = prompt_registry.template(WORDNET_PROMPT2, WordNetService._parser2)
+        messages = prompt.format_messages(groups=groups_str)
+
+        choices = {}
+        with stage("synset_batch") as recorder:
+            try:
+                output = recorder.invoke(WordNetService._llm, messages, WordNetService._parser2)
+                choices = {choice.id: [synset.synset_name for synset in choice.synsets] for choice in output.words}
+            except Exception as e:
+                logger.error(f"Error in batch choosing synsets: {str(e)}")
+                recorder.fail()
+            # 只接受该词自己的候选 synset，否则单独重试
+            retry_ids = {
+                i for i, synset_names in candidates.items()
+                if not choices.get(i) or not set(choices[i]) <= synset_names
+            }
+            recorder.retry(len(retry_ids))
+
+        for i, synset_names in candidates.items():
+            word, pos, context = items[i]
+            chosen = choices.get(i)
+            if i in retry_ids:
+                logger.warning(f"Batch synset choice missing or invalid for '{word}', retrying alone")
+                results[i] = WordNetService.get_synonyms_by_context(word, pos, context)
+            else:
+                results[i] = WordNetService._synonyms_from_synsets(word, chosen)
+        return results
+
+    @staticmethod
+    def _synonyms_from_synsets(word: str, synset_names: List[str]) -> set:
+        """取出所选 synset 里的同义词，排除原词的其他形式"""
+        synonyms = set()
+        original_stem = WordNetService.get_word_stem(word)
+        for synset_name in synset_names:
+            synset = wn.synset(synset_name)
+            for lemma in synset.lemmas():
+                synonym = lemma.name()
+                # 如果词干相同但不是完全相同的词，则跳过
+                if WordNetService.get_word_stem(synonym) == original_stem:
+                    continue
+                synonyms.add(synonym)
+        return synonyms
     
     @staticmethod
     def get_synsets(word: str, pos: str = None) -> List[str]:
@@ -1,11 +1,19 @@
 # infrastructure/repositories/active_mapping_repository.py
 
-from typing import List, Optional
+import csv
+import io
+from typing import Dict, List, Optional, Set
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 from domain.entities.entities import ActiveMapping
 from infrastructure.repositories.database_manager import db_manager
 from sqlalchemy.dialects.postgresql import insert
 
+# 超过这个行数时用 COPY 写入，否则用一条多行 INSERT
+COPY_THRESHOLD = 2000
+_INSERT_COLUMNS = ['sentence_id', 'focus_start', 'focus_end', 'chinese', 'user_expression',
+                   'ai_review_is_correct', 'ai_review_expression', 'is_partial', 'is_deleted']
+
 class ActiveMappingRepository:
     def create(self, active_mapping: ActiveMapping) -> ActiveMapping:
         with db_manager.session_scope() as session:
@@ -53,6 +61,90 @@ class ActiveMappingRepository:
                 return True
             return False
 
+    def get_mapped_sentence_ids(self, sentence_ids: List[int], session: Session) -> Set[int]:
+        """这些句子中已经有 mapping 的句子 id"""
+        if not sentence_ids:
+            return set()
+        stmt = select(ActiveMapping.sentence_id).where(
+            ActiveMapping.sentence_id.in_(sentence_ids),
+            ActiveMapping.is_deleted == False
+        ).distinct()
+        return set(session.execute(stmt).scalars())
+
+    def get_partial_sentence_ids(self, sentence_ids: List[int], session: Session) -> Set[int]:
+        """这些句子中 mapping 还不完整（跳过了同义词扩展，等待后台补全）的句子 id"""
+        if not sentence_ids:
+            return set()
+        stmt = select(ActiveMapping.sentence_id).where(
+            ActiveMapping.sentence_id.in_(sentence_ids),
+            ActiveMapping.is_deleted == False,
+            ActiveMapping.is_partial == True
+        ).distinct()
+        return set(session.execute(stmt).scalars())
+
+    def insert_many(self, rows: List[dict], session: Session) -> int:
+        """
+        在调用方的事务里一次写入多条 mapping（字段见 _INSERT_COLUMNS），不回读插入的行；
+        行数很多时用 COPY，避免超过单条语句的参数个数上限
+        """
+        if not rows:
+            return 0
+        if len(rows) > COPY_THRESHOLD:
+            self._copy_rows(rows, session)
+        else:
+            session.execute(insert(ActiveMapping.__table__).values(
+                [{column: row[column] for column in _INSERT_COLUMNS} for row in rows]
+            ))
+        return len(rows)
+
+    def replace_for_sentences(self, sentence_ids: List[int], rows: List[dict], session: Session) -> int:
+        """
+        在调用方的事务里替换这些句子的 mapping：旧的 mapping 标记为删除，再写入新的 rows，
+        事务提交前其他连接看到的仍然是旧的 mapping
+
+        新 mapping 和旧 mapping 的位置和中文相同时，保留用户已经填写的 user_expression 和 ai_review_is_correct
+        """
+        if not sentence_ids:
+            return 0
+        stmt = update(ActiveMapping.__table__).where(
+            ActiveMapping.__table__.c.sentence_id.in_(sentence_ids),
+            ActiveMapping.__table__.c.is_deleted == False
+        ).values(is_deleted=True).returning(
+            ActiveMapping.__table__.c.sentence_id,
+            ActiveMapping.__table__.c.focus_start,
+            ActiveMapping.__table__.c.focus_end,
+            ActiveMapping.__table__.c.chinese,
+            ActiveMapping.__table__.c.user_expression,
+            ActiveMapping.__table__.c.ai_review_is_correct
+        )
+        previous: Dict[tuple, tuple] = {
+            (row.sentence_id, row.focus_start, row.focus_end, row.chinese): (row.user_expression, row.ai_review_is_correct)
+            for row in session.execute(stmt)
+        }
+        for row in rows:
+            kept = previous.get((row["sentence_id"], row["focus_start"], row["focus_end"], row["chinese"]))
+            if kept:
+                row["user_expression"], row["ai_review_is_correct"] = kept
+        return self.insert_many(rows, session)
+
+    def _copy_rows(self, rows: List[dict], session: Session) -> None:
+        buffer = io.StringIO()
+        # 所有字符串都加引号，空字符串不会被当成 NULL；None 也会写成 ""，由 FORCE_NULL 转回 NULL
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+        for row in rows:
+            writer.writerow([row[column] for column in _INSERT_COLUMNS])
+        buffer.seek(0)
+        # 使用当前事务的连接，COPY 和其他写入一起提交或回滚
+        cursor = session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {ActiveMapping.__tablename__} ({', '.join(_INSERT_COLUMNS)}) FROM STDIN "
+                f"WITH (FORMAT csv, FORCE_NULL (ai_review_is_correct))",
+                buffer
+            )
+        finally:
+            cursor.close()
+
     def bulk_create(self, active_mappings: List[ActiveMapping]) -> List[ActiveMapping]:
         with db_manager.session_scope() as session:
             # Prepare the values for bulk insert
@@ -0,0 +1,135 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from sqlalchemy import and_, or_, update as sql_update
+from sqlalchemy.orm import Session
+from domain.entities.entities import EssayJob, EssayJobStatus
+from infrastructure.repositories.database_manager import db_manager
+
+# 本进程的 worker 标识，领取任务时写入 essay_jobs.worker_id
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def job_lease() -> timedelta:
+    """领取任务的租约时长，每次更新进度时续期；租约过期的处理中任务视为 worker 已经退出，可以被重新领取"""
+    return timedelta(seconds=float(os.getenv("ESSAY_JOB_LEASE_SECONDS", "600")))
+
+
+class EssayJobRepository:
+    def create(self, essay_id: int, user_id: str, session: Session = None) -> dict:
+        if session:
+            return self._create(essay_id, user_id, session)
+        with db_manager.session_scope() as new_session:
+            return self._create(essay_id, user_id, new_session)
+
+    def _create(self, essay_id: int, user_id: str, session: Session) -> dict:
+        job = EssayJob(
+            job_id=str(uuid.uuid4()),
+            essay_id=essay_id,
+            user_id=user_id,
+            status=EssayJobStatus.QUEUED,
+            total_sentences=0,
+            processed_sentences=0,
+            failed_sentences=0
+        )
+        session.add(job)
+        session.flush()
+        session.refresh(job)
+        return self._job_to_dict(job)
+
+    def get_by_id(self, job_id: str) -> Optional[dict]:
+        with db_manager.session_scope() as session:
+            job = session.query(EssayJob).filter(EssayJob.job_id == job_id).first()
+            return self._job_to_dict(job) if job else None
+
+    def get_by_essay_id(self, essay_id: int) -> Optional[dict]:
+        with db_manager.session_scope() as session:
+            job = session.query(EssayJob).filter(
+                EssayJob.essay_id == essay_id
+            ).order_by(EssayJob.create_time.desc()).first()
+            return self._job_to_dict(job) if job else None
+
+    def get_unfinished(self) -> List[dict]:
+        """排队中的任务，以及租约已经过期（worker 已经退出）的处理中任务"""
+        with db_manager.session_scope() as session:
+            jobs = session.query(EssayJob).filter(self._claimable(datetime.now(timezone.utc))).order_by(
+                EssayJob.create_time).all()
+            return [self._job_to_dict(job) for job in jobs]
+
+    def claim(self, job_id: str) -> Optional[dict]:
+        """
+        用一条带条件的 UPDATE ... RETURNING 领取任务：只有排队中、或处理中但租约已经过期的任务能被领取，
+        领取后状态为处理中、worker_id 为本进程；任务已经被其他 worker 领取或已经结束时返回 None
+        """
+        now = datetime.now(timezone.utc)
+        table = EssayJob.__table__
+        with db_manager.session_scope() as session:
+            row = session.execute(sql_update(table).where(
+                table.c.job_id == job_id, self._claimable(now)
+            ).values(
+                status=EssayJobStatus.PROCESSING, worker_id=WORKER_ID, lease_expires_at=now + job_lease(),
+                started_at=now, finished_at=None, error=None
+            ).returning(*table.c)).mappings().first()
+            return dict(row) if row else None
+
+    @staticmethod
+    def _claimable(now: datetime):
+        return or_(
+            EssayJob.status == EssayJobStatus.QUEUED,
+            and_(EssayJob.status == EssayJobStatus.PROCESSING,
+                 or_(EssayJob.lease_expires_at.is_(None), EssayJob.lease_expires_at < now))
+        )
+
+    def requeue_failed(self, job_id: str) -> bool:
+        """只有失败的任务能重新排队；同时重复请求时只有一个成功，返回是否成功"""
+        table = EssayJob.__table__
+        with db_manager.session_scope() as session:
+            row = session.execute(sql_update(table).where(
+                table.c.job_id == job_id, table.c.status == EssayJobStatus.FAILED
+            ).values(
+                status=EssayJobStatus.QUEUED, error=None, finished_at=None, worker_id=None, lease_expires_at=None
+            ).returning(table.c.job_id)).first()
+            return row is not None
+
+    def mark_processing(self, job_id: str, total_sentences: int) -> None:
+        self._update(job_id, status=EssayJobStatus.PROCESSING, total_sentences=total_sentences,
+                     processed_sentences=0, failed_sentences=0, error=None,
+                     started_at=datetime.now(timezone.utc), finished_at=None)
+
+    def update_progress(self, job_id: str, processed_sentences: int, failed_sentences: int) -> None:
+        """更新进度，同时为本进程续期租约"""
+        self._update(job_id, processed_sentences=processed_sentences, failed_sentences=failed_sentences,
+                     lease_expires_at=datetime.now(timezone.utc) + job_lease())
+
+    def mark_completed(self, job_id: str, trace: Optional[dict] = None) -> None:
+        self._update(job_id, status=EssayJobStatus.COMPLETED, trace=trace, finished_at=datetime.now(timezone.utc),
+                     lease_expires_at=None)
+
+    def mark_failed(self, job_id: str, error: str, trace: Optional[dict] = None) -> None:
+        self._update(job_id, status=EssayJobStatus.FAILED, error=error, trace=trace,
+                     finished_at=datetime.now(timezone.utc), lease_expires_at=None)
+
+    def _update(self, job_id: str, **values) -> None:
+        with db_manager.session_scope() as session:
+            session.execute(sql_update(EssayJob.__table__).where(
+                EssayJob.__table__.c.job_id == job_id
+            ).values(**values))
+
+    def _job_to_dict(self, job: EssayJob) -> dict:
+        return {
+            'job_id': job.job_id,
+            'essay_id': job.essay_id,
+            'user_id': job.user_id,
+            'status': job.status,
+            'total_sentences': job.total_sentences,
+            'processed_sentences': job.processed_sentences,
+            'failed_sentences': job.failed_sentences,
+            'error': job.error,
+            'started_at': job.started_at,
+            'finished_at': job.finished_at,
+            'trace': job.trace,
+            'create_time': job.create_time,
+            'update_time': job.update_time
+        }
@@ -85,6 +85,18 @@ class EssayRepository:
         with db_manager.session_scope() as session:
             return session.query(Essay).filter(Essay.is_deleted == False).all()
 
+    def get_essay_ids_after(self, after_id: int, limit: int = 100) -> List[int]:
+        """
+        按顺序分页读取 essay_id，只返回大于 after_id 的；
+        批量处理所有作文时用这个代替 get_all_essays，不会一次把所有作文读进内存
+        """
+        with db_manager.session_scope() as session:
+            rows = session.query(Essay.essay_id).filter(
+                Essay.is_deleted == False,
+                Essay.essay_id > after_id
+            ).order_by(Essay.essay_id).limit(limit).all()
+            return [row.essay_id for row in rows]
+
     def get_recent_essays(self, limit: int = 10) -> List[Essay]:
         with db_manager.session_scope() as session:
             return session.query(Essay).filter(Essay.is_deleted == False).order_by(Essay.create_time.desc()).limit(limit).all()
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import delete, or_, select, update as sql_update
+from sqlalchemy.dialects.postgresql import insert
+from domain.entities.entities import IdempotencyKey
+from infrastructure.repositories.database_manager import db_manager
+
+
+class IdempotencyKeyRepository:
+    def reserve(self, user_id: str, key: str, fingerprint: str,
+                ttl: timedelta, pending_timeout: timedelta) -> Optional[dict]:
+        """
+        用一条 INSERT ... ON CONFLICT DO UPDATE ... WHERE 占用一个 key：
+        key 不存在、已经过期（超过 ttl），或者上次占用后超过 pending_timeout 还没有创建出任务（进程中途退出）时，
+        由本次请求占用并返回 None；否则返回已有的记录
+        """
+        table = IdempotencyKey.__table__
+        now = datetime.now(timezone.utc)
+        with db_manager.session_scope() as session:
+            stmt = insert(table).values(user_id=user_id, idempotency_key=key, fingerprint=fingerprint)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['user_id', 'idempotency_key'],
+                set_={'fingerprint': stmt.excluded.fingerprint, 'essay_id': None, 'job_id': None, 'create_time': now},
+                where=or_(
+                    table.c.create_time < now - ttl,
+                    (table.c.job_id.is_(None)) & (table.c.create_time < now - pending_timeout)
+                )
+            ).returning(table.c.user_id)
+            if session.execute(stmt).first() is not None:
+                return None
+            row = session.execute(select(
+                table.c.fingerprint, table.c.essay_id, table.c.job_id, table.c.create_time
+            ).where(table.c.user_id == user_id, table.c.idempotency_key == key)).first()
+            return dict(row._mapping) if row else None
+
+    def attach(self, user_id: str, key: str, essay_id: int, job_id: str) -> None:
+        """记下这个 key 创建出的作文和任务，之后相同的请求直接返回它们"""
+        with db_manager.session_scope() as session:
+            session.execute(sql_update(IdempotencyKey.__table__).where(
+                IdempotencyKey.__table__.c.user_id == user_id,
+                IdempotencyKey.__table__.c.idempotency_key == key
+            ).values(essay_id=essay_id, job_id=job_id))
+
+    def release(self, user_id: str, key: str) -> None:
+        """请求失败、没有创建出任务时释放 key，客户端可以用同一个 key 重试"""
+        with db_manager.session_scope() as session:
+            session.execute(delete(IdempotencyKey.__table__).where(
+                IdempotencyKey.__table__.c.user_id == user_id,
+                IdempotencyKey.__table__.c.idempotency_key == key,
+                IdempotencyKey.__table__.c.job_id.is_(None)
+            ))
+
+    def delete_expired(self, ttl: timedelta) -> int:
+        with db_manager.session_scope() as session:
+            result = session.execute(delete(IdempotencyKey.__table__).where(
+                IdempotencyKey.__table__.c.create_time < datetime.now(timezone.utc) - ttl
+            ))
+            return result.rowcount
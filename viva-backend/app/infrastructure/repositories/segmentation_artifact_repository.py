@@ -0,0 +1,61 @@
+from datetime import datetime
+from typing import Any, Dict, List, Set, Tuple
+from sqlalchemy import and_, delete, func, or_, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from domain.entities.entities import SegmentationArtifact
+from infrastructure.repositories.database_manager import db_manager
+
+
+class SegmentationArtifactRepository:
+    def get_many(self, sentence_hashes: List[str], versions: List[str]) -> Dict[Tuple[str, str, str], Any]:
+        """返回 (sentence_hash, phase, version) -> 结果，只查这些句子在这些版本下的产物"""
+        if not sentence_hashes or not versions:
+            return {}
+        with db_manager.session_scope() as session:
+            rows = session.query(
+                SegmentationArtifact.sentence_hash,
+                SegmentationArtifact.phase,
+                SegmentationArtifact.version,
+                SegmentationArtifact.result
+            ).filter(
+                SegmentationArtifact.sentence_hash.in_(sentence_hashes),
+                SegmentationArtifact.version.in_(versions)
+            ).all()
+            return {(row.sentence_hash, row.phase, row.version): row.result for row in rows}
+
+    def upsert_many(self, artifacts: Dict[Tuple[str, str, str], Any]) -> None:
+        if not artifacts:
+            return
+        with db_manager.session_scope() as session:
+            stmt = insert(SegmentationArtifact.__table__).values([{
+                'sentence_hash': sentence_hash,
+                'phase': phase,
+                'version': version,
+                'result': result
+            } for (sentence_hash, phase, version), result in artifacts.items()])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['sentence_hash', 'phase', 'version'],
+                set_={'result': stmt.excluded.result, 'update_time': func.now()}
+            )
+            session.execute(stmt)
+
+    def delete_many(self, keys: Set[Tuple[str, str, str]]) -> int:
+        """删除这些 (sentence_hash, phase, version) 的产物"""
+        if not keys:
+            return 0
+        table = SegmentationArtifact.__table__
+        with db_manager.session_scope() as session:
+            result = session.execute(delete(table).where(
+                tuple_(table.c.sentence_hash, table.c.phase, table.c.version).in_(sorted(keys))
+            ))
+            return result.rowcount
+
+    def delete_stale(self, phase_versions: Dict[str, str], older_than: datetime) -> int:
+        """删除 phase_versions 里的阶段不是当前版本的产物，以及所有阶段里 older_than 之前更新的产物"""
+        table = SegmentationArtifact.__table__
+        with db_manager.session_scope() as session:
+            result = session.execute(delete(table).where(or_(
+                table.c.update_time < older_than,
+                *[and_(table.c.phase == phase, table.c.version != version) for phase, version in phase_versions.items()]
+            )))
+            return result.rowcount
@@ -0,0 +1,82 @@
+from typing import Dict, List, Set, Tuple
+from sqlalchemy import bindparam, delete, func, select, update as sql_update
+from sqlalchemy.dialects.postgresql import insert
+from domain.entities.entities import SegmentationCache, Sentence
+from infrastructure.repositories.database_manager import db_manager
+
+
+class SegmentationCacheRepository:
+    def get_by_hashes(self, sentence_hashes: List[str], version: str) -> Dict[str, dict]:
+        if not sentence_hashes:
+            return {}
+        with db_manager.session_scope() as session:
+            rows = session.query(SegmentationCache.sentence_hash, SegmentationCache.result).filter(
+                SegmentationCache.sentence_hash.in_(sentence_hashes),
+                SegmentationCache.version == version
+            ).all()
+            return {row.sentence_hash: row.result for row in rows}
+
+    def get_existing_hashes(self, sentence_hashes: List[str], version: str) -> Set[str]:
+        if not sentence_hashes:
+            return set()
+        with db_manager.session_scope() as session:
+            rows = session.query(SegmentationCache.sentence_hash).filter(
+                SegmentationCache.sentence_hash.in_(sentence_hashes),
+                SegmentationCache.version == version
+            ).all()
+            return {row.sentence_hash for row in rows}
+
+    def add_hits(self, counts: Dict[Tuple[str, str], int]) -> None:
+        """批量累加命中次数：(sentence_hash, version) -> 次数；按主键顺序更新，并发的批次不会互相死锁"""
+        if not counts:
+            return
+        table = SegmentationCache.__table__
+        stmt = sql_update(table).where(
+            table.c.sentence_hash == bindparam('b_sentence_hash'),
+            table.c.version == bindparam('b_version')
+        ).values(hit_count=table.c.hit_count + bindparam('b_count'))
+        with db_manager.session_scope() as session:
+            session.execute(stmt, [
+                {'b_sentence_hash': sentence_hash, 'b_version': version, 'b_count': count}
+                for (sentence_hash, version), count in sorted(counts.items())
+            ])
+
+    def get_sentences(self, version: str, limit: int) -> List[str]:
+        """在这个版本下有缓存结果的句子原文（通过 md5(sentence) 关联 sentences 表），最近更新的优先"""
+        with db_manager.session_scope() as session:
+            stmt = select(Sentence.sentence).join(
+                SegmentationCache, SegmentationCache.sentence_hash == func.md5(Sentence.sentence)
+            ).where(
+                SegmentationCache.version == version,
+                Sentence.is_deleted == False
+            ).order_by(SegmentationCache.update_time.desc()).limit(limit)
+            return list(session.execute(stmt).scalars())
+
+    def upsert_many(self, results: Dict[str, dict], version: str) -> None:
+        if not results:
+            return
+        with db_manager.session_scope() as session:
+            stmt = insert(SegmentationCache.__table__).values([{
+                'sentence_hash': sentence_hash,
+                'version': version,
+                'result': result,
+                'hit_count': 0
+            } for sentence_hash, result in results.items()])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['sentence_hash', 'version'],
+                # 重新计算的结果算作最近更新，get_sentences 按 update_time 取最近的句子
+                set_={'result': stmt.excluded.result, 'update_time': func.now()}
+            )
+            session.execute(stmt)
+
+    def delete_except_version(self, version: str) -> int:
+        with db_manager.session_scope() as session:
+            result = session.execute(delete(SegmentationCache.__table__).where(
+                SegmentationCache.__table__.c.version != version
+            ))
+            return result.rowcount
+
+    def delete_all(self) -> int:
+        with db_manager.session_scope() as session:
+            result = session.execute(delete(SegmentationCache.__table__))
+            return result.rowcount
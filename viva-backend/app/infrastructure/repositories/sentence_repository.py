@@ -1,10 +1,10 @@
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from sqlalchemy.orm import Session
 from domain.entities.entities import Essay, Sentence, EssaySentence
 from infrastructure.repositories.database_manager import db_manager
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy import select, update as sql_update, func
+from sqlalchemy import literal_column, select, update as sql_update, func
 
 class SentenceRepository:
     def create(self, sentence: Sentence, essay_id: int) -> Sentence:
@@ -107,6 +107,35 @@ class SentenceRepository:
                 return True
             return False
 
+    def upsert_for_essay(self, essay_id: int, sentences: List[str], session: Session) -> Dict[str, Tuple[int, bool]]:
+        """
+        在调用方的事务里用一条 INSERT ... ON CONFLICT (md5(sentence)) ... RETURNING 写入所有句子，
+        再用一条语句写入作文和句子的关联；返回 句子 -> (sentence_id, 是否为新插入的句子)
+        """
+        unique_sentences = list(dict.fromkeys(sentences))
+        if not unique_sentences:
+            return {}
+        # 同一条语句里不能两次更新同一行，所以先去重；xmax = 0 说明这一行是本次新插入的
+        stmt = insert(Sentence.__table__).values([
+            {'sentence': sentence, 'is_deleted': False} for sentence in unique_sentences
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[func.md5(Sentence.__table__.c.sentence)],
+            set_={'sentence': stmt.excluded.sentence}
+        ).returning(
+            Sentence.__table__.c.sentence_id,
+            Sentence.__table__.c.sentence,
+            literal_column('(xmax = 0)').label('inserted')
+        )
+        sentence_ids = {row.sentence: (row.sentence_id, row.inserted) for row in session.execute(stmt)}
+
+        link_stmt = insert(EssaySentence.__table__).values([
+            {'essay_id': essay_id, 'sentence_id': sentence_ids[sentence][0], 'is_deleted': False}
+            for sentence in unique_sentences
+        ]).on_conflict_do_nothing(index_elements=['essay_id', 'sentence_id'])
+        session.execute(link_stmt)
+        return sentence_ids
+
     def bulk_create(self, sentences: List[Sentence], essay_id: int) -> List[Sentence]:
         with db_manager.session_scope() as session:
             # 插入或获取所有 Sentence
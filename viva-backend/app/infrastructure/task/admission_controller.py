@@ -0,0 +1,173 @@
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional, Tuple
+
+from infrastructure.task.task_queue import PRIORITY_BULK, PRIORITY_INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+# 一个未命中缓存的句子最多需要的 LLM 调用：第一步、第二步、synset 选择、同义词变形（第三步通常在本地对齐）
+CALLS_PER_SENTENCE = 4
+# 每次调用 prompt 模板本身的 token 数，以及每个汉字在输入和输出里大约对应的 token 数
+PROMPT_TOKENS_PER_CALL = 600
+TOKENS_PER_CHAR = 3
+
+# 预计 LLM 调用数不超过这个值的作文按交互请求处理
+INTERACTIVE_MAX_CALLS = 120
+
+# 统计最近多长时间内完成的调用数，用来估计处理速度和 Retry-After
+THROUGHPUT_WINDOW_SECONDS = 300
+MAX_RETRY_AFTER_SECONDS = 300
+
+
+@dataclass
+class CostEstimate:
+    """一篇作文预计需要的 LLM 调用数和 token 数（已经有分词缓存的句子不计入，其余按最多需要的调用数估计）"""
+    sentences: int
+    chars: int
+    llm_calls: int
+    tokens: int
+
+
+class AdmissionRejected(Exception):
+    """超出容量时拒绝，retry_after 是预计多少秒后有足够的容量"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    按预计成本做准入控制：记录本进程（worker）和每个用户已经接受、还没处理完的作文的预计 LLM 调用数，
+    新作文加上去超过上限时拒绝（接口返回 429 和 Retry-After），保证一次突发不会占满 LLM 限额和数据库连接池
+
+    计数只在本进程的内存里，上限是每个 worker 进程各自的上限：部署了 N 个 worker 时整体的上限是 N 倍
+    单篇作文计入的调用数不超过两个上限中较小的一个，超过上限的大作文在没有其他作文占用容量时也能被接受，
+    但不会绕过上限；接受后按预计成本决定任务队列里的优先级
+    """
+
+    def __init__(self, max_inflight_calls: int, max_user_inflight_calls: int, default_calls_per_second: float):
+        self.max_inflight_calls = max_inflight_calls
+        self.max_user_inflight_calls = max_user_inflight_calls
+        self.default_calls_per_second = default_calls_per_second
+        self._lock = threading.Lock()
+        self._tickets: Dict[str, Tuple[Optional[str], CostEstimate]] = {}
+        self._inflight_calls = 0
+        self._inflight_tokens = 0
+        self._user_calls: Dict[Optional[str], int] = {}
+        self._completed: Deque[Tuple[float, int]] = deque()
+        self._admitted = 0
+        self._rejected = 0
+
+    @staticmethod
+    def estimate(sentences: int, chars: int, llm_calls: Optional[int] = None) -> CostEstimate:
+        """sentences 和 chars 是需要调用 LLM 的句子数和字数；llm_calls 不传时按每个句子 CALLS_PER_SENTENCE 次估计"""
+        if llm_calls is None:
+            llm_calls = sentences * CALLS_PER_SENTENCE
+        return CostEstimate(
+            sentences=sentences,
+            chars=chars,
+            llm_calls=llm_calls,
+            tokens=llm_calls * PROMPT_TOKENS_PER_CALL + chars * TOKENS_PER_CHAR * CALLS_PER_SENTENCE
+        )
+
+    @staticmethod
+    def priority(estimate: CostEstimate) -> int:
+        """预计成本小的作文是用户在页面上等待的交互请求，在任务队列里排在长文档前面"""
+        return PRIORITY_INTERACTIVE if estimate.llm_calls <= INTERACTIVE_MAX_CALLS else PRIORITY_BULK
+
+    def admit(self, user_id: Optional[str], estimate: CostEstimate, force: bool = False) -> str:
+        """
+        接受一篇作文并返回 ticket，处理完（或失败）后必须调用 release；
+        超过本进程或该用户的上限时抛出 AdmissionRejected。force=True 时不检查上限（如启动时恢复的任务）
+
+        单篇作文计入的调用数封顶为 min(max_user_inflight_calls, max_inflight_calls)，
+        所以任何作文在容量空闲时都能被接受，但占用的容量不会超过上限
+        """
+        calls = min(estimate.llm_calls, self.max_user_inflight_calls, self.max_inflight_calls)
+        charged = CostEstimate(sentences=estimate.sentences, chars=estimate.chars, llm_calls=calls,
+                               tokens=estimate.tokens)
+        with self._lock:
+            if not force:
+                user_calls = self._user_calls.get(user_id, 0)
+                if user_calls + calls > self.max_user_inflight_calls:
+                    self._rejected += 1
+                    raise AdmissionRejected(
+                        f"Too many essays in progress for this user ({user_calls} estimated LLM calls)",
+                        self._retry_after(user_calls + calls - self.max_user_inflight_calls))
+                if self._inflight_calls + calls > self.max_inflight_calls:
+                    self._rejected += 1
+                    raise AdmissionRejected(
+                        f"Essay processing is at capacity ({self._inflight_calls} estimated LLM calls in progress)",
+                        self._retry_after(self._inflight_calls + calls - self.max_inflight_calls))
+            ticket = str(uuid.uuid4())
+            self._tickets[ticket] = (user_id, charged)
+            self._inflight_calls += charged.llm_calls
+            self._inflight_tokens += charged.tokens
+            self._user_calls[user_id] = self._user_calls.get(user_id, 0) + charged.llm_calls
+            self._admitted += 1
+            return ticket
+
+    def release(self, ticket: Optional[str]) -> None:
+        """作文处理完成或失败后释放它占用的容量；重复释放或 ticket 为 None 时什么都不做"""
+        if ticket is None:
+            return
+        with self._lock:
+            entry = self._tickets.pop(ticket, None)
+            if entry is None:
+                return
+            user_id, estimate = entry
+            self._inflight_calls -= estimate.llm_calls
+            self._inflight_tokens -= estimate.tokens
+            remaining = self._user_calls.get(user_id, 0) - estimate.llm_calls
+            if remaining > 0:
+                self._user_calls[user_id] = remaining
+            else:
+                self._user_calls.pop(user_id, None)
+            self._completed.append((time.monotonic(), estimate.llm_calls))
+
+    def _calls_per_second(self) -> float:
+        """最近 THROUGHPUT_WINDOW_SECONDS 秒内完成的预计调用数折算的速度，没有记录时用默认值"""
+        cutoff = time.monotonic() - THROUGHPUT_WINDOW_SECONDS
+        while self._completed and self._completed[0][0] < cutoff:
+            self._completed.popleft()
+        if not self._completed:
+            return self.default_calls_per_second
+        return max(sum(calls for _, calls in self._completed) / THROUGHPUT_WINDOW_SECONDS,
+                   self.default_calls_per_second)
+
+    def _retry_after(self, excess_calls: int) -> int:
+        """按当前处理速度，腾出 excess_calls 个调用的容量大约需要的秒数"""
+        seconds = math.ceil(excess_calls / self._calls_per_second())
+        return min(max(seconds, 1), MAX_RETRY_AFTER_SECONDS)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "inflight_essays": len(self._tickets),
+                "inflight_calls": self._inflight_calls,
+                "max_inflight_calls": self.max_inflight_calls,
+                "inflight_tokens": self._inflight_tokens,
+                "users": len(self._user_calls),
+                "calls_per_second": round(self._calls_per_second(), 3),
+                "admitted": self._admitted,
+                "rejected": self._rejected
+            }
+
+
+# 创建全局的 AdmissionController 实例，每个 worker 进程各自计数
+global_admission_controller = AdmissionController(
+    max_inflight_calls=int(os.getenv("ADMISSION_MAX_INFLIGHT_CALLS", "2000")),
+    max_user_inflight_calls=int(os.getenv("ADMISSION_MAX_USER_INFLIGHT_CALLS", "600")),
+    default_calls_per_second=float(os.getenv("ADMISSION_DEFAULT_CALLS_PER_SECOND", "2"))
+)
+
+def get_admission_controller():
+    return global_admission_controller
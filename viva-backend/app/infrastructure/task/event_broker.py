@@ -0,0 +1,141 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+# 订阅结束的标记
+_CLOSED = object()
+
+
+@dataclass
+class _Channel:
+    # 只保留最近 max_history 个事件，更早的事件只计数（dropped）
+    history: Deque[dict] = field(default_factory=deque)
+    dropped: int = 0
+    subscribers: List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = field(default_factory=list)
+    # 本进程里有没有发布者 open 过这个频道；只有订阅者、从未 open 过的频道在最后一个订阅者离开时删除
+    opened: bool = False
+    closed_at: float = 0.0
+
+
+class EventBroker:
+    """
+    进程内的事件广播：后台 worker 线程按频道（如任务 id）发布事件，接口层异步订阅
+    频道保留最近 max_history 个事件，晚到的订阅者会先收到这些事件，再接着收实时事件；
+    更早的事件已经丢弃时先收到一个 truncated 事件（data 里是丢弃的个数），这些内容需要从数据库读取，
+    所以长文档的每个句子都推送，内存里每个频道最多也只有 max_history 个事件；
+    频道关闭 history_ttl_seconds 秒后被清理，从未 open 过的频道（任务在其他进程里处理或者还没开始）
+    在最后一个订阅者断开时删除
+    """
+
+    def __init__(self, history_ttl_seconds: int = 600, max_history: Optional[int] = None):
+        self.history_ttl_seconds = history_ttl_seconds
+        self.max_history = max_history if max_history is not None else int(os.getenv("EVENT_HISTORY_MAX_EVENTS", "200"))
+        self._lock = threading.Lock()
+        self._channels: Dict[str, _Channel] = {}
+
+    def has_channel(self, channel: str) -> bool:
+        with self._lock:
+            self._cleanup()
+            return channel in self._channels
+
+    def is_publishing(self, channel: str) -> bool:
+        """本进程里有发布者 open 了这个频道、还没有 close"""
+        with self._lock:
+            state = self._channels.get(channel)
+            return state is not None and state.opened and not state.closed_at
+
+    def open(self, channel: str) -> None:
+        """开始一次新的发布，清空该频道之前的历史，已经在等待的订阅者保留"""
+        with self._lock:
+            self._cleanup()
+            state = self._channels.setdefault(channel, _Channel())
+            state.history = deque()
+            state.dropped = 0
+            state.opened = True
+            state.closed_at = 0.0
+
+    def publish(self, channel: str, event: dict) -> None:
+        """线程安全，可以在任意线程调用"""
+        with self._lock:
+            state = self._channels.setdefault(channel, _Channel())
+            state.history.append(event)
+            if len(state.history) > self.max_history:
+                state.history.popleft()
+                state.dropped += 1
+            subscribers = list(state.subscribers)
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def close(self, channel: str) -> None:
+        with self._lock:
+            state = self._channels.get(channel)
+            if state is None:
+                return
+            state.closed_at = time.monotonic()
+            subscribers = list(state.subscribers)
+            state.subscribers.clear()
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, _CLOSED)
+
+    async def subscribe(self, channel: str, heartbeat_seconds: float = 15,
+                        idle_timeout_seconds: float = 600) -> AsyncIterator[Optional[dict]]:
+        """
+        先产生历史事件（有事件被丢弃时先产生 truncated 事件），再产生实时事件，频道关闭时结束；
+        heartbeat_seconds 秒内没有事件时产生一个 None（心跳，调用方可以借机检查任务状态），
+        idle_timeout_seconds 秒内一直没有事件时结束，客户端重新连接即可
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            state = self._channels.setdefault(channel, _Channel())
+            history = list(state.history)
+            if state.dropped:
+                history.insert(0, {"event": "truncated", "data": {"dropped": state.dropped}})
+            closed = bool(state.closed_at)
+            if not closed:
+                state.subscribers.append(subscriber)
+
+        try:
+            for event in history:
+                yield event
+            if closed:
+                return
+            idle_since = time.monotonic()
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    if time.monotonic() - idle_since > idle_timeout_seconds:
+                        return
+                    yield None
+                    continue
+                if event is _CLOSED:
+                    return
+                idle_since = time.monotonic()
+                yield event
+        finally:
+            with self._lock:
+                if subscriber in state.subscribers:
+                    state.subscribers.remove(subscriber)
+                if not state.opened and not state.subscribers and self._channels.get(channel) is state:
+                    del self._channels[channel]
+
+    def _cleanup(self) -> None:
+        now = time.monotonic()
+        expired = [
+            name for name, state in self._channels.items()
+            if state.closed_at and now - state.closed_at > self.history_ttl_seconds
+        ]
+        for name in expired:
+            del self._channels[name]
+
+
+# 创建一个全局的 EventBroker 实例
+global_event_broker = EventBroker()
+
+def get_event_broker():
+    return global_event_broker
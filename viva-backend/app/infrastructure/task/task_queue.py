@@ -1,35 +1,66 @@
 import asyncio
+import heapq
+import itertools
+import logging
+import os
 from typing import Callable, Any
-from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# 任务优先级，数字小的先执行：用户在页面上等待的短作文优先，长文档和后台补全排在后面；同一优先级先进先出
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
 
 class TaskQueue:
-    def __init__(self):
-        self.queue = deque()
-        self.is_processing = False
+    def __init__(self, max_workers: int = 1):
+        self.queue = []
+        self.max_workers = max_workers
+        self.active_workers = 0
+        self._sequence = itertools.count()
+        # 第一次 add_task 时记下事件循环，供 worker 线程里的同步任务追加任务
+        self._loop = None
+
+    @property
+    def is_processing(self):
+        return self.active_workers > 0
 
     async def add_task(self, task: Callable[..., Any], *args, **kwargs):
-        self.queue.append((task, args, kwargs))
-        if not self.is_processing:
+        await self.add_priority_task(PRIORITY_INTERACTIVE, task, *args, **kwargs)
+
+    async def add_priority_task(self, priority: int, task: Callable[..., Any], *args, **kwargs):
+        self._loop = asyncio.get_running_loop()
+        heapq.heappush(self.queue, (priority, next(self._sequence), task, args, kwargs))
+        # 按需启动 worker，最多 max_workers 个同时处理
+        if self.active_workers < self.max_workers:
+            self.active_workers += 1
             asyncio.create_task(self.process_queue())
 
+    def add_task_threadsafe(self, priority: int, task: Callable[..., Any], *args, **kwargs) -> None:
+        """在 worker 线程里（asyncio.to_thread 执行的同步任务中）追加任务，不等待它开始执行"""
+        if self._loop is None:
+            raise RuntimeError("Task queue has not been started in an event loop")
+        asyncio.run_coroutine_threadsafe(self.add_priority_task(priority, task, *args, **kwargs), self._loop)
+
     async def process_queue(self):
-        self.is_processing = True
-        while self.queue:
-            task, args, kwargs = self.queue.popleft()
-            try:
-                if asyncio.iscoroutinefunction(task):
-                    await task(*args, **kwargs)
-                else:
-                    task(*args, **kwargs)
-            except Exception as e:
-                print(f"Error processing task: {e}")
-        self.is_processing = False
+        try:
+            while self.queue:
+                _, _, task, args, kwargs = heapq.heappop(self.queue)
+                try:
+                    if asyncio.iscoroutinefunction(task):
+                        await task(*args, **kwargs)
+                    else:
+                        # 同步任务（如调用 LLM 的分词流水线）放到线程里执行，不阻塞事件循环
+                        await asyncio.to_thread(task, *args, **kwargs)
+                except Exception as e:
+                    logger.error(f"Error processing task: {e}")
+        finally:
+            self.active_workers -= 1
 
     def get_queue_size(self):
         return len(self.queue)
 
-# 创建一个全局的 TaskQueue 实例
-global_task_queue = TaskQueue()
+# 创建一个全局的 TaskQueue 实例，同时处理的作文数由 ESSAY_WORKER_COUNT 控制
+global_task_queue = TaskQueue(max_workers=int(os.getenv("ESSAY_WORKER_COUNT", "2")))
 
 def get_task_queue():
-    return global_task_queue
\ No newline at end of file
+    return global_task_queue
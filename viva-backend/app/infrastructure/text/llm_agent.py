@@ -15,6 +15,7 @@ sys.path.insert(0, project_root)
 # 现在你可以导入 infrastructure 模块了
 from infrastructure.text.chat_gpt_agent import ChatGptAgent
 from infrastructure.text.claude_agent import ClaudeAgent
+from infrastructure.text_processing.single_flight import llm_flight, prompt_key
 
 # 加载环境变量
 load_dotenv()
@@ -38,7 +39,8 @@ class LLMAgent:
                 f"Unsupported model type: {model_type}. Supported types are 'chatgpt' and 'claude'.")
 
     def chat(self, prompt):
-        return self.model.basic_chat(prompt)
+        # 同一个模型、同一个 prompt 的请求同时只发出一次
+        return llm_flight.do(prompt_key(self.model, prompt), self.model.basic_chat, prompt)[0]
 
 
 # 使用示例
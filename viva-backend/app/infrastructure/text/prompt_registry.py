@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain.output_parsers import PydanticOutputParser
+from langchain.prompts import ChatPromptTemplate
+
+# 加载环境变量
+load_dotenv()
+# 获取 logger
+logger = logging.getLogger(__name__)
+
+# prompt 名称 -> (保存 prompt 文件路径的环境变量, 是否编译为 ChatPromptTemplate)
+# segment_prompt1 里有原样输出的 json 示例，用字符串替换填充，不能编译成模板
+SEGMENT_PROMPT1 = "segment_prompt1"
+SEGMENT_PROMPT2 = "segment_prompt2"
+SEGMENT_PROMPT3 = "segment_prompt3"
+SEGMENT_PROMPT4 = "segment_prompt4"
+SEGMENT_PROMPT5 = "segment_prompt5"
+SEGMENT_PROMPT6 = "segment_prompt6"
+SEGMENT_PROMPT7 = "segment_prompt7"
+SEGMENT_PROMPT8 = "segment_prompt8"
+WORDNET_PROMPT1 = "wordnet_prompt1"
+WORDNET_PROMPT2 = "wordnet_prompt2"
+
+DEFAULT_PROMPTS = {
+    SEGMENT_PROMPT1: ("SEGMENT_PROMPT_FILE1", False),
+    SEGMENT_PROMPT2: ("SEGMENT_PROMPT_FILE2", True),
+    SEGMENT_PROMPT3: ("SEGMENT_PROMPT_FILE3", True),
+    SEGMENT_PROMPT4: ("SEGMENT_PROMPT_FILE4", True),
+    SEGMENT_PROMPT5: ("SEGMENT_PROMPT_FILE5", True),
+    SEGMENT_PROMPT6: ("SEGMENT_PROMPT_FILE6", True),
+    SEGMENT_PROMPT7: ("SEGMENT_PROMPT_FILE7", True),
+    SEGMENT_PROMPT8: ("SEGMENT_PROMPT_FILE8", True),
+    WORDNET_PROMPT1: ("WORDNET_PROMPT_FILE1", True),
+    WORDNET_PROMPT2: ("WORDNET_PROMPT_FILE2", True),
+}
+
+
+@dataclass
+class _PromptEntry:
+    env_name: str
+    is_template: bool = True
+    path: Optional[str] = None
+    mtime: Optional[float] = None
+    text: str = ""
+    version: str = ""
+    template: Optional[ChatPromptTemplate] = None
+    # parser 类型 -> 已经填好 format_instructions 的模板
+    partials: Dict[type, ChatPromptTemplate] = field(default_factory=dict)
+
+
+class PromptRegistry:
+    """
+    prompt 模板注册表：启动时读取并编译所有 prompt，之后只在文件 mtime 变化时重新加载，
+    同时缓存每个输出模型的 format_instructions，避免每次调用 LLM 都重新读文件、重新生成
+    """
+
+    def __init__(self, prompts: Optional[Dict[str, Tuple[str, bool]]] = None):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _PromptEntry] = {}
+        self._format_instructions: Dict[type, str] = {}
+        for name, (env_name, is_template) in (prompts or {}).items():
+            self.register(name, env_name, is_template)
+
+    def register(self, name: str, env_name: str, is_template: bool = True) -> None:
+        with self._lock:
+            self._entries[name] = _PromptEntry(env_name=env_name, is_template=is_template)
+
+    def preload(self, names: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """
+        加载 prompt，返回 名称 -> 版本号：传入 names 时只加载这些（当前配置用到的），缺少文件时抛出异常；
+        否则加载所有设置了环境变量的 prompt，没有设置的（未开启的功能用到的）记录日志后跳过
+        """
+        if names is not None:
+            return {name: self.version(name) for name in names}
+        versions = {}
+        for name in list(self._entries):
+            env_name = self._entries[name].env_name
+            if not os.getenv(env_name):
+                logger.info(f"Skipping prompt {name}: {env_name} is not set")
+                continue
+            versions[name] = self.version(name)
+        return versions
+
+    def text(self, name: str) -> str:
+        return self._load(name).text
+
+    def version(self, name: str) -> str:
+        """prompt 内容的哈希，可用于缓存键和监控"""
+        return self._load(name).version
+
+    def versions(self) -> Dict[str, str]:
+        return self.preload()
+
+    def template(self, name: str, parser: Optional[PydanticOutputParser] = None) -> ChatPromptTemplate:
+        """返回编译好的模板；传入 parser 时返回已经填好 format_instructions 的模板"""
+        entry = self._load(name)
+        if entry.template is None:
+            raise ValueError(f"Prompt {name} is not registered as a template.")
+        if parser is None:
+            return entry.template
+        pydantic_object = parser.pydantic_object
+        partial = entry.partials.get(pydantic_object)
+        if partial is None:
+            partial = entry.template.partial(format_instructions=self.format_instructions(parser))
+            entry.partials[pydantic_object] = partial
+        return partial
+
+    def format_instructions(self, parser: PydanticOutputParser) -> str:
+        pydantic_object = parser.pydantic_object
+        instructions = self._format_instructions.get(pydantic_object)
+        if instructions is None:
+            instructions = parser.get_format_instructions()
+            self._format_instructions[pydantic_object] = instructions
+        return instructions
+
+    def _load(self, name: str) -> _PromptEntry:
+        entry = self._entries.get(name)
+        if entry is None:
+            raise KeyError(f"Prompt {name} is not registered.")
+
+        path = os.getenv(entry.env_name)
+        if not path:
+            raise ValueError(f"{entry.env_name} is not set in environment variables.")
+        mtime = os.stat(path).st_mtime
+        if entry.path == path and entry.mtime == mtime:
+            return entry
+
+        with self._lock:
+            # 双重检查，避免多个线程同时重新加载
+            entry = self._entries[name]
+            if entry.path == path and entry.mtime == mtime:
+                return entry
+            with open(path, "r") as file:
+                text = file.read()
+            # 整体替换条目，其他线程要么看到旧模板要么看到新模板
+            new_entry = _PromptEntry(
+                env_name=entry.env_name,
+                is_template=entry.is_template,
+                path=path,
+                mtime=mtime,
+                text=text,
+                version=hashlib.sha256(text.encode("utf-8")).hexdigest()[:12],
+                template=ChatPromptTemplate.from_template(text) if entry.is_template else None
+            )
+            if entry.path is not None:
+                logger.info(f"Reloaded prompt {name} from {path}, version {new_entry.version}")
+            self._entries[name] = new_entry
+        return new_entry
+
+
+# 创建全局的 PromptRegistry 实例
+prompt_registry = PromptRegistry(DEFAULT_PROMPTS)
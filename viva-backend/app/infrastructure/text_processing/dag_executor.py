@@ -0,0 +1,120 @@
+import contextvars
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+# 获取 logger
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class NodeFailure:
+    """fail_fast=False 时失败节点的结果，依赖它的节点不会执行，直接得到同一个 NodeFailure"""
+    key: Hashable
+    error: Exception
+
+
+@dataclass
+class _Node:
+    key: Hashable
+    fn: Callable[..., Any]
+    deps: Tuple[Hashable, ...]
+    args: Tuple[Any, ...] = ()
+    on_done: Optional[Callable[[Any], None]] = None
+    waiting: set = field(default_factory=set)
+
+
+class DagExecutor:
+    """
+    按依赖关系执行任务图：所有依赖都完成的节点会被立即并发执行，
+    同时在途的节点数不超过 max_in_flight；这只是这一张图自己的线程数，
+    不是 LLM 的并发上限（每次执行都有自己的线程池），LLM 调用的进程内上限由 llm_limiter 控制
+
+    节点函数的参数是固定参数 args 加上其依赖节点的结果（按 deps 的顺序）；
+    on_done 回调在调度线程中执行，可以在里面继续 add_node，用于依赖结果才能确定的子图（例如按词展开）
+
+    fail_fast=True 时任一节点抛错就取消剩余节点并抛出；否则失败只影响依赖它的节点，
+    失败节点及其下游的结果都是 NodeFailure（on_done 同样会被调用）
+    """
+
+    def __init__(self, max_in_flight: int = 8, fail_fast: bool = True):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1.")
+        self.max_in_flight = max_in_flight
+        self.fail_fast = fail_fast
+        self._nodes: Dict[Hashable, _Node] = {}
+        self._results: Dict[Hashable, Any] = {}
+        self._dependents: Dict[Hashable, List[Hashable]] = {}
+        self._ready: List[Hashable] = []
+
+    def add_node(self, key: Hashable, fn: Callable[..., Any], deps: Tuple[Hashable, ...] = (),
+                 args: Tuple[Any, ...] = (), on_done: Optional[Callable[[Any], None]] = None) -> Hashable:
+        if key in self._nodes:
+            raise ValueError(f"Duplicate node key: {key}")
+        node = _Node(key=key, fn=fn, deps=tuple(deps), args=tuple(args), on_done=on_done)
+        node.waiting = {dep for dep in node.deps if dep not in self._results}
+        for dep in node.waiting:
+            if dep not in self._nodes:
+                raise ValueError(f"Node {key} depends on unknown node {dep}")
+            self._dependents.setdefault(dep, []).append(key)
+        self._nodes[key] = node
+        if not node.waiting:
+            self._ready.append(key)
+        return key
+
+    def result(self, key: Hashable) -> Any:
+        return self._results[key]
+
+    def run(self) -> Dict[Hashable, Any]:
+        """执行整张图直到所有节点完成，返回 key -> 结果"""
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            try:
+                while self._ready or running:
+                    # 只提交到 max_in_flight 个，剩下的留在就绪队列里，保证先就绪的先执行
+                    while self._ready and len(running) < self.max_in_flight:
+                        key = self._ready.pop(0)
+                        node = self._nodes[key]
+                        dep_results = [self._results[dep] for dep in node.deps]
+                        failure = next((r for r in dep_results if isinstance(r, NodeFailure)), None)
+                        if failure is not None:
+                            self._complete(key, failure)
+                            continue
+                        # 在提交时的上下文中执行，contextvars（如作文的处理记录）在工作线程里同样可见
+                        context = contextvars.copy_context()
+                        running[pool.submit(context.run, node.fn, *node.args, *dep_results)] = key
+
+                    if not running:
+                        continue
+                    done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        key = running.pop(future)
+                        error = future.exception()
+                        if error is None:
+                            self._complete(key, future.result())
+                        elif self.fail_fast:
+                            raise error
+                        else:
+                            logger.error(f"Node {key} failed: {str(error)}")
+                            self._complete(key, NodeFailure(key=key, error=error))
+            except Exception:
+                for future in running:
+                    future.cancel()
+                raise
+
+        pending = [key for key in self._nodes if key not in self._results]
+        if pending:
+            raise RuntimeError(f"Dependency cycle detected, unfinished nodes: {pending}")
+        return self._results
+
+    def _complete(self, key: Hashable, result: Any) -> None:
+        self._results[key] = result
+        node = self._nodes[key]
+        if node.on_done:
+            node.on_done(result)
+        for dependent_key in self._dependents.pop(key, []):
+            dependent = self._nodes[dependent_key]
+            dependent.waiting.discard(key)
+            if not dependent.waiting:
+                self._ready.append(dependent_key)
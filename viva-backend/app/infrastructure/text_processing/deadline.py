@@ -0,0 +1,68 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+
+class DeadlineExceeded(Exception):
+    """剩余时间不够跑一个可选阶段时抛出，调用方跳过这个阶段、把结果标记为不完整"""
+
+
+class Deadline:
+    """一次请求的截止时间（time.monotonic 的时刻）"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("request_deadline", default=None)
+
+
+def _reserve_seconds() -> float:
+    return float(os.getenv("ESSAY_DEADLINE_RESERVE_SECONDS", "5"))
+
+
+@contextmanager
+def deadline(seconds: float) -> Iterator[Optional[Deadline]]:
+    """
+    在当前上下文中设置截止时间，其间（包括 DagExecutor 的工作线程里）都能通过 remaining_seconds 看到；
+    seconds <= 0 表示不限时；嵌套时取更早的那个截止时间
+    """
+    outer = _current_deadline.get()
+    if seconds <= 0:
+        yield outer
+        return
+    current = Deadline(seconds)
+    if outer is not None and outer.expires_at < current.expires_at:
+        current = outer
+    token = _current_deadline.set(current)
+    try:
+        yield current
+    finally:
+        _current_deadline.reset(token)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def remaining_seconds() -> float:
+    """当前截止时间的剩余秒数，没有截止时间时为无穷大"""
+    current = _current_deadline.get()
+    return current.remaining() if current is not None else float("inf")
+
+
+def budget_low() -> bool:
+    """剩余时间是否已经少于 ESSAY_DEADLINE_RESERVE_SECONDS，此时可选阶段（同义词扩展、词形变换）应当跳过"""
+    return remaining_seconds() < _reserve_seconds()
+
+
+def check_optional_stage(name: str) -> None:
+    """可选阶段开始前调用，剩余时间不够时抛出 DeadlineExceeded"""
+    if budget_low():
+        raise DeadlineExceeded(f"Skipping {name}: {remaining_seconds():.1f}s left before the deadline")
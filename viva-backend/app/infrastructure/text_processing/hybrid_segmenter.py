@@ -0,0 +1,118 @@
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import jieba
+import jieba.posseg as pseg
+
+from infrastructure.english.cedict import CedictService
+
+# jieba 词性 -> WordNet 词性（n/v/a/r），不在表里的词（代词、介词、助词、数词、标点等）不参与分词结果
+_JIEBA_POS = {
+    "n": "n", "ng": "n", "nz": "n", "vn": "n", "an": "n",
+    "nr": "n", "ns": "n", "nt": "n",
+    "v": "v", "vd": "v", "vg": "v",
+    "a": "a", "ag": "a",
+    "d": "r", "ad": "r",
+    # 成语和习用语的词性不确定，先按形容词处理，再交给 LLM 确认
+    "i": "a", "l": "a",
+}
+# 这些词性的词几乎不会在词典里有合适的释义，直接交给 LLM
+_ALWAYS_RESOLVE = {"nr", "ns", "nt", "i", "l"}
+
+_HAN = re.compile(r'[一-鿿]')
+# 去掉释义里的括号说明，如 "to study (a subject)"、"[literary]"
+_BRACKETS = re.compile(r'\([^)]*\)|\[[^\]]*\]')
+# 不能作为译词的释义
+_SKIP_GLOSS = re.compile(r'^(CL:|variant of|old variant|surname|see |used in|abbr\. for|also written|erhua variant)',
+                         re.IGNORECASE)
+# 每个片段最多交给 LLM 的候选数
+MAX_CANDIDATES = 5
+
+
+@dataclass
+class SpanCandidate:
+    """jieba 切出来的一个实词，以及词典给出的候选英文"""
+    chinese: str
+    start: int
+    len: int
+    pos: str
+    candidates: List[str] = field(default_factory=list)
+    # 专有名词、成语等即使只有一个候选也交给 LLM
+    needs_llm: bool = False
+
+    @property
+    def resolved(self) -> Optional[str]:
+        """词典里只有一个候选时直接采用，否则为 None，需要 LLM 选择或翻译"""
+        if self.needs_llm or len(self.candidates) != 1:
+            return None
+        return self.candidates[0]
+
+
+class HybridSegmenter:
+    """
+    本地分词：jieba 切词并标注词性，离线词典给出候选英文；
+    只有一个候选的词直接确定，有歧义或词典里没有的词留给 LLM
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._is_initialized = False
+
+    def ensure_loaded(self) -> None:
+        """jieba 的词典和离线汉英词典都只在第一次使用时加载"""
+        with self._lock:
+            if not self._is_initialized:
+                jieba.initialize()
+                CedictService.ensure_loaded()
+                self._is_initialized = True
+
+    def version(self) -> str:
+        """jieba 和离线词典的版本，用于流水线版本号"""
+        self.ensure_loaded()
+        return f"{jieba.__version__}:{CedictService.version()}"
+
+    def segment(self, sentence: str) -> List[SpanCandidate]:
+        self.ensure_loaded()
+        spans = []
+        start = 0
+        for token in pseg.lcut(sentence):
+            word, flag = token.word, token.flag
+            index = sentence.find(word, start)
+            if index < 0:
+                continue
+            start = index + len(word)
+            pos = _JIEBA_POS.get(flag)
+            if pos is None or not _HAN.search(word):
+                continue
+            spans.append(SpanCandidate(
+                chinese=word,
+                start=index,
+                len=len(word),
+                pos=pos,
+                candidates=self._candidates(word, pos),
+                needs_llm=flag in _ALWAYS_RESOLVE
+            ))
+        return spans
+
+    @staticmethod
+    def _candidates(word: str, pos: str) -> List[str]:
+        """把词典释义整理成可以直接作为分词结果的英文，去重后最多保留 MAX_CANDIDATES 个"""
+        candidates = []
+        for gloss in CedictService.lookup(word):
+            if _SKIP_GLOSS.match(gloss):
+                continue
+            gloss = _BRACKETS.sub('', gloss).strip(' ,;.')
+            if pos == "v" and gloss.startswith("to "):
+                gloss = gloss[3:]
+            # 太长的释义是解释而不是译词
+            if not gloss or len(gloss.split()) > 3:
+                continue
+            if gloss.lower() not in (c.lower() for c in candidates):
+                candidates.append(gloss)
+        return candidates[:MAX_CANDIDATES]
+
+
+# 创建全局的 HybridSegmenter 实例
+hybrid_segmenter = HybridSegmenter()
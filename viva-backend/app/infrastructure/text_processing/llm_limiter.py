@@ -0,0 +1,55 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+
+class LLMLimiter:
+    """
+    进程内所有 LLM 调用共用的并发上限（SEGMENT_MAX_CONCURRENCY）：
+    不论调用来自哪篇作文、队列里的哪个 worker、重试还是批量重新分词，同时在途的 LLM 请求都不超过这个数
+
+    DagExecutor 只负责按依赖关系安排节点，不再决定 LLM 的并发；上限在第一次使用时从环境变量读取
+    """
+
+    def __init__(self, limit: Optional[int] = None):
+        self._limit = limit
+        self._lock = threading.Lock()
+        self._semaphore: Optional[threading.BoundedSemaphore] = None
+        self._in_flight = 0
+        self._waiting = 0
+
+    def _get_semaphore(self) -> threading.BoundedSemaphore:
+        with self._lock:
+            if self._semaphore is None:
+                if self._limit is None:
+                    self._limit = int(os.getenv("SEGMENT_MAX_CONCURRENCY", "8"))
+                if self._limit < 1:
+                    raise ValueError("SEGMENT_MAX_CONCURRENCY must be at least 1.")
+                self._semaphore = threading.BoundedSemaphore(self._limit)
+            return self._semaphore
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """占用一个 LLM 调用名额，名额用完时等待其他调用结束"""
+        semaphore = self._get_semaphore()
+        with self._lock:
+            self._waiting += 1
+        semaphore.acquire()
+        with self._lock:
+            self._waiting -= 1
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            semaphore.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"limit": self._limit or 0, "in_flight": self._in_flight, "waiting": self._waiting}
+
+
+# 创建全局的 LLMLimiter 实例
+llm_limiter = LLMLimiter()
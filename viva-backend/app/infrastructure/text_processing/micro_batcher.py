@@ -0,0 +1,122 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from infrastructure.text_processing import pipeline_metrics
+
+# 获取 logger
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    动态批处理：把不同线程（不同作文、不同用户）同时提交的请求攒成一批，一次调用 process_batch，
+    再把结果按顺序分发回各自的调用方
+
+    没有后台线程：一批里第一个提交的线程负责等待最多 max_wait_ms，然后在自己的线程里执行这一批；
+    攒够 max_batch_size 个时由最后提交的线程立即执行。process_batch 必须返回与输入一一对应的结果，
+    它抛出的异常会传给这一批的所有调用方
+
+    这一批在一个空的上下文里执行，不带执行线程所在作文的记录和截止时间（可选阶段在提交前各自检查截止时间）；
+    执行期间 stage() 的记录只计入全局统计，结束后平均分摊到这一批每个请求所在的作文
+    """
+
+    def __init__(self, name: str, process_batch: Callable[[List[T]], List[R]],
+                 max_batch_size: int = 8, max_wait_ms: float = 20):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1.")
+        self.name = name
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+        self._cond = threading.Condition()
+        self._pending: List[Tuple[T, Future, Optional[pipeline_metrics.PipelineTrace]]] = []
+        self._batches = 0
+        self._items = 0
+
+    def submit(self, item: T) -> R:
+        """提交一个请求并阻塞到这一批执行完，返回该请求的结果"""
+        future: Future = Future()
+        batch = None
+        with self._cond:
+            pending = self._pending
+            pending.append((item, future, pipeline_metrics.current_trace()))
+            if len(pending) >= self.max_batch_size:
+                batch = self._take()
+            elif len(pending) == 1:
+                # 第一个请求负责在等待结束后发出这一批，除非其他线程已经因为攒满而发出了
+                deadline = time.monotonic() + self.max_wait_seconds
+                while self._pending is pending:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        batch = self._take()
+                        break
+                    self._cond.wait(remaining)
+
+        if batch is not None:
+            self._run(batch)
+        return future.result()
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": round(self._items / self._batches, 2) if self._batches else 0.0
+            }
+
+    def _take(self) -> List[Tuple[T, Future, Optional[pipeline_metrics.PipelineTrace]]]:
+        batch = self._pending
+        self._pending = []
+        self._batches += 1
+        self._items += len(batch)
+        self._cond.notify_all()
+        return batch
+
+    def _run(self, batch: List[Tuple[T, Future, Optional[pipeline_metrics.PipelineTrace]]]) -> None:
+        error = None
+        results = []
+        collector = pipeline_metrics.StageCollector()
+        try:
+            results = contextvars.Context().run(self._process, [item for item, _, _ in batch], collector)
+            if len(results) != len(batch):
+                raise ValueError(f"{self.name} batch returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            logger.error(f"Error processing {self.name} batch of {len(batch)}: {str(e)}")
+            error = e
+        # 先把这一批（包括失败的一批已经发生的调用）的记录分摊给每个请求所在的作文，再唤醒调用方
+        for (_, _, trace), records in zip(batch, pipeline_metrics.share_records(collector.records, len(batch))):
+            if trace is not None:
+                for record in records:
+                    trace.add(record)
+        for index, (_, future, _) in enumerate(batch):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[index])
+
+    def _process(self, items: List[T], collector: pipeline_metrics.StageCollector) -> List[R]:
+        with pipeline_metrics.collect(collector):
+            return self.process_batch(items)
+
+
+def batching_enabled() -> bool:
+    """SEGMENT_BATCH_MAX_WAIT_MS 大于 0 时开启跨作文的动态批处理"""
+    return float(os.getenv("SEGMENT_BATCH_MAX_WAIT_MS", "0")) > 0
+
+
+def create_batcher(name: str, process_batch: Callable[[List[T]], List[R]]) -> MicroBatcher:
+    """按环境变量 SEGMENT_BATCH_MAX_SIZE / SEGMENT_BATCH_MAX_WAIT_MS 创建批处理器"""
+    return MicroBatcher(
+        name,
+        process_batch,
+        max_batch_size=int(os.getenv("SEGMENT_BATCH_MAX_SIZE", "8")),
+        max_wait_ms=float(os.getenv("SEGMENT_BATCH_MAX_WAIT_MS", "0"))
+    )
@@ -0,0 +1,84 @@
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, Optional
+
+FAST = "fast"
+STRONG = "strong"
+
+# 含有数字、英文或引号的句子通常有专有名词、引用等，交给强模型
+_COMPLEX_CHARS = re.compile(r'[0-9A-Za-z"“”‘’《》]')
+
+
+class CascadeStats:
+    """按任务统计路由到快/强模型的次数、路由原因，以及快模型结果没通过本地校验、升级到强模型的次数和原因"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Counter = Counter()
+        self._route_reasons: Counter = Counter()
+        self._escalations: Counter = Counter()
+
+    def record_route(self, task: str, tier: str, reason: str, count: int = 1) -> None:
+        with self._lock:
+            self._routes[(task, tier)] += count
+            self._route_reasons[(task, reason)] += count
+
+    def record_escalation(self, task: str, reason: str, count: int = 1) -> None:
+        with self._lock:
+            self._escalations[(task, reason)] += count
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            tasks = {task for task, _ in self._routes} | {task for task, _ in self._escalations}
+            result = {}
+            for task in sorted(tasks):
+                fast = self._routes[(task, FAST)]
+                escalated = sum(n for (t, _), n in self._escalations.items() if t == task)
+                result[task] = {
+                    FAST: fast,
+                    STRONG: self._routes[(task, STRONG)],
+                    "escalated": escalated,
+                    "escalation_rate": round(escalated / fast, 4) if fast else 0.0,
+                    "route_reasons": {reason: n for (t, reason), n in self._route_reasons.items() if t == task},
+                    "escalation_reasons": {reason: n for (t, reason), n in self._escalations.items() if t == task},
+                }
+            return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._routes.clear()
+            self._route_reasons.clear()
+            self._escalations.clear()
+
+
+# 创建全局的 CascadeStats 实例
+cascade_stats = CascadeStats()
+
+
+class ModelCascade:
+    """
+    快/强两级模型的路由规则：设置了 SEGMENT_FAST_MODEL_NAME 时开启，
+    不超过 SEGMENT_FAST_MAX_CHARS 个字、且不含数字/英文/引号的句子先交给快模型
+    """
+
+    def __init__(self):
+        self.fast_model_name: Optional[str] = os.getenv("SEGMENT_FAST_MODEL_NAME") or None
+        self.max_fast_chars = int(os.getenv("SEGMENT_FAST_MAX_CHARS", "30"))
+
+    @property
+    def enabled(self) -> bool:
+        return self.fast_model_name is not None
+
+    def route_sentence(self, sentence: str) -> str:
+        if not self.enabled:
+            return STRONG
+        if len(sentence) > self.max_fast_chars:
+            tier, reason = STRONG, "long"
+        elif _COMPLEX_CHARS.search(sentence):
+            tier, reason = STRONG, "complex"
+        else:
+            tier, reason = FAST, "short_simple"
+        cascade_stats.record_route("sentence", tier, reason)
+        return tier
@@ -0,0 +1,239 @@
+import difflib
+import logging
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Set, Tuple
+
+from infrastructure.repositories.segmentation_cache_repository import SegmentationCacheRepository
+
+# 获取 logger
+logger = logging.getLogger(__name__)
+
+# 字符 n-gram 的长度，中文句子用 2-gram
+NGRAM = 2
+# MinHash 签名长度 = BANDS * ROWS；Jaccard 相似度约 0.5 以上的句子有较大概率落进同一个桶
+BANDS = 16
+ROWS = 4
+# 太短的句子 n-gram 太少，相似度不可靠，复用的收益也小
+MIN_CHARS = 8
+# 修改的部分超过新句子的这个比例时不复用，直接走完整流程
+MAX_CHANGED_RATIO = 0.5
+# 加载索引失败后至少等待多少秒再重试
+LOAD_RETRY_SECONDS = 30
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_HAN = re.compile(r'[一-鿿]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _shingles(text: str) -> Set[int]:
+    text = _WHITESPACE.sub('', text)
+    if len(text) < NGRAM:
+        return {zlib.crc32(text.encode("utf-8"))}
+    return {zlib.crc32(text[i:i + NGRAM].encode("utf-8")) for i in range(len(text) - NGRAM + 1)}
+
+
+class MinHasher:
+    """字符 n-gram 的 MinHash 签名；参数由固定的种子生成，同一个句子在不同进程里得到相同的签名"""
+
+    def __init__(self, num_perm: int = BANDS * ROWS, seed: int = 1):
+        generator = random.Random(seed)
+        self._params = [(generator.randrange(1, _MERSENNE_PRIME), generator.randrange(0, _MERSENNE_PRIME))
+                        for _ in range(num_perm)]
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        hashes = _shingles(text)
+        return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self._params)
+
+
+class NearDuplicateIndex:
+    """
+    已经有分词缓存的句子的 MinHash LSH 索引：签名按 BANDS 段分桶，和新句子至少一段相同的句子作为候选，
+    再用 difflib 的相似度确认；启动时（或第一次使用、流水线版本变化时）在后台线程里从 segmentation_cache
+    读出当前版本下的句子建索引，建好之前 find 一律返回 None（按没有相似句子处理），不阻塞请求；
+    之后新算出的句子随缓存写入一起加入索引
+    """
+
+    def __init__(self, repository: Optional[SegmentationCacheRepository] = None):
+        self.repository = repository or SegmentationCacheRepository()
+        self.min_ratio = float(os.getenv("NEAR_DUPLICATE_MIN_RATIO", "0.8"))
+        self.max_sentences = int(os.getenv("NEAR_DUPLICATE_MAX_SENTENCES", "100000"))
+        self._hasher = MinHasher()
+        self._lock = threading.Lock()
+        # 已经建好的索引对应的流水线版本，以及后台正在建索引的版本
+        self._version: Optional[str] = None
+        self._loading_version: Optional[str] = None
+        # 建索引期间新写入缓存的句子，建好后补进索引
+        self._backlog: List[str] = []
+        # 加载失败后，在这个时刻（time.monotonic）之前不重试，避免数据库不可用时每个请求都重新加载
+        self._retry_at = 0.0
+        self._sentences: Set[str] = set()
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], Set[str]] = {}
+
+    def ensure_loaded(self, version: str) -> bool:
+        """这个版本的索引已经建好时返回 True；否则在后台开始建索引（已经在建时不重复）并返回 False"""
+        with self._lock:
+            if self._version == version:
+                return True
+            if self._loading_version != version and time.monotonic() >= self._retry_at:
+                self._loading_version = version
+                self._backlog = []
+                threading.Thread(target=self._load, args=(version,), name="near-duplicate-index", daemon=True).start()
+            return False
+
+    def _load(self, version: str) -> None:
+        """在后台线程里读句子、算签名，全部算完后再持锁替换索引"""
+        try:
+            sentences = self.repository.get_sentences(version, self.max_sentences)
+        except Exception as e:
+            # 加载失败时保留原来的索引（版本不变，find 仍然按没有相似句子处理），
+            # LOAD_RETRY_SECONDS 秒后的下一次 ensure_loaded 重新加载
+            logger.error(f"Error loading near-duplicate index: {str(e)}")
+            with self._lock:
+                if self._loading_version == version:
+                    self._loading_version = None
+                    self._backlog = []
+                    self._retry_at = time.monotonic() + LOAD_RETRY_SECONDS
+            return
+        index_sentences: Set[str] = set()
+        buckets: Dict[Tuple[int, Tuple[int, ...]], Set[str]] = {}
+        for sentence, signature in self._signatures(sentences):
+            if sentence in index_sentences:
+                continue
+            index_sentences.add(sentence)
+            for band in self._bands(signature):
+                buckets.setdefault(band, set()).add(sentence)
+
+        with self._lock:
+            if self._loading_version != version:
+                # 建索引期间版本又变了，丢弃这次的结果
+                return
+            backlog, self._backlog = self._backlog, []
+        backlog_signatures = self._signatures(backlog)
+        with self._lock:
+            if self._loading_version != version:
+                return
+            self._sentences, self._buckets = index_sentences, buckets
+            self._version = version
+            self._loading_version = None
+            self._add_signatures(backlog_signatures)
+            logger.info(f"Loaded {len(self._sentences)} sentences into the near-duplicate index")
+
+    def add_many(self, sentences: List[str], version: str) -> None:
+        with self._lock:
+            if self._loading_version == version:
+                self._backlog.extend(sentences)
+                return
+            if self._version != version:
+                return
+            sentences = [sentence for sentence in sentences if sentence not in self._sentences]
+        signatures = self._signatures(sentences)
+        with self._lock:
+            if self._version == version:
+                self._add_signatures(signatures)
+
+    def _signatures(self, sentences: List[str]) -> List[Tuple[str, Tuple[int, ...]]]:
+        """不持锁计算签名，太短的句子不进索引"""
+        return [(sentence, self._hasher.signature(sentence)) for sentence in sentences if len(sentence) >= MIN_CHARS]
+
+    def _add_signatures(self, signatures: List[Tuple[str, Tuple[int, ...]]]) -> None:
+        for sentence, signature in signatures:
+            if len(self._sentences) >= self.max_sentences:
+                break
+            if sentence in self._sentences:
+                continue
+            self._sentences.add(sentence)
+            for band in self._bands(signature):
+                self._buckets.setdefault(band, set()).add(sentence)
+
+    @staticmethod
+    def _bands(signature: Tuple[int, ...]) -> List[Tuple[int, Tuple[int, ...]]]:
+        return [(band, signature[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+    def find(self, sentence: str) -> Optional[str]:
+        """相似度最高、且不低于 NEAR_DUPLICATE_MIN_RATIO 的已有句子，没有时（包括索引还没建好时）为 None"""
+        if len(sentence) < MIN_CHARS or self._version is None:
+            return None
+        signature = self._hasher.signature(sentence)
+        with self._lock:
+            candidates = set()
+            for band in self._bands(signature):
+                candidates |= self._buckets.get(band, set())
+        candidates.discard(sentence)
+
+        best, best_ratio = None, self.min_ratio
+        for candidate in candidates:
+            matcher = difflib.SequenceMatcher(None, candidate, sentence, autojunk=False)
+            if matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = candidate, ratio
+        return best
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"sentences": len(self._sentences), "buckets": len(self._buckets),
+                    "loading": self._loading_version is not None}
+
+
+def plan_reuse(neighbour: str, sentence: str,
+               spans: List[Tuple[int, int]]) -> Optional[Tuple[Dict[int, int], List[Tuple[int, int]]]]:
+    """
+    对比相似句子和新句子，决定哪些词可以直接复用、哪些片段需要重新分词
+
+    Args:
+        neighbour: 已经分好词的相似句子
+        sentence: 新句子
+        spans: neighbour 里每个词的 (start, len)
+
+    Returns:
+        (可以复用的词的序号 -> 在新句子里的 start, 新句子里需要重新分词的片段 [(start, end)])；
+        修改的部分太多时返回 None
+    """
+    opcodes = difflib.SequenceMatcher(None, neighbour, sentence, autojunk=False).get_opcodes()
+    equal_blocks = [(i1, i2, j1) for tag, i1, i2, j1, _ in opcodes if tag == 'equal']
+
+    # 完全落在没有修改的部分里的词原样复用，只平移位置
+    reused = {}
+    for index, (start, length) in enumerate(spans):
+        for i1, i2, j1 in equal_blocks:
+            if i1 <= start and start + length <= i2:
+                reused[index] = start - i1 + j1
+                break
+
+    changed = [False] * len(sentence)
+    for tag, _, _, j1, j2 in opcodes:
+        if tag in ('replace', 'insert'):
+            for j in range(j1, j2):
+                changed[j] = True
+    # 被修改切断的词不能复用，它在新句子里剩下的部分也要重新分词
+    for index, (start, length) in enumerate(spans):
+        if index in reused:
+            continue
+        for i1, i2, j1 in equal_blocks:
+            for i in range(max(start, i1), min(start + length, i2)):
+                changed[i - i1 + j1] = True
+
+    fragments = []
+    start = None
+    for j, is_changed in enumerate(changed + [False]):
+        if is_changed and start is None:
+            start = j
+        elif not is_changed and start is not None:
+            # 只有标点、数字等没有汉字的片段不需要分词
+            if _HAN.search(sentence[start:j]):
+                fragments.append((start, j))
+            start = None
+
+    if sum(end - start for start, end in fragments) > MAX_CHANGED_RATIO * len(sentence):
+        return None
+    return reused, fragments
+
+
+# 创建全局的 NearDuplicateIndex 实例
+near_duplicate_index = NearDuplicateIndex()
@@ -0,0 +1,106 @@
+import re
+from difflib import SequenceMatcher
+from typing import List, Optional, Tuple
+
+# 模糊匹配时允许的最低相似度
+FUZZY_MATCH_THRESHOLD = 0.6
+
+_IGNORED_CHARS = re.compile(r'[\s，。！？、；：,.!?;:"“”‘’\'（）()《》]')
+_HAN = re.compile(r'[一-鿿]')
+
+
+class OffsetAligner:
+    """
+    在原句中为每个中文片段计算 start/len，替代第三步的 LLM 调用
+
+    从左到右扫描：优先取游标之后第一个未被占用的出现位置（处理重复出现的片段），
+    英文语序和中文不同时再退回到句首查找；找不到原文时做去标点和模糊匹配，
+    仍然找不到的片段返回 None，由调用方决定是否回退到 LLM
+    """
+
+    def align(self, original: str, segments: List[str]) -> List[Optional[Tuple[int, int]]]:
+        used = [False] * len(original)
+        cursor = 0
+        positions = []
+        for segment in segments:
+            position = self._locate(original, segment, used, cursor)
+            if position is not None:
+                start, length = position
+                for i in range(start, start + length):
+                    used[i] = True
+                cursor = start + length
+            positions.append(position)
+        return positions
+
+    def align_one(self, original: str, segment: str, cursor: int = 0) -> Optional[Tuple[int, int]]:
+        return self._locate(original, segment, [False] * len(original), cursor)
+
+    def _locate(self, original: str, segment: str, used: List[bool], cursor: int) -> Optional[Tuple[int, int]]:
+        segment = segment.strip()
+        if not segment:
+            return None
+
+        position = self._locate_exact(original, segment, used, cursor)
+        if position is not None:
+            return position
+
+        # 去掉标点和空白后再精确匹配一次，例如 LLM 给出了 "决定，" 而原文是 "决定"
+        normalized = _IGNORED_CHARS.sub('', segment)
+        if normalized and normalized != segment:
+            position = self._locate_exact(original, normalized, used, cursor)
+            if position is not None:
+                return position
+
+        return self._locate_fuzzy(original, normalized or segment, used, cursor)
+
+    def _locate_exact(self, original: str, segment: str, used: List[bool], cursor: int) -> Optional[Tuple[int, int]]:
+        occurrences = [m.start() for m in re.finditer(f'(?={re.escape(segment)})', original)]
+        if not occurrences:
+            return None
+        free = [start for start in occurrences if not any(used[start:start + len(segment)])]
+        # 先找游标之后的，再找游标之前的；都被占用时允许和其他词共用同一段
+        for candidates in ([s for s in free if s >= cursor], free, occurrences):
+            if candidates:
+                return candidates[0], len(segment)
+        return None
+
+    def _locate_fuzzy(self, original: str, segment: str, used: List[bool], cursor: int) -> Optional[Tuple[int, int]]:
+        best = None
+        best_key = None
+        for length in (len(segment), len(segment) - 1, len(segment) + 1):
+            if length <= 0 or length > len(original):
+                continue
+            for start in range(len(original) - length + 1):
+                if any(used[start:start + length]):
+                    continue
+                ratio = SequenceMatcher(None, segment, original[start:start + length]).ratio()
+                if ratio < FUZZY_MATCH_THRESHOLD:
+                    continue
+                # 相似度优先，其次优先游标之后、离游标近的位置
+                key = (ratio, start >= cursor, -abs(start - cursor))
+                if best_key is None or key > best_key:
+                    best, best_key = (start, length), key
+        return best
+
+    @staticmethod
+    def uncovered_spans(original: str, positions: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """原句中没有被任何片段覆盖、并且含有汉字的连续区间 (start, end)；标点和空白不要求覆盖"""
+        covered = [False] * len(original)
+        for start, length in positions:
+            for i in range(max(start, 0), min(start + length, len(original))):
+                covered[i] = True
+        spans = []
+        start = None
+        for i in range(len(original) + 1):
+            if i < len(original) and not covered[i]:
+                if start is None:
+                    start = i
+                continue
+            if start is not None:
+                if _HAN.search(original[start:i]):
+                    spans.append((start, i))
+                start = None
+        return spans
+
+
+offset_aligner = OffsetAligner()
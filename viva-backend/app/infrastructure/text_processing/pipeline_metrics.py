@@ -0,0 +1,262 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from langchain_core.exceptions import OutputParserException
+
+from infrastructure.text_processing.llm_limiter import llm_limiter
+from infrastructure.text_processing.single_flight import llm_flight, prompt_key
+
+# 每个阶段保留最近多少次耗时用于计算分位数
+LATENCY_SAMPLE_SIZE = 1000
+
+
+@dataclass
+class StageRecord:
+    """一次阶段执行的记录"""
+    stage: str
+    seconds: float = 0.0
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    retries: int = 0
+    parse_failures: int = 0
+    errors: int = 0
+    # 复用了其他线程同时发出的相同 LLM 请求、自己没有调用 LLM 的次数
+    coalesced: int = 0
+
+
+class StageRecorder:
+    """
+    stage() 里使用的记录器：通过 invoke 调用 LLM 时自动记录 token 和解析失败，
+    其他调用方式（如 LLMAgent.chat 只返回文本）用 record_call 记录调用次数
+
+    invoke 经过 llm_flight：相同模型、相同 prompt 的请求同时只发出一次，调用和 token 只记在实际发出请求的一方；
+    实际发出的请求占用 llm_limiter 的名额，受进程内的 LLM 并发上限限制
+    """
+
+    def __init__(self, stage: str):
+        self.record = StageRecord(stage=stage)
+
+    def invoke(self, llm, messages, parser=None):
+        """调用 LangChain 的 chat model，传入 parser 时返回解析结果"""
+        def call():
+            try:
+                with llm_limiter.slot():
+                    output = llm.invoke(messages)
+            except Exception:
+                self.record_call()
+                raise
+            self.record_call(output)
+            return output
+
+        output, shared = llm_flight.do(prompt_key(llm, messages), call)
+        if shared:
+            self.record.coalesced += 1
+        if parser is None:
+            return output
+        try:
+            return parser.parse(output.content)
+        except OutputParserException:
+            self.record.parse_failures += 1
+            raise
+
+    def record_call(self, message: Any = None) -> None:
+        self.record.llm_calls += 1
+        prompt_tokens, completion_tokens = _token_usage(message)
+        self.record.prompt_tokens += prompt_tokens
+        self.record.completion_tokens += completion_tokens
+
+    def retry(self, count: int = 1) -> None:
+        """批量请求里缺失或不合格、需要单独重试的条目数"""
+        self.record.retries += count
+
+    def fail(self) -> None:
+        """阶段内部捕获了异常、没有得到结果时调用"""
+        self.record.errors += 1
+
+
+def _token_usage(message: Any) -> tuple:
+    """从 LangChain 的 AIMessage 中取 token 用量，取不到时为 0"""
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+
+
+class _StageStats:
+    def __init__(self):
+        self.count = 0
+        self.total = StageRecord(stage="")
+        self.max_seconds = 0.0
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLE_SIZE)
+
+    def add(self, record: StageRecord) -> None:
+        self.count += 1
+        for name in ("seconds", "llm_calls", "prompt_tokens", "completion_tokens",
+                     "retries", "parse_failures", "errors", "coalesced"):
+            setattr(self.total, name, getattr(self.total, name) + getattr(record, name))
+        self.max_seconds = max(self.max_seconds, record.seconds)
+        self.latencies.append(record.seconds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        result = asdict(self.total)
+        result.pop("stage")
+        result["total_seconds"] = round(result.pop("seconds"), 4)
+        result.update({
+            "count": self.count,
+            "avg_seconds": round(self.total.seconds / self.count, 4) if self.count else 0.0,
+            "p50_seconds": round(_percentile(latencies, 0.5), 4),
+            "p95_seconds": round(_percentile(latencies, 0.95), 4),
+            "max_seconds": round(self.max_seconds, 4),
+        })
+        return result
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class PipelineMetrics:
+    """进程内按阶段汇总的耗时、token、重试和解析失败统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, _StageStats] = {}
+
+    def add(self, record: StageRecord) -> None:
+        with self._lock:
+            self._stages.setdefault(record.stage, _StageStats()).add(record)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {stage: stats.to_dict() for stage, stats in sorted(self._stages.items())}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages.clear()
+
+
+class PipelineTrace:
+    """一篇作文的处理记录，保存该作文所有阶段的执行情况（多个线程同时写入）"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._stages: Dict[str, _StageStats] = {}
+
+    def add(self, record: StageRecord) -> None:
+        with self._lock:
+            self._stages.setdefault(record.stage, _StageStats()).add(record)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {stage: stats.to_dict() for stage, stats in sorted(self._stages.items())}
+        return {
+            "name": self.name,
+            "wall_seconds": round(time.monotonic() - self._started, 4),
+            "llm_calls": sum(stage["llm_calls"] for stage in stages.values()),
+            "prompt_tokens": sum(stage["prompt_tokens"] for stage in stages.values()),
+            "completion_tokens": sum(stage["completion_tokens"] for stage in stages.values()),
+            "stages": stages,
+        }
+
+
+class StageCollector:
+    """代替作文记录收集阶段记录，用于之后再分摊给多篇作文（如跨作文合并的一批请求）"""
+
+    def __init__(self):
+        self.records: List[StageRecord] = []
+        self._lock = threading.Lock()
+
+    def add(self, record: StageRecord) -> None:
+        with self._lock:
+            self.records.append(record)
+
+
+def share_records(records: List[StageRecord], parts: int) -> List[List[StageRecord]]:
+    """
+    把阶段记录平均分成 parts 份：调用数、token 等计数按整数拆分（余数给前几份），合计与原记录一致；
+    耗时不拆分，每一份都是整批的耗时（每个调用方都等待了这么久）
+    """
+    shares: List[List[StageRecord]] = [[] for _ in range(parts)]
+    counters = ("llm_calls", "prompt_tokens", "completion_tokens", "retries", "parse_failures", "errors", "coalesced")
+    for record in records:
+        for index in range(parts):
+            share = StageRecord(stage=record.stage, seconds=record.seconds)
+            for name in counters:
+                total = getattr(record, name)
+                setattr(share, name, total // parts + (1 if index < total % parts else 0))
+            shares[index].append(share)
+    return shares
+
+
+_current_trace: ContextVar[Optional[PipelineTrace]] = ContextVar("pipeline_trace", default=None)
+_current_stage: ContextVar[Optional[str]] = ContextVar("pipeline_stage", default=None)
+
+# 创建全局的 PipelineMetrics 实例
+pipeline_metrics = PipelineMetrics()
+
+
+@contextmanager
+def trace(name: str) -> Iterator[PipelineTrace]:
+    """在当前上下文中开始一篇作文的记录，其间（包括 DagExecutor 的工作线程里）的 stage 都会记入"""
+    current = PipelineTrace(name)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+
+
+def current_trace() -> Optional[PipelineTrace]:
+    """当前上下文里正在记录的作文，没有时为 None"""
+    return _current_trace.get()
+
+
+@contextmanager
+def collect(collector: Optional[StageCollector] = None) -> Iterator[StageCollector]:
+    """其间的 stage 只计入全局统计和 collector（不传时新建一个），不计入任何作文的记录"""
+    collector = collector or StageCollector()
+    token = _current_trace.set(collector)
+    try:
+        yield collector
+    finally:
+        _current_trace.reset(token)
+
+
+def current_stage() -> Optional[str]:
+    """当前正在执行的阶段名，不在任何 stage() 里时为 None"""
+    return _current_stage.get()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[StageRecorder]:
+    """
+    记录一个阶段：耗时、LLM 调用次数、token、重试和解析失败，
+    同时计入全局统计和当前作文的记录；阶段抛出异常或调用了 fail() 计为一次错误
+    """
+    recorder = StageRecorder(name)
+    stage_token = _current_stage.set(name)
+    started = time.perf_counter()
+    try:
+        yield recorder
+    except Exception:
+        recorder.record.errors += 1
+        raise
+    finally:
+        _current_stage.reset(stage_token)
+        recorder.record.seconds = time.perf_counter() - started
+        pipeline_metrics.add(recorder.record)
+        current = _current_trace.get()
+        if current is not None:
+            current.add(recorder.record)
@@ -0,0 +1,149 @@
+import hashlib
+import logging
+import os
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# 获取当前文件的目录
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# 获取项目根目录（假设 infrastructure 是在项目根目录下的一个文件夹）
+project_root = os.path.abspath(os.path.join(current_dir, '..', '..'))
+
+# 将项目根目录添加到 Python 路径
+sys.path.insert(0, project_root)
+
+from infrastructure.repositories.segmentation_artifact_repository import SegmentationArtifactRepository
+
+# 获取 logger
+logger = logging.getLogger(__name__)
+
+PHASE1 = "phase1"
+PHASE2 = "phase2"
+PHASE3 = "phase3"
+SYNONYMS = "synonyms"
+TRANSFORM = "transform"
+
+
+def chain_version(*parts: str) -> str:
+    """把上一阶段的版本号和本阶段的 prompt、模型等拼起来取哈希，得到本阶段的版本号"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def _sentence_hash(sentence: str) -> str:
+    """与 segmentation_cache.sentence_hash 和数据库里 md5(sentence) 的结果一致"""
+    return hashlib.md5(sentence.encode("utf-8")).hexdigest()
+
+
+class ArtifactRun:
+    """
+    一次 segment_sentences 用到的分阶段产物：开始时一次读出所有句子已有的产物，
+    运行期间各阶段成功的结果先记在内存里，结束时 flush 一次写入；
+    下游阶段失败时作废它用到的上游产物（invalidate），下次重试重新计算上游，不会一直复用同一个坏结果
+    """
+
+    def __init__(self, repository: Optional[SegmentationArtifactRepository], versions: Dict[str, str]):
+        self.repository = repository
+        self.versions = versions
+        self._loaded: Dict[Tuple[str, str, str], Any] = {}
+        self._pending: Dict[Tuple[str, str, str], Any] = {}
+        self._invalidated: Set[Tuple[str, str, str]] = set()
+        self._lock = threading.Lock()
+
+    def load(self, sentences: List[str], versions: Optional[List[str]] = None) -> None:
+        """读出这些句子在给定版本（默认是第一到第三步的版本）下的产物，读取失败时按没有产物处理"""
+        if self.repository is None:
+            return
+        try:
+            loaded = self.repository.get_many(list({_sentence_hash(s) for s in sentences}),
+                                              versions or list(self.versions.values()))
+        except Exception as e:
+            logger.error(f"Error reading segmentation artifacts: {str(e)}")
+            return
+        with self._lock:
+            self._loaded.update(loaded)
+
+    def get(self, sentence: str, phase: str, version: Optional[str] = None) -> Any:
+        """某个句子某个阶段的产物（json），没有时为 None；version 默认是该阶段的版本号"""
+        key = (_sentence_hash(sentence), phase, version or self.versions[phase])
+        with self._lock:
+            return self._pending.get(key, self._loaded.get(key))
+
+    def put(self, sentence: str, phase: str, result: Any, version: Optional[str] = None) -> None:
+        if self.repository is None:
+            return
+        key = (_sentence_hash(sentence), phase, version or self.versions[phase])
+        with self._lock:
+            self._pending[key] = result
+            self._invalidated.discard(key)
+
+    def invalidate(self, sentence: str, phase: str, version: Optional[str] = None) -> None:
+        """作废某个句子某个阶段的产物：本次运行不再使用，flush 时从数据库删除"""
+        if self.repository is None:
+            return
+        key = (_sentence_hash(sentence), phase, version or self.versions[phase])
+        with self._lock:
+            self._pending.pop(key, None)
+            if self._loaded.pop(key, None) is not None:
+                self._invalidated.add(key)
+
+    def flush(self) -> None:
+        """删除作废的产物、写入本次运行新产生的产物；失败不影响分词结果"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            invalidated, self._invalidated = self._invalidated, set()
+        if self.repository is None:
+            return
+        try:
+            if invalidated:
+                self.repository.delete_many(invalidated)
+                logger.info(f"Invalidated {len(invalidated)} segmentation artifacts after downstream failures")
+            if pending:
+                self.repository.upsert_many(pending)
+        except Exception as e:
+            logger.error(f"Error writing segmentation artifacts: {str(e)}")
+
+
+class SegmentationArtifacts:
+    """
+    分阶段的分词产物，以 md5(句子) + 阶段 + 阶段版本号 为键存在 segmentation_artifacts 表里：
+    某个阶段失败时前面阶段的结果已经保存，重试或重跑时从最后一个成功的阶段继续；
+    某一步的 prompt 改动只影响这一步和之后的阶段
+    """
+
+    def __init__(self, repository: Optional[SegmentationArtifactRepository] = None, enabled: bool = True):
+        self.repository = (repository or SegmentationArtifactRepository()) if enabled else None
+
+    def start_run(self, sentences: List[str], versions: Dict[str, str]) -> ArtifactRun:
+        run = ArtifactRun(self.repository, versions)
+        run.load(sentences)
+        return run
+
+    def prune(self, phase_versions: Dict[str, str], ttl: timedelta) -> int:
+        """
+        清理旧产物：第一到第三步不是当前版本的（prompt 或模型改动后永远不会再用到），
+        以及超过 ttl 没有更新的（同义词扩展的版本取决于分词结果，无法列举，按时间清理）
+        """
+        if self.repository is None:
+            return 0
+        deleted = self.repository.delete_stale(phase_versions, datetime.now(timezone.utc) - ttl)
+        logger.info(f"Pruned {deleted} segmentation artifacts")
+        return deleted
+
+
+def artifact_ttl() -> timedelta:
+    return timedelta(days=float(os.getenv("SEGMENT_ARTIFACT_TTL_DAYS", "7")))
+
+
+if __name__ == "__main__":
+    # 清理旧版本和过期的分阶段产物：python infrastructure/text_processing/segmentation_artifacts.py
+    from infrastructure.text_processing.segmentation_service import SegmentationService
+
+    segmentation_service = SegmentationService()
+    print(f"删除产物条数: {segmentation_service.artifacts.prune(segmentation_service.phase_versions(), artifact_ttl())}")
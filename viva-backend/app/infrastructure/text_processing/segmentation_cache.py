@@ -0,0 +1,154 @@
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+# 获取当前文件的目录
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# 获取项目根目录（假设 infrastructure 是在项目根目录下的一个文件夹）
+project_root = os.path.abspath(os.path.join(current_dir, '..', '..'))
+
+# 将项目根目录添加到 Python 路径
+sys.path.insert(0, project_root)
+
+from infrastructure.repositories.segmentation_cache_repository import SegmentationCacheRepository
+from infrastructure.text_processing.segmentation_service import SynonymExpansionResult
+
+# 获取 logger
+logger = logging.getLogger(__name__)
+
+
+def sentence_hash(sentence: str) -> str:
+    """与数据库里 md5(sentence) 的结果一致"""
+    return hashlib.md5(sentence.encode("utf-8")).hexdigest()
+
+
+class SegmentationCache:
+    """
+    以 md5(句子) + 流水线版本号 为键的分词结果缓存，存在 Postgres 的 segmentation_cache 表里
+    命中时直接复用 SynonymExpansionResult，不再调用 LLM
+
+    读缓存不写数据库：每个条目的命中次数先在内存里累加，由后台线程每隔
+    SEGMENT_CACHE_HIT_FLUSH_SECONDS 秒批量写回 hit_count（进程退出时未写回的次数会丢失，hit_count 只作参考）
+    """
+    # 命中统计在进程内所有实例间共享
+    _stats_lock = threading.Lock()
+    _hits = 0
+    _misses = 0
+    # (sentence_hash, version) -> 还没写回数据库的命中次数
+    _pending_hits: Dict[Tuple[str, str], int] = {}
+    _flusher: Optional[threading.Thread] = None
+
+    def __init__(self, repository: Optional[SegmentationCacheRepository] = None):
+        self.repository = repository or SegmentationCacheRepository()
+
+    def get_many(self, sentences: List[str], version: str) -> Dict[str, SynonymExpansionResult]:
+        """返回 句子 -> 缓存结果，未命中的句子不在返回值里"""
+        hashes = {sentence: sentence_hash(sentence) for sentence in sentences}
+        try:
+            rows = self.repository.get_by_hashes(list(set(hashes.values())), version)
+        except Exception as e:
+            # 缓存不可用时不影响主流程，全部按未命中处理
+            logger.error(f"Error reading segmentation cache: {str(e)}")
+            rows = {}
+
+        results = {}
+        for sentence, hash_value in hashes.items():
+            if hash_value in rows:
+                results[sentence] = SynonymExpansionResult.model_validate(rows[hash_value])
+        self._record(hits=len(results), misses=len(hashes) - len(results))
+        self._record_hits([hashes[sentence] for sentence in results], version)
+        return results
+
+    def contains_many(self, sentences: List[str], version: str) -> Set[str]:
+        """有缓存结果的句子，只查询是否存在，不读取结果、不计入命中统计；缓存不可用时为空"""
+        hashes = {sentence: sentence_hash(sentence) for sentence in sentences}
+        try:
+            existing = self.repository.get_existing_hashes(list(set(hashes.values())), version)
+        except Exception as e:
+            logger.error(f"Error reading segmentation cache: {str(e)}")
+            return set()
+        return {sentence for sentence, hash_value in hashes.items() if hash_value in existing}
+
+    def put_many(self, results: Dict[str, SynonymExpansionResult], version: str) -> None:
+        try:
+            self.repository.upsert_many(
+                {sentence_hash(sentence): result.model_dump(mode="json") for sentence, result in results.items()},
+                version
+            )
+        except Exception as e:
+            logger.error(f"Error writing segmentation cache: {str(e)}")
+
+    def invalidate(self, current_version: Optional[str] = None) -> int:
+        """
+        清理缓存：传入当前版本号时只删除其他版本（prompt 或模型改动后的旧结果），否则全部删除
+        """
+        if current_version:
+            deleted = self.repository.delete_except_version(current_version)
+        else:
+            deleted = self.repository.delete_all()
+        logger.info(f"Invalidated {deleted} segmentation cache entries")
+        return deleted
+
+    def _record_hits(self, hashes: List[str], version: str) -> None:
+        if not hashes:
+            return
+        with self._stats_lock:
+            for hash_value in hashes:
+                key = (hash_value, version)
+                SegmentationCache._pending_hits[key] = SegmentationCache._pending_hits.get(key, 0) + 1
+            if SegmentationCache._flusher is None:
+                SegmentationCache._flusher = threading.Thread(
+                    target=self._flush_loop, args=(self.repository,), name="segmentation-cache-hits", daemon=True)
+                SegmentationCache._flusher.start()
+
+    @classmethod
+    def _flush_loop(cls, repository: SegmentationCacheRepository) -> None:
+        interval = float(os.getenv("SEGMENT_CACHE_HIT_FLUSH_SECONDS", "30"))
+        while True:
+            time.sleep(interval)
+            cls.flush_hits(repository)
+
+    @classmethod
+    def flush_hits(cls, repository: SegmentationCacheRepository) -> None:
+        """把内存里累加的命中次数一次性写回 hit_count，写入失败时丢弃这一批"""
+        with cls._stats_lock:
+            pending, cls._pending_hits = cls._pending_hits, {}
+        if not pending:
+            return
+        try:
+            repository.add_hits(pending)
+        except Exception as e:
+            logger.error(f"Error flushing segmentation cache hit counts: {str(e)}")
+
+    @classmethod
+    def _record(cls, hits: int, misses: int) -> None:
+        with cls._stats_lock:
+            cls._hits += hits
+            cls._misses += misses
+
+    @classmethod
+    def stats(cls) -> Dict[str, float]:
+        with cls._stats_lock:
+            total = cls._hits + cls._misses
+            return {
+                "hits": cls._hits,
+                "misses": cls._misses,
+                "hit_rate": cls._hits / total if total else 0.0
+            }
+
+
+if __name__ == "__main__":
+    # prompt 改动后清理旧版本的缓存：python infrastructure/text_processing/segmentation_cache.py [--all]
+    from infrastructure.text_processing.segmentation_service import SegmentationService
+
+    if "--all" in sys.argv:
+        print(f"删除缓存条数: {SegmentationCache().invalidate()}")
+    else:
+        version = SegmentationService().pipeline_version()
+        print(f"当前流水线版本: {version}")
+        print(f"删除缓存条数: {SegmentationCache().invalidate(version)}")
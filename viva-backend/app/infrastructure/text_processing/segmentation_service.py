@@ -1,12 +1,14 @@
 from dataclasses import dataclass
+import hashlib
 import json
 import logging
 import os
-from typing import List, Dict, Optional
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
 import anthropic
 from dotenv import load_dotenv
 import re
 import sys
+import threading
 from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 from langchain.output_parsers import PydanticOutputParser
@@ -26,7 +28,26 @@ sys.path.insert(0, project_root)
 # 现在你可以导入 infrastructure 模块了
 from infrastructure.english.coca import CocaService
 from infrastructure.english.word_net import WordNetService
+from infrastructure.english.inflection import InflectionService
 from infrastructure.text.llm_agent import LLMAgent
+from infrastructure.text.prompt_registry import (
+    prompt_registry, SEGMENT_PROMPT1, SEGMENT_PROMPT2, SEGMENT_PROMPT3, SEGMENT_PROMPT4, SEGMENT_PROMPT5,
+    SEGMENT_PROMPT6, SEGMENT_PROMPT7, SEGMENT_PROMPT8, WORDNET_PROMPT1, WORDNET_PROMPT2
+)
+from infrastructure.text_processing.dag_executor import DagExecutor, NodeFailure
+from infrastructure.text_processing.offset_aligner import offset_aligner
+from infrastructure.text_processing.pipeline_metrics import stage
+from infrastructure.text_processing.llm_limiter import llm_limiter
+from infrastructure.text_processing.micro_batcher import MicroBatcher, batching_enabled, create_batcher
+from infrastructure.text_processing.model_cascade import FAST, STRONG, ModelCascade, cascade_stats
+from infrastructure.text_processing.hybrid_segmenter import hybrid_segmenter
+from infrastructure.english.cedict import CedictService
+from infrastructure.text_processing.segmentation_artifacts import (
+    PHASE1, PHASE2, PHASE3, SYNONYMS, TRANSFORM, ArtifactRun, SegmentationArtifacts, chain_version
+)
+from infrastructure.text_processing.deadline import DeadlineExceeded, check_optional_stage
+from infrastructure.text_processing.near_duplicate_index import plan_reuse
+from infrastructure.task.admission_controller import CALLS_PER_SENTENCE
 
 # 加载环境变量
 load_dotenv()
@@ -60,6 +81,13 @@ class WordWithIndexAndSynonym(BaseModel):
     chinese: str = Field(description="corresponding chinese word from original sentence")
     start: int = Field(description="chinese word index start in original sentence")
     len: int = Field(description="chinese word length")
+class PackedSentenceSegmentation(BaseModel):
+    index: int = Field(description="the index of the sentence I give you")
+    original: str = Field(description="The original Chinese sentence, unchanged")
+    translation: str = Field(description="Natural English translation of the sentence")
+    words: List[str] = Field(description="English segments of the translation, following English word order")
+class PackedSegmentationResult(BaseModel):
+    sentences: List[PackedSentenceSegmentation] = Field(description="one result for every sentence I give you")
 class SegmentationResult(BaseModel):
     original: str = Field(description="The original Chinese sentence")
     translation: str = Field(description="The English translation of the sentence")
@@ -72,10 +100,45 @@ class SynonymExpansionResult(BaseModel):
     original: str = Field(description="The original Chinese word")
     translation: str = Field(description="The English translation of the sentence")
     words: List[WordWithIndexAndSynonym] = Field(description="List of word mappings with English and Chinese")
+    # 离截止时间太近、跳过了同义词扩展或词形变换时为 True，此时每个词只有第三步的译词
+    partial: bool = Field(default=False, description="Whether synonym expansion was skipped")
 class WordTransformationResult(BaseModel):
     words_transformation: List[str] = Field(description="converted words from the original words")
+class WordTransformationItem(BaseModel):
+    id: int = Field(description="the id of the item I give you")
+    words_transformation: List[str] = Field(description="converted words from the original words of the item, in the same order")
+class BatchWordTransformationResult(BaseModel):
+    items: List[WordTransformationItem] = Field(description="one result for every item I give you")
+class HybridSpanResolution(BaseModel):
+    id: int = Field(description="the id of the word I give you")
+    english: str = Field(description="the English for the word in this sentence, empty if it has no meaning of its own")
+    pos: POS = Field(description="Part of speech tag. Must be one of: n (noun), v (verb), a (adjective), r (adverb).")
+class HybridResolutionResult(BaseModel):
+    spans: List[HybridSpanResolution] = Field(description="one result for every word I give you")
+class NearDuplicateFragment(BaseModel):
+    id: int = Field(description="the id of the fragment I give you")
+    words: List[Word] = Field(description="the words in this fragment, in order, empty if it has none")
+class NearDuplicateResolution(BaseModel):
+    fragments: List[NearDuplicateFragment] = Field(description="one result for every fragment I give you")
+
+# 一次性处理的作文长度上限，更长的文本（日记、书的章节等）按长文档模式分块处理
+ESSAY_MAX_CHARS = 1500
+
+# 影响分词结果的 prompt，用于计算流水线版本号
+PIPELINE_PROMPTS = [
+    SEGMENT_PROMPT1,
+    SEGMENT_PROMPT2,
+    SEGMENT_PROMPT3,
+    SEGMENT_PROMPT4,
+    SEGMENT_PROMPT5,
+    WORDNET_PROMPT1,
+    WORDNET_PROMPT2,
+]
 
 class SegmentationService:
+    # 所有实例共用的第一步批处理器，合并不同作文（不同用户）同时发出的请求
+    _phase1_batcher: MicroBatcher = None
+    _batcher_lock = threading.Lock()
 
     def __init__(self):
         self.chat_agent = LLMAgent()
@@ -84,141 +147,864 @@ class SegmentationService:
         self.parser2 = PydanticOutputParser(pydantic_object=SegmentationResult)
         self.parser3 = PydanticOutputParser(pydantic_object=FinalSegmentationResult)
         self.parser4 = PydanticOutputParser(pydantic_object=WordTransformationResult)
+        self.parser5 = PydanticOutputParser(pydantic_object=BatchWordTransformationResult)
+        self.parser6 = PydanticOutputParser(pydantic_object=PackedSegmentationResult)
+        self.parser7 = PydanticOutputParser(pydantic_object=HybridResolutionResult)
+        self.parser8 = PydanticOutputParser(pydantic_object=NearDuplicateResolution)
+        # 第一步合并请求时每个请求的 token 预算，0 表示每个句子单独请求
+        self.pack_token_budget = int(os.getenv("SEGMENT_PACK_TOKEN_BUDGET", "0"))
+        # 两级模型：简单的句子和词形变化先用快模型，本地校验不通过时再用强模型
+        self.cascade = ModelCascade()
+        self.fast_llm = ChatOpenAI(model=self.cascade.fast_model_name, temperature=0,
+                                   openai_api_key=os.getenv("OPENAI_API_KEY")) if self.cascade.enabled else None
+        # hybrid 模式：jieba + 离线汉英词典先分词，LLM 只处理有歧义或词典里没有的词
+        self.hybrid = os.getenv("SEGMENT_MODE", "llm") == "hybrid"
+        if self.hybrid and not CedictService.is_available():
+            logger.warning("SEGMENT_MODE=hybrid but CEDICT_FILE is not available, falling back to LLM segmentation")
+            self.hybrid = False
+        # 相似句子复用：没有修改的词沿用相似句子的分词结果，只有修改过的片段交给 LLM
+        self.near_duplicate = os.getenv("NEAR_DUPLICATE_ENABLED", "false").lower() == "true"
+        # 分阶段保存的产物，失败的句子重试时从最后一个成功的阶段继续
+        self.artifacts = SegmentationArtifacts(enabled=os.getenv("SEGMENT_ARTIFACTS_ENABLED", "true").lower() == "true")
+
+    def active_prompts(self) -> List[str]:
+        """当前配置用到的 prompt：PIPELINE_PROMPTS 加上开启的功能（合并请求、hybrid、相似句子复用）用到的"""
+        uses_packed_prompt = self.pack_token_budget or batching_enabled()
+        return PIPELINE_PROMPTS + ([SEGMENT_PROMPT6] if uses_packed_prompt else []) \
+            + ([SEGMENT_PROMPT7] if self.hybrid else []) + ([SEGMENT_PROMPT8] if self.near_duplicate else [])
+
+    def pipeline_version(self) -> str:
+        """
+        分词流水线的版本号：所有 prompt 版本和模型名的哈希，任何一个变化都会得到新的版本号
+        """
+        digest = hashlib.sha256()
+        for prompt_name in self.active_prompts():
+            digest.update(prompt_registry.version(prompt_name).encode("utf-8"))
+        digest.update(str(os.getenv("LLM_MODEL_TYPE")).encode("utf-8"))
+        digest.update(str(os.getenv("LLM_MODEL_NAME_FOR_BASIC_CHAT")).encode("utf-8"))
+        if self.cascade.enabled:
+            digest.update(f"{self.cascade.fast_model_name}:{self.cascade.max_fast_chars}".encode("utf-8"))
+        if self.hybrid:
+            digest.update(f"hybrid:{hybrid_segmenter.version()}".encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    def phase_versions(self) -> Dict[str, str]:
+        """
+        强模型流程第一到第三步各自的版本号：每一步的版本号包含前一步的版本号，
+        所以改动某一步的 prompt 只会让这一步和之后的产物失效
+        """
+        model = f"{os.getenv('LLM_MODEL_TYPE')}:{os.getenv('LLM_MODEL_NAME_FOR_BASIC_CHAT')}"
+        uses_packed_prompt = self.pack_token_budget or batching_enabled()
+        phase1 = chain_version(PHASE1, prompt_registry.version(SEGMENT_PROMPT1), model,
+                               prompt_registry.version(SEGMENT_PROMPT6) if uses_packed_prompt else "")
+        phase2 = chain_version(phase1, prompt_registry.version(SEGMENT_PROMPT2), model)
+        phase3 = chain_version(phase2, prompt_registry.version(SEGMENT_PROMPT3), model)
+        return {PHASE1: phase1, PHASE2: phase2, PHASE3: phase3}
 
-    def validate_essay(self, essay: str) -> None:
+    def _expansion_versions(self, segmentation_result: FinalSegmentationResult) -> Tuple[str, str]:
         """
-        验证作文内容是否符合要求
+        同义词扩展两步的版本号：取决于第三步的分词结果本身（不论它来自哪个流程）和扩展用到的 prompt、模型
+        """
+        model = str(os.getenv("LLM_MODEL_NAME_FOR_BASIC_CHAT"))
+        words = json.dumps([(word.english, word.pos.value) for word in segmentation_result.words], ensure_ascii=False)
+        synonyms = chain_version(SYNONYMS, words, prompt_registry.version(WORDNET_PROMPT1),
+                                 prompt_registry.version(WORDNET_PROMPT2), model)
+        transform = chain_version(synonyms, prompt_registry.version(SEGMENT_PROMPT4),
+                                  prompt_registry.version(SEGMENT_PROMPT5), model, str(self.cascade.fast_model_name))
+        return synonyms, transform
+
+    def validate_essay(self, essay: str, allow_long: bool = False) -> None:
+        """
+        验证作文内容是否符合要求；allow_long 时允许长文档模式的长度（LONG_DOCUMENT_MAX_CHARS）
         """
         if not essay.strip():
             raise ValueError("作文内容不能为空。")
-        if len(essay) > 1500:
-            raise ValueError("作文内容不能超过1500个字。")
+        max_chars = int(os.getenv("LONG_DOCUMENT_MAX_CHARS", "20000")) if allow_long else ESSAY_MAX_CHARS
+        if len(essay) > max_chars:
+            raise ValueError(f"作文内容不能超过{max_chars}个字。")
+
+    @staticmethod
+    def is_long_document(essay: str) -> bool:
+        """超过一次性处理上限的文本需要按长文档模式分块处理"""
+        return len(essay) > ESSAY_MAX_CHARS
 
     def split_into_sentences(self, essay: str) -> List[str]:
         """
         将作文分割成句子
         """
+        return list(self.iter_sentences(essay))
+
+    @staticmethod
+    def iter_sentences(essay: str) -> Iterator[str]:
+        """
+        逐个产生句子，不需要一次性拿到全部分句结果；
+        句子以。！？结尾（分隔符留在句子里），最后没有结尾标点的部分也算一句
+        """
         # 使用正则表达式分割句子，这里的模式可能需要根据实际情况调整
-        sentences = re.split(r'([。！？])', essay)
-        # 将分割符加回句子中
-        sentences = [''.join(i) for i in zip(sentences[0::2], sentences[1::2] + [''])]
-        return [s.strip() for s in sentences if s.strip()]
-
-    def segment_sentence(self, sentence: str) -> SynonymExpansionResult:
-        process1_result = self._translate2English_and_segment(sentence)
-        process2_result = self._fill_chinese_segment(process1_result)
-        process3_result = self._fill_chinese_segment_index(process2_result)
-        expanded_result = self.expand_synonyms(process3_result)
-        return expanded_result
+        for match in re.finditer(r'[^。！？]*[。！？]|[^。！？]+', essay):
+            sentence = match.group(0).strip()
+            if sentence:
+                yield sentence
+
+    @staticmethod
+    def iter_sentence_chunks(essay: str, chunk_size: int) -> Iterator[List[str]]:
+        """按 chunk_size 个句子一组产生句子，用于长文档分块处理"""
+        chunk = []
+        for sentence in SegmentationService.iter_sentences(essay):
+            chunk.append(sentence)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def segment_sentence(self, sentence: str) -> Optional[SynonymExpansionResult]:
+        """
+        单个句子分词：和整篇作文走同一个流水线（segment_sentences），失败时为 None；
+        缓存和相同句子的合并由 EssayService.segment_with_cache 负责
+        """
+        return self.segment_sentences([sentence])[0]
         
     def _translate2English_and_segment(self, sentence: str):
         """
         第一步：使用LLM分词
         """
         sentence = sentence.strip()
-        prompt_file = os.getenv("SEGMENT_PROMPT_FILE1")
-        if not prompt_file:
-            raise ValueError("SEGMENT_PROMPT_FILE is not set in environment variables.")
-        prompt = open(prompt_file, "r").read()
-        prompt = prompt.replace("{sentence}", sentence)
-        response = self.chat_agent.chat(prompt)
-        logger.error(f"Segment phase1 LLM original response: {response}")
+        prompt = prompt_registry.text(SEGMENT_PROMPT1).replace("{sentence}", sentence)
+        with stage("phase1") as recorder:
+            # LLMAgent 只返回文本，拿不到 token 用量
+            with llm_limiter.slot():
+                response = self.chat_agent.chat(prompt)
+            recorder.record_call()
+            if response is None:
+                recorder.fail()
+        logger.debug(f"Segment phase1 LLM original response: {response}")
         return response
 
+    def _segment_fast(self, sentence: str) -> Optional[FinalSegmentationResult]:
+        """
+        用快模型完成前三步（第三步本来就在本地对齐），结果通过本地校验才返回，否则返回 None 交给强模型
+        """
+        sentence = sentence.strip()
+        prompt = prompt_registry.text(SEGMENT_PROMPT1).replace("{sentence}", sentence)
+        with stage("phase1_fast") as recorder:
+            try:
+                process1_result = recorder.invoke(self.fast_llm, prompt).content
+            except Exception as e:
+                logger.error(f"Error in fast translation and segmentation: {str(e)}")
+                recorder.fail()
+                cascade_stats.record_escalation("sentence", "phase1_error")
+                return None
+
+        messages = prompt_registry.template(SEGMENT_PROMPT2, self.parser2).format_messages(
+            process1_result=str(process1_result))
+        with stage("phase2_fast") as recorder:
+            try:
+                process2_result = recorder.invoke(self.fast_llm, messages, self.parser2)
+            except Exception as e:
+                logger.error(f"Error in fast filling Chinese segment: {str(e)}")
+                recorder.fail()
+                cascade_stats.record_escalation("sentence", "phase2_unparseable")
+                return None
+
+        problem = self._fast_segmentation_problem(sentence, process1_result, process2_result)
+        aligned_result = None if problem else self._align_chinese_segment_index(process2_result)
+        if problem is None and aligned_result is None:
+            problem = "alignment_failed"
+        # 对齐后的片段要覆盖原句里所有的汉字，漏掉了部分句子的结果不能用
+        if problem is None and offset_aligner.uncovered_spans(
+                sentence, [(word.start, word.len) for word in aligned_result.words]):
+            problem = "sentence_not_covered"
+        if problem:
+            logger.info(f"Fast model result rejected ({problem}), escalating: {sentence}")
+            cascade_stats.record_escalation("sentence", problem)
+            return None
+        return aligned_result
+
+    def _segment_hybrid(self, sentence: str) -> Optional[FinalSegmentationResult]:
+        """
+        hybrid 模式的前三步：jieba 切词、离线词典给出候选，只有一个候选的词直接确定，
+        其余的词一次性交给 LLM（有快模型时用快模型）；LLM 失败或结果不完整时返回 None，交给完整的 LLM 流程
+
+        不生成整句翻译，translation 为空字符串
+        """
+        sentence = sentence.strip()
+        with stage("hybrid_local"):
+            spans = hybrid_segmenter.segment(sentence)
+        pending = [i for i, span in enumerate(spans) if span.resolved is None]
+
+        resolutions = {}
+        if pending:
+            spans_str = json.dumps([
+                {"id": i, "chinese": spans[span_index].chinese, "pos": spans[span_index].pos,
+                 "candidates": spans[span_index].candidates}
+                for i, span_index in enumerate(pending)
+            ], ensure_ascii=False, indent=2)
+            messages = prompt_registry.template(SEGMENT_PROMPT7, self.parser7).format_messages(
+                sentence=sentence, spans=spans_str)
+            with stage("hybrid_resolve") as recorder:
+                try:
+                    result = recorder.invoke(self.fast_llm or self.llm, messages, self.parser7)
+                except Exception as e:
+                    logger.error(f"Error in resolving hybrid segmentation spans: {str(e)}")
+                    recorder.fail()
+                    cascade_stats.record_escalation("hybrid", "resolve_error")
+                    return None
+            resolutions = {pending[item.id]: item for item in result.spans if 0 <= item.id < len(pending)}
+            if len(resolutions) != len(pending):
+                cascade_stats.record_escalation("hybrid", "resolve_incomplete")
+                return None
+        cascade_stats.record_route("hybrid", FAST, "resolve_spans" if pending else "dictionary_only")
+
+        words = []
+        for i, span in enumerate(spans):
+            if i in resolutions:
+                english, pos = resolutions[i].english.strip(), resolutions[i].pos
+            else:
+                english, pos = span.resolved, span.pos
+            if not english:
+                continue
+            words.append(WordWithIndex(english=english, pos=pos, chinese=span.chinese, start=span.start, len=span.len))
+        if not words:
+            cascade_stats.record_escalation("hybrid", "no_words")
+            return None
+        return FinalSegmentationResult(original=sentence, translation="", words=words)
+
+    @staticmethod
+    def _fast_segmentation_problem(sentence: str, process1_result: str,
+                                   process2_result: SegmentationResult) -> Optional[str]:
+        """本地校验快模型的结果，返回不通过的原因"""
+        match = re.search(r'\{.*\}', process1_result or "", re.S)
+        try:
+            process1_words = [word["english"] for word in json.loads(match.group(0))["words"]] if match else None
+        except (ValueError, KeyError, TypeError):
+            process1_words = None
+        if not process1_words:
+            return "phase1_unparseable"
+        if process2_result.original.strip() != sentence:
+            return "original_changed"
+        # 第二步只补充中文和词性，不能增删英文分词
+        if [word.english for word in process2_result.words] != process1_words:
+            return "words_mismatch"
+        # 每个英文分词都要对应原句中真实存在的中文片段
+        if any(not word.chinese.strip() or word.chinese.strip() not in sentence for word in process2_result.words):
+            return "span_not_in_sentence"
+        return None
+
+    @classmethod
+    def get_phase1_batcher(cls) -> MicroBatcher:
+        with cls._batcher_lock:
+            if cls._phase1_batcher is None:
+                cls._phase1_batcher = create_batcher("phase1", cls._process_phase1_batch)
+            return cls._phase1_batcher
+
+    @staticmethod
+    def _process_phase1_batch(requests: List[Tuple["SegmentationService", str]]) -> List[Optional[str]]:
+        """
+        执行一批第一步请求：只有一个句子时照常单独请求，否则用合并的 prompt；
+        所有实例的模型和 prompt 都来自同样的环境变量，用这一批第一个请求的实例发出请求
+        """
+        service = requests[0][0]
+        sentences = [sentence for _, sentence in requests]
+        if len(sentences) == 1:
+            return [service._translate2English_and_segment(sentences[0])]
+        return service._translate2English_and_segment_packed(sentences)
+
+    def _translate2English_and_segment_batched(self, sentence: str):
+        """通过动态批处理执行第一步，合并请求里缺失或失败的句子单独重试"""
+        try:
+            result = self.get_phase1_batcher().submit((self, sentence))
+        except Exception as e:
+            logger.error(f"Error in batched translation and segmentation: {str(e)}")
+            result = None
+        return result or self._translate2English_and_segment(sentence)
+
+    def estimate_llm_calls(self, sentences: List[str]) -> int:
+        """
+        这些句子（按未命中缓存计算）最多需要的 LLM 调用数，用于准入控制和批量重新分词的限速；
+        开启合并请求时第一步按合并后的请求数计算
+        """
+        calls = len(sentences) * CALLS_PER_SENTENCE
+        if self.pack_token_budget and not self.hybrid:
+            calls -= sum(len(pack) - 1 for pack in self._pack_sentences(sentences))
+        return calls
+
+    def _pack_sentences(self, sentences: List[str]) -> List[List[int]]:
+        """
+        把连续的句子按 token 预算分组，返回每组句子的序号；只有一个句子的组不合并，仍然单独请求
+        """
+        packs = []
+        current = []
+        current_tokens = 0
+        for index, sentence in enumerate(sentences):
+            tokens = self._estimate_tokens(sentence)
+            if current and current_tokens + tokens > self.pack_token_budget:
+                packs.append(current)
+                current, current_tokens = [], 0
+            current.append(index)
+            current_tokens += tokens
+        if current:
+            packs.append(current)
+        return [pack for pack in packs if len(pack) > 1]
+
+    @staticmethod
+    def _estimate_tokens(sentence: str) -> int:
+        """粗略估计一个句子在输入和输出里占用的 token：中文每个字约 1 个 token，翻译和分词结果约为原文的 3 倍"""
+        return len(sentence) * 4
+
+    def _translate2English_and_segment_packed(self, sentences: List[str]) -> List[Optional[str]]:
+        """
+        第一步的合并版本：一次请求翻译并分词多个连续句子，再按 index 拆回每个句子，
+        返回与 sentences 一一对应、和单句请求格式相同的结果；缺失或原句对不上的位置为 None
+        """
+        sentences_str = json.dumps([{"index": i, "sentence": sentence.strip()} for i, sentence in enumerate(sentences)],
+                                   ensure_ascii=False, indent=2)
+        prompt = prompt_registry.template(SEGMENT_PROMPT6, self.parser6)
+        messages = prompt.format_messages(sentences=sentences_str)
+
+        results: List[Optional[str]] = [None] * len(sentences)
+        with stage("phase1_packed") as recorder:
+            try:
+                packed = recorder.invoke(self.llm, messages, self.parser6)
+            except Exception as e:
+                logger.error(f"Error in packed translation and segmentation: {str(e)}")
+                recorder.fail()
+                recorder.retry(len(sentences))
+                return results
+
+            for item in packed.sentences:
+                if not 0 <= item.index < len(sentences) or item.original.strip() != sentences[item.index].strip():
+                    continue
+                if not item.words:
+                    continue
+                results[item.index] = json.dumps({
+                    "original": item.original,
+                    "translation": item.translation,
+                    "words": [{"english": word} for word in item.words]
+                }, ensure_ascii=False, indent=2)
+            missing = len([result for result in results if result is None])
+            if missing:
+                logger.warning(f"Packed segmentation missing {missing} of {len(sentences)} sentences, retrying them alone")
+                recorder.retry(missing)
+        return results
+
     def _fill_chinese_segment(self, process1_result) -> SegmentationResult:
         """
         第二步：使用LLM填充中文分词
         """
-        prompt_file = os.getenv("SEGMENT_PROMPT_FILE2")
-        if not prompt_file:
-            raise ValueError("SEGMENT_PROMPT_FILE is not set in environment variables.")
-        
-        with open(prompt_file, "r") as file:
-            prompt_template = file.read()
-
-        prompt = ChatPromptTemplate.from_template(prompt_template)
+        prompt = prompt_registry.template(SEGMENT_PROMPT2, self.parser2)
 
         messages = prompt.format_messages(
-            process1_result=str(process1_result),
-            format_instructions=self.parser2.get_format_instructions()
+            process1_result=str(process1_result)
         )
 
-        try:
-            output = self.llm(messages)
-            logger.error(f"Segment phase2 LLM original response: {output.content}")
-            result = self.parser2.parse(output.content)
-            logger.info(f"Successfully parsed result: {result}")
+        with stage("phase2") as recorder:
+            try:
+                result = recorder.invoke(self.llm, messages, self.parser2)
+                logger.debug(f"Successfully parsed result: {result}")
 
-            return result
-        except Exception as e:
-            logger.error(f"Error in filling Chinese segment: {str(e)}")
-            return None
+                return result
+            except Exception as e:
+                logger.error(f"Error in filling Chinese segment: {str(e)}")
+                recorder.fail()
+                return None
 
     def _fill_chinese_segment_index(self, process2_result) -> FinalSegmentationResult:
         """
-        第三步：使用LLM填充中文分词索引
+        第三步：填充中文分词索引，先在本地对齐，对齐失败时才使用LLM
         """
-        prompt_file = os.getenv("SEGMENT_PROMPT_FILE3")
-        if not prompt_file:
-            raise ValueError("SEGMENT_PROMPT_FILE3 is not set in environment variables.")
-        prompt_template = open(prompt_file, "r").read()
-        prompt = ChatPromptTemplate.from_template(prompt_template)
+        if process2_result is None:
+            # 第二步失败时没有可以对齐的内容，不再把 None 发给 LLM
+            return None
+        with stage("phase3_align") as recorder:
+            aligned_result = self._align_chinese_segment_index(process2_result)
+            if aligned_result is None:
+                recorder.fail()
+        if aligned_result is not None:
+            return aligned_result
+        logger.info("Local alignment failed, falling back to LLM for segment index")
+
+        prompt = prompt_registry.template(SEGMENT_PROMPT3, self.parser3)
 
         messages = prompt.format_messages(
-            process2_result=str(process2_result),
-            format_instructions=self.parser3.get_format_instructions()
+            process2_result=str(process2_result)
         )
 
-        try:
-            output = self.llm(messages)
-            logger.error(f"Segment phase3 LLM original response: {output.content}")
-            result = self.parser3.parse(output.content)
-            logger.info(f"Successfully parsed result: {result}")
-            return result
-        except Exception as e:
-            logger.error(f"Error in filling Chinese segment index: {str(e)}")
-            return None
+        with stage("phase3_llm") as recorder:
+            try:
+                result = recorder.invoke(self.llm, messages, self.parser3)
+                logger.debug(f"Successfully parsed result: {result}")
+                return result
+            except Exception as e:
+                logger.error(f"Error in filling Chinese segment index: {str(e)}")
+                recorder.fail()
+                return None
         
+    def _align_chinese_segment_index(self, process2_result: SegmentationResult) -> Optional[FinalSegmentationResult]:
+        """
+        在原句中本地计算每个中文片段的 start 和 len，有任何一个片段对不上就返回 None
+        """
+        positions = offset_aligner.align(process2_result.original, [word.chinese for word in process2_result.words])
+        if any(position is None for position in positions):
+            return None
+
+        return FinalSegmentationResult(
+            original=process2_result.original,
+            translation=process2_result.translation,
+            words=[
+                WordWithIndex(
+                    english=word.english,
+                    pos=word.pos,
+                    # 模糊匹配时以原句中的片段为准
+                    chinese=process2_result.original[start:start + length],
+                    start=start,
+                    len=length
+                )
+                for word, (start, length) in zip(process2_result.words, positions)
+            ]
+        )
+
     def expand_synonyms(self, segmentation_result: FinalSegmentationResult) -> SynonymExpansionResult:
         """
         第四步：扩展分词结果到所属的WordNet synset里的 synonyms同义词，并去掉其中词频大于 20000 名的
         """
-        
-        expanded_result = SynonymExpansionResult(
+        # 整句的词一次性选 synset、一次性变形，而不是每个词调用两次 LLM
+        high_freq_synonyms_list = self._get_sentence_high_freq_synonyms(
+            segmentation_result.words, segmentation_result.original)
+        transformed_list = self._transform_sentence_synonyms(segmentation_result.words, high_freq_synonyms_list)
+
+        return SynonymExpansionResult(
             original=segmentation_result.original,
             translation=segmentation_result.translation,
-            words=[]
+            words=[self._build_expanded_word(word, transformed)
+                   for word, transformed in zip(segmentation_result.words, transformed_list)]
         )
-        
-        for word in segmentation_result.words:
-            # 使用新方法获取同义词，排除原词的其他形式
-            synonyms = WordNetService.get_synonyms_by_context(word.english
-            , word.pos, segmentation_result.original)
-            
-            # 过滤出高频同义词（词频排名<=2000的词）
-            high_freq_synonyms = {
-                syn for syn in synonyms 
-                if CocaService.get_word_rank(syn) <= 2000
-            }
-            # 将剩下的词变为和原词同样的形式
-            transformed_synonyms = []
-            if high_freq_synonyms:
-                transformed_synonyms = self._transform_word_to_same_form(word.english, word.pos
-                                                                     , list(high_freq_synonyms))
-            # 将原词放在第一位
-            synonyms_list = [word.english] + transformed_synonyms
-
-            expanded_word = WordWithIndexAndSynonym(
-                english=synonyms_list,
-                pos=word.pos,
-                chinese=word.chinese,
-                start=word.start,
-                len=word.len
+
+    def segment_sentences(self, sentences: List[str],
+                          on_sentence_done: Optional[Callable[[int, Optional[SynonymExpansionResult]], None]] = None,
+                          neighbours: Optional[Dict[str, Tuple[str, SynonymExpansionResult]]] = None
+                          ) -> List[Optional[SynonymExpansionResult]]:
+        """
+        整篇作文一起分词：按 句子 -> 各阶段 -> synset 选择 -> 同义词变形 构建依赖图，
+        所有就绪的节点并发执行（LLM 调用另外受进程内共用的 llm_limiter 限制，所有作文加起来不超过 SEGMENT_MAX_CONCURRENCY），
+        结果按原句子顺序返回，耗时取决于最长的依赖链而不是所有调用的总和
+
+        某个句子失败不影响其他句子，失败的句子结果为 None；
+        每个句子完成（或失败）时都会回调 on_sentence_done(句子序号, 结果)
+
+        强模型流程每个阶段成功的结果都会保存为产物，之前失败过的句子从最后一个成功的阶段继续
+
+        neighbours 是 句子 -> (相似的已有句子, 它的分词结果)：这些句子复用相似句子里没有修改的词，
+        只把修改过的片段交给 LLM，复用不成功时走完整流程
+        """
+        WordNetService.ensure_loaded()
+        neighbours = neighbours or {}
+        run = self.artifacts.start_run(sentences, self.phase_versions())
+        # 已经有第三步产物的句子，再读出它们的同义词扩展产物
+        expansion_versions = []
+        for sentence in sentences:
+            phase3 = run.get(sentence, PHASE3)
+            if phase3 is not None:
+                expansion_versions.extend(self._expansion_versions(FinalSegmentationResult.model_validate(phase3)))
+        if expansion_versions:
+            run.load(sentences, expansion_versions)
+        executor = DagExecutor(max_in_flight=int(os.getenv("SEGMENT_MAX_CONCURRENCY", "8")), fail_fast=False)
+
+        def sentence_done(index: int, result) -> None:
+            if on_sentence_done:
+                on_sentence_done(index, None if isinstance(result, NodeFailure) else result)
+
+        # hybrid 模式下所有句子先走本地分词，失败的句子单独走完整的 LLM 流程，不参与合并请求
+        tiers = [FAST if self.hybrid else self.cascade.route_sentence(sentence) for sentence in sentences]
+        # 只有走强模型、并且还没有第一步产物的句子参与合并请求
+        strong_indexes = [index for index, tier in enumerate(tiers)
+                          if tier == STRONG and self._resume_phase(run, sentences[index]) is None
+                          and sentences[index] not in neighbours]
+        packs = [
+            [strong_indexes[i] for i in pack]
+            for pack in self._pack_sentences([sentences[index] for index in strong_indexes])
+        ] if self.pack_token_budget else []
+        for pack_index, pack in enumerate(packs):
+            executor.add_node(("pack", pack_index), self._translate2English_and_segment_packed,
+                              args=([sentences[index] for index in pack],))
+
+        pack_positions = {index: (pack_index, position)
+                          for pack_index, pack in enumerate(packs) for position, index in enumerate(pack)}
+        for index, sentence in enumerate(sentences):
+            if sentence in neighbours and self._resume_phase(run, sentence) is None:
+                neighbour, neighbour_result = neighbours[sentence]
+                executor.add_node(("reuse", index), self._segment_near_duplicate,
+                                  args=(sentence, neighbour, neighbour_result),
+                                  on_done=lambda result, index=index, sentence=sentence: self._on_reuse_done(
+                                      executor, index, sentence, result, sentence_done, run))
+            elif tiers[index] == FAST and self._resume_phase(run, sentence) is not None:
+                # 之前走强模型流程失败过的句子直接从产物继续
+                self._add_phase_nodes(executor, index, sentence, None, sentence_done, run)
+            elif self.hybrid:
+                executor.add_node(("hybrid", index), self._segment_hybrid, args=(sentence,),
+                                  on_done=lambda result, index=index, sentence=sentence: self._on_shortcut_done(
+                                      executor, index, sentence, result, sentence_done, "hybrid", run))
+            elif tiers[index] == FAST:
+                executor.add_node(("fast", index), self._segment_fast, args=(sentence,),
+                                  on_done=lambda result, index=index, sentence=sentence: self._on_shortcut_done(
+                                      executor, index, sentence, result, sentence_done, "sentence", run))
+            else:
+                self._add_phase_nodes(executor, index, sentence, pack_positions.get(index), sentence_done, run)
+
+        try:
+            results = executor.run()
+        finally:
+            run.flush()
+        final_results = []
+        for index in range(len(sentences)):
+            result = results.get(("expanded", index))
+            final_results.append(None if isinstance(result, NodeFailure) else result)
+        return final_results
+
+    @staticmethod
+    def _resume_phase(run: ArtifactRun, sentence: str) -> Optional[str]:
+        """这个句子已经有产物的最后一个阶段，没有时为 None"""
+        return next((phase for phase in (PHASE3, PHASE2, PHASE1) if run.get(sentence, phase) is not None), None)
+
+    @staticmethod
+    def _saving(run: ArtifactRun, sentence: str, phase: str, fn: Callable, dump: Callable = lambda result: result,
+                version: Optional[str] = None, upstream: Optional[Tuple[str, Optional[str]]] = None) -> Callable:
+        """
+        包装一个阶段的函数：结果不为 None 时记为这个句子这个阶段的产物；
+        失败（返回 None 或抛出异常）时作废 upstream=(阶段, 版本号) 的产物，下次从上游重新计算
+        """
+        def wrapped(*args):
+            try:
+                result = fn(*args)
+            except DeadlineExceeded:
+                raise
+            except Exception:
+                if upstream is not None:
+                    run.invalidate(sentence, *upstream)
+                raise
+            if result is not None:
+                run.put(sentence, phase, dump(result), version)
+            elif upstream is not None:
+                run.invalidate(sentence, *upstream)
+            return result
+        return wrapped
+
+    @staticmethod
+    def _optional(fn: Callable) -> Callable:
+        """包装可选阶段（同义词扩展、词形变换）：上一个可选阶段被跳过（参数为 None）或离截止时间太近时返回 None"""
+        def wrapped(*args):
+            if any(arg is None for arg in args):
+                return None
+            try:
+                return fn(*args)
+            except DeadlineExceeded as e:
+                logger.info(str(e))
+                return None
+        return wrapped
+
+    def _add_phase_nodes(self, executor: DagExecutor, index: int, sentence: str,
+                         pack_position: Optional[Tuple[int, int]], sentence_done: Callable[[int, object], None],
+                         run: ArtifactRun) -> None:
+        """用强模型的第一、二、三步节点，已经有产物的阶段直接使用产物"""
+        on_phase3 = lambda result: self._add_word_nodes(executor, index, sentence, result, sentence_done, run)
+        dump = lambda result: result.model_dump(mode="json")
+        resume_phase = self._resume_phase(run, sentence)
+        if resume_phase == PHASE3:
+            phase3 = FinalSegmentationResult.model_validate(run.get(sentence, PHASE3))
+            executor.add_node(("phase3", index), lambda: phase3, on_done=on_phase3)
+            return
+        if resume_phase == PHASE2:
+            phase2 = SegmentationResult.model_validate(run.get(sentence, PHASE2))
+            executor.add_node(("phase3", index), self._saving(run, sentence, PHASE3, self._fill_chinese_segment_index, dump,
+                                                              upstream=(PHASE2, None)),
+                              args=(phase2,), on_done=on_phase3)
+            return
+
+        if resume_phase == PHASE1:
+            phase1_result = run.get(sentence, PHASE1)
+            phase1 = executor.add_node(("phase1", index), lambda: phase1_result)
+        elif pack_position is not None:
+            pack_index, position = pack_position
+            # 合并请求里缺失或不合格的句子单独重试
+            phase1 = executor.add_node(
+                ("phase1", index),
+                self._saving(run, sentence, PHASE1, lambda packed_results: packed_results[position]
+                             or self._translate2English_and_segment(sentence)),
+                deps=(("pack", pack_index),)
             )
-            
-            expanded_result.words.append(expanded_word)
-        
-        return expanded_result
+        else:
+            translate = self._translate2English_and_segment_batched if batching_enabled() \
+                else self._translate2English_and_segment
+            phase1 = executor.add_node(("phase1", index), self._saving(run, sentence, PHASE1, translate), args=(sentence,))
+        phase2 = executor.add_node(("phase2", index), self._saving(run, sentence, PHASE2, self._fill_chinese_segment, dump,
+                                                                   upstream=(PHASE1, None)),
+                                   deps=(phase1,))
+        executor.add_node(("phase3", index), self._saving(run, sentence, PHASE3, self._fill_chinese_segment_index, dump,
+                                                          upstream=(PHASE2, None)),
+                          deps=(phase2,), on_done=on_phase3)
+
+    def _on_shortcut_done(self, executor: DagExecutor, index: int, sentence: str, shortcut_result,
+                          sentence_done: Callable[[int, object], None], task: str, run: ArtifactRun) -> None:
+        """
+        快模型或 hybrid 模式的结果通过校验就直接作为第三步的结果，否则升级到强模型重新做前三步；
+        task 是 cascade_stats 里记录升级的任务名
+        """
+        if shortcut_result is None or isinstance(shortcut_result, NodeFailure):
+            if isinstance(shortcut_result, NodeFailure):
+                cascade_stats.record_escalation(task, "error")
+            self._add_phase_nodes(executor, index, sentence, None, sentence_done, run)
+            return
+        executor.add_node(("phase3", index), lambda: shortcut_result,
+                          on_done=lambda result: self._add_word_nodes(executor, index, sentence, result, sentence_done, run))
+
+    def _segment_near_duplicate(self, sentence: str, neighbour: str, neighbour_result: SynonymExpansionResult
+                                ) -> Optional[Tuple[List[WordWithIndexAndSynonym], FinalSegmentationResult]]:
+        """
+        相似句子复用的前三步：没有修改的词（连同同义词）平移位置后直接复用，
+        修改过的片段一次性交给 LLM 分词，再在片段范围内对齐位置；
+        返回 (复用的词, 新分出的词)，修改太多、LLM 失败或结果对不上原句时返回 None，交给完整流程
+        """
+        if any(neighbour[word.start:word.start + word.len] != word.chinese for word in neighbour_result.words):
+            cascade_stats.record_escalation("near_duplicate", "neighbour_misaligned")
+            return None
+        plan = plan_reuse(neighbour, sentence, [(word.start, word.len) for word in neighbour_result.words])
+        if plan is None:
+            cascade_stats.record_escalation("near_duplicate", "too_different")
+            return None
+        reused_positions, fragments = plan
+        reused = [word.model_copy(update={"start": reused_positions[i]})
+                  for i, word in enumerate(neighbour_result.words) if i in reused_positions]
+
+        words = []
+        if fragments:
+            fragments_str = json.dumps([{"id": i, "text": sentence[start:end]} for i, (start, end) in enumerate(fragments)],
+                                       ensure_ascii=False, indent=2)
+            messages = prompt_registry.template(SEGMENT_PROMPT8, self.parser8).format_messages(
+                sentence=sentence, fragments=fragments_str)
+            with stage("near_duplicate_resolve") as recorder:
+                try:
+                    result = recorder.invoke(self.llm, messages, self.parser8)
+                except Exception as e:
+                    logger.error(f"Error in resolving near-duplicate fragments: {str(e)}")
+                    recorder.fail()
+                    cascade_stats.record_escalation("near_duplicate", "resolve_error")
+                    return None
+            resolved = {item.id: item.words for item in result.fragments if 0 <= item.id < len(fragments)}
+            if len(resolved) != len(fragments):
+                cascade_stats.record_escalation("near_duplicate", "resolve_incomplete")
+                return None
+            for i, (start, end) in enumerate(fragments):
+                position = start
+                for word in resolved[i]:
+                    chinese = word.chinese.strip()
+                    found = sentence.find(chinese, position, end) if chinese else -1
+                    if found < 0 or not word.english.strip():
+                        cascade_stats.record_escalation("near_duplicate", "span_not_in_fragment")
+                        return None
+                    words.append(WordWithIndex(english=word.english.strip(), pos=word.pos, chinese=chinese,
+                                               start=found, len=len(chinese)))
+                    position = found + len(chinese)
+        cascade_stats.record_route("near_duplicate", FAST, "resolve_fragments" if fragments else "reuse_all")
+        return reused, FinalSegmentationResult(original=sentence, translation="", words=words)
+
+    def _on_reuse_done(self, executor: DagExecutor, index: int, sentence: str, reuse_result,
+                       sentence_done: Callable[[int, object], None], run: ArtifactRun) -> None:
+        """复用成功时只对新分出的词做同义词扩展，再和复用的词合并；失败时走完整的强模型流程"""
+        if reuse_result is None or isinstance(reuse_result, NodeFailure):
+            if isinstance(reuse_result, NodeFailure):
+                cascade_stats.record_escalation("near_duplicate", "error")
+            self._add_phase_nodes(executor, index, sentence, None, sentence_done, run)
+            return
+        reused, new_segmentation = reuse_result
+        if not new_segmentation.words:
+            executor.add_node(("expanded", index), lambda: SynonymExpansionResult(
+                original=sentence, translation="", words=reused
+            ), on_done=lambda result: sentence_done(index, result))
+            return
+        self._add_word_nodes(executor, index, sentence, new_segmentation, sentence_done, run, reused)
+
+    def _add_word_nodes(self, executor: DagExecutor, index: int, sentence: str,
+                        segmentation_result: FinalSegmentationResult,
+                        sentence_done: Callable[[int, object], None], run: ArtifactRun,
+                        reused_words: Optional[List[WordWithIndexAndSynonym]] = None) -> None:
+        """
+        第三步完成后才知道有哪些词，此时再把同义词扩展节点加入依赖图，已经有产物的步骤直接使用产物；
+        reused_words 是从相似句子复用、已经扩展过的词，按位置和新扩展的词合并
+        """
+        if isinstance(segmentation_result, NodeFailure) or segmentation_result is None:
+            sentence_done(index, segmentation_result)
+            return
+        synonyms_version, transform_version = self._expansion_versions(segmentation_result)
+        # 整句的 synset 选择和同义词变形各合并成一次 LLM 调用
+        synonyms = run.get(sentence, SYNONYMS, synonyms_version)
+        synonyms_key = executor.add_node(
+            ("synonyms", index),
+            (lambda: synonyms) if synonyms is not None else self._optional(self._saving(
+                run, sentence, SYNONYMS, self._get_sentence_high_freq_synonyms, version=synonyms_version)),
+            args=() if synonyms is not None else (segmentation_result.words, segmentation_result.original)
+        )
+        transformed = run.get(sentence, TRANSFORM, transform_version)
+        transform_key = executor.add_node(
+            ("transform", index),
+            (lambda _: transformed) if transformed is not None else self._optional(self._saving(
+                run, sentence, TRANSFORM, self._transform_sentence_synonyms, version=transform_version,
+                upstream=(SYNONYMS, synonyms_version))),
+            args=() if transformed is not None else (segmentation_result.words,),
+            deps=(synonyms_key,)
+        )
+
+        def assemble(transformed_list):
+            # 同义词扩展或词形变换被跳过时只保留第三步的译词，标记为不完整，之后由后台补全
+            partial = transformed_list is None
+            if partial:
+                transformed_list = [[] for _ in segmentation_result.words]
+            words = [self._build_expanded_word(word, transformed)
+                     for word, transformed in zip(segmentation_result.words, transformed_list)]
+            if reused_words:
+                words = sorted(words + reused_words, key=lambda word: word.start)
+            return SynonymExpansionResult(
+                original=segmentation_result.original,
+                translation=segmentation_result.translation,
+                words=words,
+                partial=partial
+            )
+
+        executor.add_node(("expanded", index), assemble, deps=(transform_key,),
+                          on_done=lambda result: sentence_done(index, result))
+
+    def _get_sentence_high_freq_synonyms(self, words: List[WordWithIndex], context: str) -> List[List[str]]:
+        """根据语境一次找到整句所有词的同义词，并过滤出高频同义词（词频排名<=2000的词）"""
+        # 使用新方法获取同义词，排除原词的其他形式（synset 选择的 LLM 调用在 WordNetService 里单独记录）
+        check_optional_stage("synonyms")
+        with stage("synonyms"):
+            synonyms_list = WordNetService.get_synonyms_by_context_batch(
+                [(word.english, word.pos) for word in words], context)
+        return [
+            sorted(syn for syn in synonyms if CocaService.get_word_rank(syn) <= 2000)
+            for synonyms in synonyms_list
+        ]
+
+    def _transform_sentence_synonyms(self, words: List[WordWithIndex],
+                                     high_freq_synonyms_list: List[List[str]]) -> List[List[str]]:
+        """将剩下的词变为和原词同样的形式，没有同义词的词不参与"""
+        transformed_list = [[] for _ in words]
+        indexes = [i for i, synonyms in enumerate(high_freq_synonyms_list) if synonyms]
+        if not indexes:
+            return transformed_list
+        check_optional_stage("transform")
+        batch_result = self._transform_words_to_same_form_batch(
+            [(words[i].english, words[i].pos, high_freq_synonyms_list[i]) for i in indexes])
+        for i, transformed in zip(indexes, batch_result):
+            transformed_list[i] = transformed
+        return transformed_list
+
+    def _build_expanded_word(self, word: WordWithIndex, transformed_synonyms: List[str]) -> WordWithIndexAndSynonym:
+        # 将原词放在第一位
+        return WordWithIndexAndSynonym(
+            english=[word.english] + transformed_synonyms,
+            pos=word.pos,
+            chinese=word.chinese,
+            start=word.start,
+            len=word.len
+        )
+
+    def _transform_words_to_same_form_batch(self, items: List[Tuple[str, str, List[str]]]) -> List[List[str]]:
+        """
+        批量版本的 _transform_word_to_same_form：先用本地词形变化引擎转换，
+        只把本地无法确定的同义词（不规则词、未知词形）放进一次 LLM 请求
+        Args:
+            items: (原始单词, 词性, 需要转换的同义词列表) 的列表
+        Returns:
+            与 items 一一对应的转换后的同义词列表
+        """
+        with stage("transform_local"):
+            local_results = [InflectionService.transform_like(word, pos, synonyms) for word, pos, synonyms in items]
+        pending = [
+            (i, [j for j, transformed in enumerate(local_result) if transformed is None])
+            for i, local_result in enumerate(local_results)
+        ]
+        pending = [(i, missing) for i, missing in pending if missing]
+
+        if pending:
+            llm_results = self._transform_words_to_same_form_cascade(
+                [(items[i][0], items[i][1], [items[i][2][j] for j in missing]) for i, missing in pending])
+            for (i, missing), llm_result in zip(pending, llm_results):
+                # LLM 也没能给出完整结果时，丢掉这些无法转换的同义词
+                if len(llm_result) == len(missing):
+                    for j, transformed in zip(missing, llm_result):
+                        local_results[i][j] = transformed
+
+        return [[transformed for transformed in local_result if transformed] for local_result in local_results]
+
+    def _transform_words_to_same_form_cascade(self, items: List[Tuple[str, str, List[str]]]) -> List[List[str]]:
+        """开启两级模型时先用快模型转换，数量不对或有空结果的项再交给强模型"""
+        if not self.cascade.enabled or not items:
+            return self._transform_words_to_same_form_llm_batch(items)
+
+        cascade_stats.record_route("transform", FAST, "irregular_form", len(items))
+        transformed_list = self._transform_words_to_same_form_llm_batch(items, llm=self.fast_llm, retry_alone=False)
+        escalate = [
+            i for i, ((word, pos, synonyms), transformed) in enumerate(zip(items, transformed_list))
+            if len(transformed) != len(synonyms) or not all(w.strip() for w in transformed)
+        ]
+        if escalate:
+            cascade_stats.record_escalation("transform", "invalid_result", len(escalate))
+            strong_results = self._transform_words_to_same_form_llm_batch([items[i] for i in escalate])
+            for i, transformed in zip(escalate, strong_results):
+                transformed_list[i] = transformed
+        return transformed_list
+
+    def _transform_words_to_same_form_llm_batch(self, items: List[Tuple[str, str, List[str]]],
+                                                llm: Optional[ChatOpenAI] = None,
+                                                retry_alone: bool = True) -> List[List[str]]:
+        """
+        一次 LLM 请求转换多个词（一句话甚至整篇作文）的同义词，再按 id 拆回每个词；
+        整体解析失败或某一项不完整时，对该项单独调用一次 _transform_word_to_same_form
+        （retry_alone=False 时不重试，该项结果为空列表，由调用方决定怎么处理）
+        """
+        if not items:
+            return []
+        if len(items) == 1 and retry_alone:
+            word, pos, synonyms = items[0]
+            return [self._transform_word_to_same_form(word, pos, synonyms) or []]
+
+        items_str = json.dumps([
+            {
+                "id": i,
+                "ref_word_lemma": WordNetService.get_word_lemma(word, pos),
+                "ref_word_transformation": word,
+                "words": synonyms
+            }
+            for i, (word, pos, synonyms) in enumerate(items)
+        ], ensure_ascii=False, indent=2)
+        prompt = prompt_registry.template(SEGMENT_PROMPT5, self.parser5)
+        messages = prompt.format_messages(items=items_str)
+
+        batch_results = {}
+        with stage("transform_batch" if llm is None else "transform_fast") as recorder:
+            try:
+                result = recorder.invoke(llm or self.llm, messages, self.parser5)
+                batch_results = {item.id: item.words_transformation for item in result.items}
+            except Exception as e:
+                logger.error(f"Error in batch transforming synonyms form: {str(e)}")
+                recorder.fail()
+            retry_indexes = [
+                i for i, (word, pos, synonyms) in enumerate(items)
+                if batch_results.get(i) is None or len(batch_results[i]) != len(synonyms)
+            ]
+            recorder.retry(len(retry_indexes))
+
+        transformed_list = []
+        for i, (word, pos, synonyms) in enumerate(items):
+            transformed = batch_results.get(i)
+            if i in retry_indexes:
+                if not retry_alone:
+                    transformed = []
+                else:
+                    logger.warning(f"Batch transformation missing or malformed for '{word}', retrying alone")
+                    transformed = self._transform_word_to_same_form(word, pos, synonyms) or []
+            transformed_list.append(transformed)
+        return transformed_list
 
     def _transform_word_to_same_form(self, word: str, pos: str, synonyms: List[str]) -> List[str]:
         """
@@ -232,26 +1018,22 @@ class SegmentationService:
         # 获取原始单词的原型
         word_lemma = WordNetService.get_word_lemma(word, pos)
         word_transformation = word
-        print(f"word_lemma: {word_lemma}, word_transformation: {word_transformation}")
-        prompt_file = os.getenv("SEGMENT_PROMPT_FILE4")
-        if not prompt_file:
-            raise ValueError("SEGMENT_PROMPT_FILE4 is not set in environment variables.")
-        prompt_template = open(prompt_file, "r").read()
-        prompt = ChatPromptTemplate.from_template(prompt_template)
+        logger.debug(f"word_lemma: {word_lemma}, word_transformation: {word_transformation}")
+        prompt = prompt_registry.template(SEGMENT_PROMPT4, self.parser4)
 
         messages = prompt.format_messages(
             ref_word_lemma=word_lemma, 
             ref_word_transformation=word_transformation, 
-            words=synonyms,
-            format_instructions=self.parser4.get_format_instructions()
+            words=synonyms
         )
-        try:    
-            output = self.llm.invoke(messages)
-            result = self.parser4.parse(output.content)
-            return result.words_transformation
-        except Exception as e:
-            logger.error(f"Error in transforming synonyms form: {str(e)}")
-            return None
+        with stage("transform_single") as recorder:
+            try:
+                result = recorder.invoke(self.llm, messages, self.parser4)
+                return result.words_transformation
+            except Exception as e:
+                logger.error(f"Error in transforming synonyms form: {str(e)}")
+                recorder.fail()
+                return None
         
 if __name__ == "__main__":
     # 创建服务实例
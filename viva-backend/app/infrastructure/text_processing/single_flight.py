@@ -0,0 +1,87 @@
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    """
+    合并同时进行的相同计算：同一个 key 同时只有一个调用方（leader）真正执行，
+    其他调用方等待并拿到同一个结果（或同一个异常）；执行结束后 key 被移除，之后的调用重新执行
+
+    结果只在执行期间共享，不做缓存（分词结果的缓存由 SegmentationCache 负责）
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._leaders = 0
+        self._shared = 0
+
+    def claim(self, key: Hashable) -> Tuple[Future, bool]:
+        """
+        登记一个 key：没有进行中的计算时成为 leader，返回 (新的 Future, True)，
+        之后必须调用 resolve；否则返回 (进行中计算的 Future, False)
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self._shared += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self._leaders += 1
+            return future, True
+
+    def resolve(self, key: Hashable, result: Any = None, error: BaseException = None) -> None:
+        """leader 完成计算后调用，把结果（或异常）交给所有等待的调用方"""
+        with self._lock:
+            future = self._calls.pop(key)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args) -> Tuple[Any, bool]:
+        """执行 fn(*args)，相同 key 的计算正在进行时等待它的结果；返回 (结果, 是否复用了其他调用方的结果)"""
+        future, leader = self.claim(key)
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self.resolve(key, error=e)
+            raise
+        self.resolve(key, result)
+        return result, False
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"leaders": self._leaders, "shared": self._shared, "in_flight": len(self._calls)}
+
+
+def prompt_key(llm: Any, messages: Any) -> str:
+    """LLM 请求的 key：模型（类型、名称、温度）加上 prompt 内容的哈希"""
+    if isinstance(messages, (list, tuple)):
+        content = [(getattr(message, "type", ""), getattr(message, "content", str(message))) for message in messages]
+    else:
+        content = str(messages)
+    model = (
+        type(llm).__name__,
+        getattr(llm, "model_name", None) or getattr(llm, "model", None),
+        getattr(llm, "temperature", None)
+    )
+    payload = json.dumps([model, content], ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# 句子级：以 (句子, 流水线版本号) 为 key，不同作文同时提交的相同句子只跑一次流水线
+sentence_flight = SingleFlight("sentence")
+# LLM 调用级：以 prompt_key 为 key，相同的 prompt 同时只发出一次请求
+llm_flight = SingleFlight("llm")
+
+
+def single_flight_stats() -> Dict[str, Dict[str, int]]:
+    return {"sentence": sentence_flight.stats(), "llm": llm_flight.stats()}
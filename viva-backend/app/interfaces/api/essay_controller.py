@@ -1,4 +1,7 @@
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, File, Form, Header, HTTPException, Response, UploadFile
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
 import logging
 from typing import List, Optional
 import tempfile
@@ -6,18 +9,30 @@ import os
 from application.use_cases.get_sentence_use_case import GetSentenceUseCase
 from application.use_cases.get_user_essays_use_case import GetUserEssaysUseCase
 from domain.entities.entities import Essay
-from domain.schemas.essay_schema import EssaySchema, EssayWithSentencesSchema
+from domain.schemas.essay_schema import EssayJobSchema, EssaySchema, EssayWithSentencesSchema
 from domain.services.active_expression_service import AICheckRequest, ActiveExpressionService
 from domain.services.anki_service import AnkiService
-from domain.services.essay_processing_service import EssayService
+from domain.services.essay_processing_service import EssayService, IdempotencyKeyInUse, IdempotencyKeyMismatch
 from domain.services.tts_service import slugify
 from infrastructure.repositories.active_mapping_repository import ActiveMappingRepository
 from infrastructure.repositories.sentence_repository import SentenceRepository
 from infrastructure.repositories.database_manager import db_manager
 from infrastructure.oss.AliOssAgent import OssAgent
 from infrastructure.text_processing.segmentation_service import SegmentationService
-from interfaces.service.jwt_service import get_current_user
+from interfaces.service.jwt_service import get_admin_user, get_current_user
 from infrastructure.repositories.essay_repository import EssayRepository
+from infrastructure.repositories.essay_job_repository import EssayJobRepository
+from infrastructure.task.event_broker import get_event_broker
+from infrastructure.text_processing.pipeline_metrics import pipeline_metrics
+from infrastructure.text_processing.segmentation_cache import SegmentationCache
+from infrastructure.text_processing.model_cascade import cascade_stats
+from infrastructure.text_processing.single_flight import single_flight_stats
+from infrastructure.text_processing.llm_limiter import llm_limiter
+from infrastructure.text_processing.near_duplicate_index import near_duplicate_index
+from infrastructure.task.admission_controller import AdmissionRejected, get_admission_controller
+from infrastructure.task.task_queue import get_task_queue
+from infrastructure.english.word_net import WordNetService
+from domain.entities.entities import EssayJobStatus
 from pydantic import BaseModel, ValidationError
 import uuid
 
@@ -60,10 +75,12 @@ async def get_user_essays(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving user essays: {str(e)}")
 
-@router.post("/submitEssay")
+@router.post("/submitEssay", response_model=EssayJobSchema)
 async def submit_essay(
+    response: Response,
     content: str = Form(...),
     image: Optional[UploadFile] = File(None),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
     current_user: dict = Depends(get_current_user),
     essay_repository: EssayRepository = Depends(EssayRepository),
     segmentation_service: SegmentationService = Depends(SegmentationService),
@@ -85,15 +102,211 @@ async def submit_essay(
             essay_repository
         )
         
-        # Create and process essay
-        created_essay = await essay_service.create_and_process_essay(content, image, user_id)
-        return created_essay
-            
+        # 保存作文并放入后台处理，立即返回任务 id；客户端超时重试时带同一个 Idempotency-Key 不会重复处理
+        job = await essay_service.submit_essay(content, image, user_id, idempotency_key)
+        if job.get('replayed'):
+            response.headers["Idempotent-Replayed"] = "true"
+        return EssayJobSchema(**job)
+
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except IdempotencyKeyInUse as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except IdempotencyKeyMismatch as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error submitting essay: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error submitting essay: {str(e)}")
 
 
+@router.get("/essayJobs/{job_id}", response_model=EssayJobSchema)
+async def get_essay_job(
+    job_id: str,
+    current_user: dict = Depends(get_current_user),
+    essay_job_repository: EssayJobRepository = Depends(EssayJobRepository)
+):
+    try:
+        user_id = current_user.get('id')
+        if not user_id:
+            raise HTTPException(status_code=400, detail="Invalid user ID")
+
+        job = essay_job_repository.get_by_id(job_id)
+        if not job or job['user_id'] != user_id:
+            raise HTTPException(status_code=404, detail="Job not found")
+
+        return EssayJobSchema(**job)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving job: {str(e)}")
+
+@router.get("/essays/{essay_id}/job", response_model=EssayJobSchema)
+async def get_latest_essay_job(
+    essay_id: int,
+    current_user: dict = Depends(get_current_user),
+    essay_job_repository: EssayJobRepository = Depends(EssayJobRepository)
+):
+    """作文最新的后台处理任务，前端打开作文时用来判断是否还在处理、是否需要订阅进度"""
+    try:
+        user_id = current_user.get('id')
+        if not user_id:
+            raise HTTPException(status_code=400, detail="Invalid user ID")
+
+        job = essay_job_repository.get_by_essay_id(essay_id)
+        if not job or job['user_id'] != user_id:
+            raise HTTPException(status_code=404, detail="Job not found")
+
+        return EssayJobSchema(**job)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving job: {str(e)}")
+
+@router.post("/essayJobs/{job_id}/retry", response_model=EssayJobSchema)
+async def retry_essay_job(
+    job_id: str,
+    current_user: dict = Depends(get_current_user),
+    essay_repository: EssayRepository = Depends(EssayRepository),
+    segmentation_service: SegmentationService = Depends(SegmentationService),
+    sentence_repository: SentenceRepository = Depends(SentenceRepository),
+    active_mapping_repository: ActiveMappingRepository = Depends(ActiveMappingRepository),
+    essay_job_repository: EssayJobRepository = Depends(EssayJobRepository)
+):
+    """重新处理一个失败的任务"""
+    try:
+        user_id = current_user.get('id')
+        if not user_id:
+            raise HTTPException(status_code=400, detail="Invalid user ID")
+
+        job = essay_job_repository.get_by_id(job_id)
+        if not job or job['user_id'] != user_id:
+            raise HTTPException(status_code=404, detail="Job not found")
+
+        essay_service = EssayService(
+            segmentation_service,
+            sentence_repository,
+            active_mapping_repository,
+            essay_repository
+        )
+        return EssayJobSchema(**await essay_service.retry_job(job_id))
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrying job: {str(e)}")
+
+@router.get("/essayJobs/{job_id}/trace")
+async def get_essay_job_trace(
+    job_id: str,
+    current_user: dict = Depends(get_current_user),
+    essay_job_repository: EssayJobRepository = Depends(EssayJobRepository)
+):
+    """任务结束后保存的各阶段耗时、LLM 调用、token、重试和解析失败"""
+    user_id = current_user.get('id')
+    if not user_id:
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+
+    job = essay_job_repository.get_by_id(job_id)
+    if not job or job['user_id'] != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job['trace'] is None:
+        raise HTTPException(status_code=404, detail="Trace not available yet")
+    return job['trace']
+
+@router.get("/segmentationMetrics")
+async def get_segmentation_metrics(current_user: dict = Depends(get_admin_user)):
+    """仅管理员：本进程启动以来分词流水线各阶段的汇总统计、分词缓存命中情况、快/强模型的路由统计、相同请求的合并情况、相似句子索引和准入控制"""
+    return {
+        "stages": pipeline_metrics.snapshot(),
+        "cache": SegmentationCache.stats(),
+        "batching": {
+            "phase1": SegmentationService.get_phase1_batcher().stats(),
+            "synset": WordNetService.get_synset_batcher().stats()
+        },
+        "cascade": cascade_stats.snapshot(),
+        "single_flight": single_flight_stats(),
+        "llm_concurrency": llm_limiter.stats(),
+        "near_duplicate": near_duplicate_index.stats(),
+        "admission": {**get_admission_controller().stats(), "queued_tasks": get_task_queue().get_queue_size()}
+    }
+
+@router.get("/essayJobs/{job_id}/events")
+async def stream_essay_job_events(
+    job_id: str,
+    current_user: dict = Depends(get_current_user),
+    essay_repository: EssayRepository = Depends(EssayRepository),
+    segmentation_service: SegmentationService = Depends(SegmentationService),
+    sentence_repository: SentenceRepository = Depends(SentenceRepository),
+    active_mapping_repository: ActiveMappingRepository = Depends(ActiveMappingRepository),
+    essay_job_repository: EssayJobRepository = Depends(EssayJobRepository)
+):
+    """
+    SSE 推送作文处理进度：每个句子分词完成就推送一个 sentence 事件（带该句的 mapping），
+    最后推送 done 或 failed 事件；任务已结束时从数据库重建同样的事件
+
+    等待期间定时发送心跳注释；任务不在本进程里处理（其他 worker 进程，或者还没开始）时，
+    每次心跳检查一次任务状态，结束后同样从数据库重建事件
+    """
+    user_id = current_user.get('id')
+    if not user_id:
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+
+    job = essay_job_repository.get_by_id(job_id)
+    if not job or job['user_id'] != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    event_broker = get_event_broker()
+    essay_service = EssayService(
+        segmentation_service,
+        sentence_repository,
+        active_mapping_repository,
+        essay_repository
+    )
+    finished = (EssayJobStatus.COMPLETED, EssayJobStatus.FAILED)
+    if job['status'] in finished and not event_broker.has_channel(job_id):
+        finished_events = essay_service.get_finished_job_events(job)
+
+        async def events():
+            for event in finished_events:
+                yield event
+    else:
+        async def events():
+            async for event in event_broker.subscribe(job_id):
+                if event is not None:
+                    yield event
+                    continue
+                if not event_broker.is_publishing(job_id):
+                    latest = await asyncio.to_thread(essay_job_repository.get_by_id, job_id)
+                    if latest is None:
+                        return
+                    if latest['status'] in finished:
+                        for finished_event in await asyncio.to_thread(essay_service.get_finished_job_events, latest):
+                            yield finished_event
+                        return
+                yield None
+
+    async def event_stream():
+        async for event in events():
+            if event is None:
+                # SSE 注释行，前端解析时忽略，只用来保持连接
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False, default=str)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # 关闭 nginx 的缓冲，事件才能及时到达前端
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/essays/{essay_id}", response_model=EssayWithSentencesSchema)
 async def get_essay_with_sentences(
     essay_id: int,
@@ -33,4 +33,11 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
             raise credentials_exception
         return {"id": user_id}
     except jwt.PyJWTError:
-        raise credentials_exception
\ No newline at end of file
+        raise credentials_exception
+
+def get_admin_user(current_user: dict = Depends(get_current_user)):
+    """只允许 ADMIN_USER_IDS（逗号分隔的 google_id）里的用户访问，没有配置时所有用户都不能访问"""
+    admin_ids = {user_id.strip() for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+    if current_user.get("id") not in admin_ids:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
\ No newline at end of file
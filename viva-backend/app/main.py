@@ -11,6 +11,9 @@ from infrastructure.repositories.sentence_repository import SentenceRepository
 from infrastructure.repositories.essay_repository import EssayRepository
 from infrastructure.repositories.active_mapping_repository import ActiveMappingRepository
 from infrastructure.oss.AliOssAgent import OssAgent
+from infrastructure.text.prompt_registry import prompt_registry
+from infrastructure.text_processing.segmentation_artifacts import artifact_ttl
+from infrastructure.text_processing.near_duplicate_index import near_duplicate_index
 import logging
 
 # 配置日志
@@ -30,6 +33,8 @@ app.add_middleware(
 
 # 创建共享的基础设施实例
 segmentation_service = SegmentationService()
+# 启动时加载并编译当前配置用到的 prompt 模板（未开启的功能不需要对应的 prompt 文件），之后只在文件修改时重新加载
+logger.info(f"Loaded prompts: {prompt_registry.preload(segmentation_service.active_prompts())}")
 sentence_repository = SentenceRepository()
 essay_repository = EssayRepository()
 active_mapping_repository = ActiveMappingRepository()
@@ -45,6 +50,40 @@ essay_service = EssayService(
 active_expression_service = ActiveExpressionService()
 anki_service = AnkiService()
 
+# 启动时继续处理上次进程退出时没有完成的作文任务
+@app.on_event("startup")
+async def resume_essay_jobs():
+    try:
+        await essay_service.resume_unfinished_jobs()
+    except Exception as e:
+        logger.error(f"Error resuming essay jobs: {str(e)}")
+
+# 启动时清理过期的 Idempotency-Key
+@app.on_event("startup")
+async def delete_expired_idempotency_keys():
+    try:
+        essay_service.delete_expired_idempotency_keys()
+    except Exception as e:
+        logger.error(f"Error deleting expired idempotency keys: {str(e)}")
+
+# 开启相似句子复用时，启动后就在后台建立相似句子索引，不等到第一篇作文
+@app.on_event("startup")
+async def load_near_duplicate_index():
+    if not segmentation_service.near_duplicate:
+        return
+    try:
+        near_duplicate_index.ensure_loaded(segmentation_service.pipeline_version())
+    except Exception as e:
+        logger.error(f"Error loading near-duplicate index: {str(e)}")
+
+# 启动时清理旧版本和过期的分阶段分词产物
+@app.on_event("startup")
+async def prune_segmentation_artifacts():
+    try:
+        segmentation_service.artifacts.prune(segmentation_service.phase_versions(), artifact_ttl())
+    except Exception as e:
+        logger.error(f"Error pruning segmentation artifacts: {str(e)}")
+
 # 配置依赖注入
 def get_essay_service():
     return essay_service
@@ -0,0 +1,75 @@
+"""
+按文件名顺序执行 migrations 目录下的 SQL 文件，已经执行过的记录在 schema_migrations 表里，之后跳过；
+每个文件在一个事务里执行，失败时回滚并停止，修复后重新运行即可
+
+部署时在启动新版本之前运行（在 app 目录下）：
+    python -m maintenance.apply_migrations
+    python -m maintenance.apply_migrations --dry-run
+"""
+import argparse
+import logging
+import os
+import sys
+from typing import List, Optional
+
+# 获取当前文件的目录
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# 获取项目根目录（maintenance 在项目根目录下）
+project_root = os.path.abspath(os.path.join(current_dir, '..'))
+
+# 将项目根目录添加到 Python 路径
+sys.path.insert(0, project_root)
+
+from sqlalchemy import text
+
+from infrastructure.repositories.database_manager import db_manager
+
+# 获取 logger
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(project_root, "migrations")
+
+
+def pending_migrations(applied: List[str]) -> List[str]:
+    files = sorted(name for name in os.listdir(MIGRATIONS_DIR) if name.endswith(".sql"))
+    return [name for name in files if name not in applied]
+
+
+def run(dry_run: bool = False) -> List[str]:
+    """执行还没有执行过的 migration，返回本次执行的文件名"""
+    with db_manager.engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "filename VARCHAR(255) PRIMARY KEY, "
+            "applied_at TIMESTAMP WITH TIME ZONE DEFAULT now())"
+        ))
+        applied = list(connection.execute(text("SELECT filename FROM schema_migrations")).scalars())
+
+    pending = pending_migrations(applied)
+    if dry_run:
+        return pending
+    for name in pending:
+        with open(os.path.join(MIGRATIONS_DIR, name), "r", encoding="utf-8") as file:
+            sql = file.read()
+        with db_manager.engine.begin() as connection:
+            connection.exec_driver_sql(sql)
+            connection.execute(text("INSERT INTO schema_migrations (filename) VALUES (:filename)"),
+                               {"filename": name})
+        logger.info(f"Applied migration {name}")
+    return pending
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Apply pending SQL migrations")
+    parser.add_argument("--dry-run", action="store_true", help="只列出还没有执行的 migration")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    names = run(args.dry_run)
+    print(f"{'待执行' if args.dry_run else '已执行'}的 migration: {names or '无'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
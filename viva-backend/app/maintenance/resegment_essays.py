@@ -0,0 +1,310 @@
+"""
+prompt（SEGMENT_PROMPT_FILE*）或模型改动后，用当前的分词流水线重新处理已有作文的句子，替换旧的 ActiveMapping
+
+- 按 essay_id 顺序分页读取作文，多个线程同时处理不同的作文，每篇作文内部仍由 DagExecutor 并发调用 LLM，
+  所有线程的 LLM 调用共用进程内的并发上限 SEGMENT_MAX_CONCURRENCY
+- 每篇作文的句子在一个事务里替换 mapping：旧的标记为删除、写入新的，提交前用户看到的仍然是旧的；
+  分词失败的句子保留旧的 mapping，不会被清空
+- 进度保存在 checkpoint 文件里（已完成作文的水位线和已替换的句子），每篇作文完成后追加一行，
+  中断后用同样的命令继续
+- 按每分钟的 LLM 调用数限速；某篇作文有句子失败（通常是被限流）时把速度减半，之后逐步恢复，
+  失败的句子不记为完成，下次运行时重试
+- --dry-run 只统计需要重新分词的句子（未命中当前版本的分词缓存）和预计的 LLM 调用次数，不调用 LLM、不写数据库
+
+在 app 目录下运行：
+    python -m maintenance.resegment_essays --dry-run
+    python -m maintenance.resegment_essays --workers 4 --calls-per-minute 300
+    python -m maintenance.resegment_essays --essay-id 12 --essay-id 15
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set
+
+# 获取当前文件的目录
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# 获取项目根目录（maintenance 在项目根目录下）
+project_root = os.path.abspath(os.path.join(current_dir, '..'))
+
+# 将项目根目录添加到 Python 路径
+sys.path.insert(0, project_root)
+
+from domain.services.essay_processing_service import EssayService
+from infrastructure.repositories.active_mapping_repository import ActiveMappingRepository
+from infrastructure.repositories.database_manager import db_manager
+from infrastructure.repositories.essay_repository import EssayRepository
+from infrastructure.repositories.sentence_repository import SentenceRepository
+from infrastructure.text_processing import pipeline_metrics
+from infrastructure.text_processing.segmentation_service import SegmentationService
+
+# 获取 logger
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    令牌桶限速：每分钟最多 calls_per_minute 次 LLM 调用；
+    slow_down() 把速度减半（最低为设定值的 10%），speed_up() 每次恢复设定值的 10%
+    """
+
+    def __init__(self, calls_per_minute: float):
+        self.max_rate = calls_per_minute / 60
+        self.rate = self.max_rate
+        self._tokens = self.rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, calls: int) -> None:
+        """阻塞到可以发出 calls 次调用；一次要求的调用数超过桶的容量时，等到桶满就放行"""
+        if self.max_rate <= 0 or calls <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                capacity = max(self.rate * 60, 1)
+                self._tokens = min(capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                needed = min(calls, capacity)
+                if self._tokens >= needed:
+                    self._tokens -= needed
+                    return
+                wait = (needed - self._tokens) / self.rate
+            time.sleep(min(wait, 5))
+
+    def slow_down(self) -> None:
+        with self._lock:
+            self.rate = max(self.rate / 2, self.max_rate * 0.1)
+            logger.warning(f"Slowing down to {self.rate * 60:.0f} LLM calls per minute")
+
+    def speed_up(self) -> None:
+        with self._lock:
+            self.rate = min(self.rate + self.max_rate * 0.1, self.max_rate)
+
+
+class Checkpoint:
+    """
+    重新分词的进度：watermark 之前（含）的作文都已处理完；之后已处理完的作文单独记录，
+    done_sentence_ids 是已经替换过 mapping 的句子（多篇作文共用的句子只处理一次）；
+    checkpoint 和流水线版本绑定，版本变化后需要 --restart；path 为 None 时只在内存里记录
+
+    文件是 JSON lines：第一行是版本号（以及之前的进度），之后每完成一篇作文追加一行
+    （这篇作文、新替换的句子和当时的水位线），加载时依次重放；中断时写了一半的行忽略
+    """
+
+    def __init__(self, path: Optional[str], version: str):
+        self.path = path
+        self.version = version
+        self.watermark = 0
+        self.done_essay_ids: Set[int] = set()
+        self.done_sentence_ids: Set[int] = set()
+        self._started_ids: List[int] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str, version: str, restart: bool) -> "Checkpoint":
+        checkpoint = cls(path, version)
+        if restart or not os.path.exists(path):
+            checkpoint._write_header()
+            return checkpoint
+        with open(path, "r", encoding="utf-8") as file:
+            text = file.read()
+        if not text.endswith("\n"):
+            # 中断时写了一半的最后一行单独成行，之后追加的记录不会和它连在一起
+            with open(path, "a", encoding="utf-8") as file:
+                file.write("\n")
+        lines = text.splitlines()
+        header = json.loads(lines[0])
+        if header["version"] != version:
+            raise ValueError(f"Checkpoint {path} was written for pipeline version {header['version']}, "
+                             f"current version is {version}; use --restart to start over")
+        checkpoint.watermark = header.get("watermark", 0)
+        checkpoint.done_essay_ids = set(header.get("done_essay_ids", []))
+        checkpoint.done_sentence_ids = set(header.get("done_sentence_ids", []))
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 中断时写了一半的行
+                continue
+            checkpoint.done_sentence_ids.update(record["sentence_ids"])
+            if record["complete"]:
+                checkpoint.done_essay_ids.add(record["essay_id"])
+            checkpoint.watermark = record["watermark"]
+        checkpoint.done_essay_ids = {essay_id for essay_id in checkpoint.done_essay_ids
+                                     if essay_id > checkpoint.watermark}
+        return checkpoint
+
+    def start(self, essay_id: int) -> None:
+        """按 essay_id 顺序登记开始处理的作文"""
+        with self._lock:
+            self._started_ids.append(essay_id)
+
+    def finish(self, essay_id: int, sentence_ids: List[int], complete: bool = True) -> None:
+        """
+        记录已替换的句子并立即追加到 checkpoint 文件；complete 时这篇作文算处理完，水位线推进到连续完成的最后一篇，
+        否则水位线停在这篇作文之前，下次运行时重新处理它还没完成的句子
+        """
+        with self._lock:
+            self.done_sentence_ids.update(sentence_ids)
+            if complete:
+                self.done_essay_ids.add(essay_id)
+            while self._started_ids and self._started_ids[0] in self.done_essay_ids:
+                self.watermark = self._started_ids.pop(0)
+                self.done_essay_ids.discard(self.watermark)
+            self._append({"essay_id": essay_id, "sentence_ids": sentence_ids, "complete": complete,
+                          "watermark": self.watermark})
+
+    def is_sentence_done(self, sentence_id: int) -> bool:
+        with self._lock:
+            return sentence_id in self.done_sentence_ids
+
+    def _write_header(self) -> None:
+        if self.path is None:
+            return
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.write(json.dumps({"version": self.version}) + "\n")
+
+    def _append(self, record: dict) -> None:
+        """每篇作文只追加一行，写入量和已完成的作文数无关"""
+        if self.path is None:
+            return
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record) + "\n")
+
+
+class Resegmenter:
+    def __init__(self, essay_service: EssayService, checkpoint: Checkpoint, rate_limiter: RateLimiter,
+                 dry_run: bool = False):
+        self.essay_service = essay_service
+        self.checkpoint = checkpoint
+        self.rate_limiter = rate_limiter
+        self.dry_run = dry_run
+        self._lock = threading.Lock()
+        self.totals = {"essays": 0, "sentences": 0, "cached": 0, "llm_calls": 0, "replaced": 0, "failed": 0}
+
+    def iter_essay_ids(self, page_size: int = 100) -> Iterator[int]:
+        """按 essay_id 顺序产生水位线之后还没处理的作文"""
+        after_id = self.checkpoint.watermark
+        while True:
+            page = self.essay_service.essay_repository.get_essay_ids_after(after_id, page_size)
+            if not page:
+                return
+            for essay_id in page:
+                if essay_id not in self.checkpoint.done_essay_ids:
+                    yield essay_id
+            after_id = page[-1]
+
+    def process_essay(self, essay_id: int) -> None:
+        sentences = [sentence for sentence in self.essay_service.sentence_repository.get_by_essay_id(essay_id)
+                     if not self.checkpoint.is_sentence_done(sentence.sentence_id)]
+        if self.dry_run:
+            self._count(essay_id, sentences)
+            return
+
+        texts = [sentence.sentence for sentence in sentences]
+        # 按最多需要的调用数限速，命中缓存的句子其实不需要调用
+        self.rate_limiter.acquire(self.essay_service.segmentation_service.estimate_llm_calls(texts))
+        with pipeline_metrics.trace(f"resegment-{essay_id}") as trace:
+            results = self.essay_service.segment_with_cache(texts) if texts else []
+
+        rows = []
+        replaced_ids = []
+        for sentence, result in zip(sentences, results):
+            if result is None:
+                continue
+            replaced_ids.append(sentence.sentence_id)
+            rows.extend(self.essay_service.build_mapping_insert_rows(sentence.sentence_id, result))
+        with db_manager.session_scope() as session:
+            self.essay_service.active_mapping_repository.replace_for_sentences(replaced_ids, rows, session)
+
+        failed = len(sentences) - len(replaced_ids)
+        if failed:
+            # 失败的句子保留旧的 mapping，不记为完成
+            logger.warning(f"Essay {essay_id}: {failed} of {len(sentences)} sentences failed, keeping their mappings")
+            self.rate_limiter.slow_down()
+        else:
+            self.rate_limiter.speed_up()
+        self._add(essays=1, sentences=len(sentences), llm_calls=trace.summary()["llm_calls"],
+                  replaced=len(replaced_ids), failed=failed)
+        # 有失败的作文不算完成，下次运行时重新处理其中失败的句子
+        self.checkpoint.finish(essay_id, replaced_ids, complete=not failed)
+
+    def _count(self, essay_id: int, sentences) -> None:
+        texts = list(dict.fromkeys(sentence.sentence for sentence in sentences))
+        version = self.essay_service.segmentation_service.pipeline_version()
+        cached = self.essay_service.segmentation_cache.get_many(texts, version)
+        misses = [text for text in texts if text not in cached]
+        self._add(essays=1, sentences=len(texts), cached=len(cached),
+                  llm_calls=self.essay_service.segmentation_service.estimate_llm_calls(misses))
+        # 多篇作文共用的句子只统计一次
+        self.checkpoint.finish(essay_id, [sentence.sentence_id for sentence in sentences])
+
+    def _add(self, **counts: int) -> None:
+        with self._lock:
+            for name, count in counts.items():
+                self.totals[name] += count
+
+
+def run(essay_ids: Optional[List[int]], workers: int, calls_per_minute: float, checkpoint_path: str,
+        dry_run: bool, restart: bool) -> Dict[str, int]:
+    essay_service = EssayService(
+        segmentation_service=SegmentationService(),
+        sentence_repository=SentenceRepository(),
+        active_mapping_repository=ActiveMappingRepository(),
+        essay_repository=EssayRepository()
+    )
+    version = essay_service.segmentation_service.pipeline_version()
+    checkpoint = Checkpoint(None, version) if dry_run or essay_ids \
+        else Checkpoint.load(checkpoint_path, version, restart)
+    resegmenter = Resegmenter(essay_service, checkpoint, RateLimiter(calls_per_minute), dry_run)
+    logger.info(f"Re-segmenting essays with pipeline version {version}, starting after essay {checkpoint.watermark}")
+
+    # 同时在途的作文不超过 workers 个，不会一次把所有作文提交进线程池
+    semaphore = threading.BoundedSemaphore(workers)
+
+    def process(essay_id: int) -> None:
+        try:
+            resegmenter.process_essay(essay_id)
+        except Exception as e:
+            logger.error(f"Error re-segmenting essay {essay_id}: {str(e)}")
+        finally:
+            semaphore.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for essay_id in sorted(essay_ids) if essay_ids else resegmenter.iter_essay_ids():
+            semaphore.acquire()
+            checkpoint.start(essay_id)
+            pool.submit(process, essay_id)
+    return resegmenter.totals
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Re-segment existing essays with the current pipeline")
+    parser.add_argument("--essay-id", type=int, action="append", help="只处理这些作文（不读写 checkpoint）")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("ESSAY_WORKER_COUNT", "2")),
+                        help="同时处理的作文数")
+    parser.add_argument("--calls-per-minute", type=float, default=300, help="每分钟最多的 LLM 调用数，0 表示不限")
+    parser.add_argument("--checkpoint", default="resegment_checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="忽略已有的 checkpoint，从头开始")
+    parser.add_argument("--dry-run", action="store_true", help="只统计需要重新分词的句子和预计的 LLM 调用次数")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    totals = run(args.essay_id, args.workers, args.calls_per_minute, args.checkpoint, args.dry_run, args.restart)
+    if args.dry_run:
+        print(f"作文数: {totals['essays']}  句子数: {totals['sentences']}  命中缓存: {totals['cached']}  "
+              f"预计 LLM 调用: {totals['llm_calls']}")
+    else:
+        print(f"作文数: {totals['essays']}  句子数: {totals['sentences']}  替换: {totals['replaced']}  "
+              f"失败: {totals['failed']}  LLM 调用: {totals['llm_calls']}")
+    return 1 if totals["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
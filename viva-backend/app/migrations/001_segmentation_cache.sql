@@ -0,0 +1,14 @@
+-- 分词结果缓存：md5(句子) + 流水线版本号 -> SynonymExpansionResult
+CREATE TABLE IF NOT EXISTS segmentation_cache (
+    sentence_hash VARCHAR(32) NOT NULL,
+    version VARCHAR(64) NOT NULL,
+    result JSONB NOT NULL,
+    hit_count INTEGER DEFAULT 0,
+    create_time TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    update_time TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    PRIMARY KEY (sentence_hash, version)
+);
+
+-- 清理旧版本（delete_except_version）和相似句子索引加载（get_sentences）按版本查询
+CREATE INDEX IF NOT EXISTS ix_segmentation_cache_version_update_time
+    ON segmentation_cache (version, update_time DESC);
@@ -0,0 +1,19 @@
+-- 后台处理作文的任务：状态、进度和错误
+CREATE TABLE IF NOT EXISTS essay_jobs (
+    job_id VARCHAR(36) PRIMARY KEY,
+    essay_id INTEGER NOT NULL REFERENCES essays (essay_id),
+    user_id VARCHAR(255) REFERENCES users (google_id),
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    total_sentences INTEGER DEFAULT 0,
+    processed_sentences INTEGER DEFAULT 0,
+    failed_sentences INTEGER DEFAULT 0,
+    error TEXT,
+    started_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE,
+    create_time TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    update_time TIMESTAMP WITH TIME ZONE DEFAULT now()
+);
+
+-- 按作文查最新的任务（get_by_essay_id），启动时恢复未完成的任务（get_unfinished）
+CREATE INDEX IF NOT EXISTS ix_essay_jobs_essay_id ON essay_jobs (essay_id, create_time DESC);
+CREATE INDEX IF NOT EXISTS ix_essay_jobs_status ON essay_jobs (status);
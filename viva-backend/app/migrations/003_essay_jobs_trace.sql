@@ -0,0 +1,2 @@
+-- 任务各阶段的耗时、LLM 调用、token、重试和解析失败汇总
+ALTER TABLE essay_jobs ADD COLUMN IF NOT EXISTS trace JSONB;
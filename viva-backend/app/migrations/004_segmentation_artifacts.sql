@@ -0,0 +1,13 @@
+-- 分阶段的分词产物：md5(句子) + 阶段 + 阶段版本号 -> 该阶段的结果
+CREATE TABLE IF NOT EXISTS segmentation_artifacts (
+    sentence_hash VARCHAR(32) NOT NULL,
+    phase VARCHAR(20) NOT NULL,
+    version VARCHAR(64) NOT NULL,
+    result JSONB NOT NULL,
+    create_time TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    update_time TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    PRIMARY KEY (sentence_hash, phase, version)
+);
+
+-- 启动时按时间清理过期的产物
+CREATE INDEX IF NOT EXISTS ix_segmentation_artifacts_update_time ON segmentation_artifacts (update_time);
@@ -0,0 +1,6 @@
+-- 离截止时间太近、跳过了同义词扩展的 mapping，后台补全后替换；已有的 mapping 都是完整的
+ALTER TABLE active_mappings ADD COLUMN IF NOT EXISTS is_partial BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- 写入时查找需要替换的不完整 mapping（get_partial_sentence_ids）
+CREATE INDEX IF NOT EXISTS ix_active_mappings_partial_sentence_id
+    ON active_mappings (sentence_id) WHERE is_partial;
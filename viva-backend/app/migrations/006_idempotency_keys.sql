@@ -0,0 +1,14 @@
+-- submitEssay 的 Idempotency-Key：同一个用户的同一个 key 只创建一篇作文
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id VARCHAR(255) NOT NULL REFERENCES users (google_id),
+    idempotency_key VARCHAR(255) NOT NULL,
+    fingerprint VARCHAR(64) NOT NULL,
+    essay_id INTEGER REFERENCES essays (essay_id),
+    job_id VARCHAR(36) REFERENCES essay_jobs (job_id),
+    create_time TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    update_time TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    PRIMARY KEY (user_id, idempotency_key)
+);
+
+-- 启动时清理过期的 key（delete_expired）
+CREATE INDEX IF NOT EXISTS ix_idempotency_keys_create_time ON idempotency_keys (create_time);
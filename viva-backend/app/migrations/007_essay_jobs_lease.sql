@@ -0,0 +1,3 @@
+-- 领取任务的 worker 和租约：同一个任务同时只能被一个 worker 处理（EssayJobRepository.claim）
+ALTER TABLE essay_jobs ADD COLUMN IF NOT EXISTS worker_id VARCHAR(64);
+ALTER TABLE essay_jobs ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE;
@@ -0,0 +1,69 @@
+"""
+InflectionService 的本地词形变化：确定的形式直接返回，不确定的返回 None 交给 LLM
+
+在 app 目录下运行（需要 nltk 的 wordnet 数据）：
+    python -m unittest tests.test_inflection
+"""
+import os
+import sys
+import unittest
+
+# 获取项目根目录（tests 在项目根目录下）
+project_root = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# 将项目根目录添加到 Python 路径
+sys.path.insert(0, project_root)
+
+from infrastructure.english.inflection import (
+    InflectionService, COMPARATIVE, PAST, PLURAL, PRESENT_PARTICIPLE, SUPERLATIVE, THIRD_PERSON
+)
+
+
+class RegularFormsTest(unittest.TestCase):
+    def test_plural(self):
+        self.assertEqual(InflectionService.inflect("cat", "n", PLURAL), "cats")
+        self.assertEqual(InflectionService.inflect("box", "n", PLURAL), "boxes")
+        self.assertEqual(InflectionService.inflect("city", "n", PLURAL), "cities")
+        self.assertEqual(InflectionService.inflect("child", "n", PLURAL), "children")
+
+    def test_verb_forms(self):
+        self.assertEqual(InflectionService.inflect("stop", "v", PAST), "stopped")
+        self.assertEqual(InflectionService.inflect("settle", "v", PAST), "settled")
+        self.assertEqual(InflectionService.inflect("play", "v", THIRD_PERSON), "plays")
+        self.assertEqual(InflectionService.inflect("make", "v", PRESENT_PARTICIPLE), "making")
+        self.assertEqual(InflectionService.inflect("put", "v", PRESENT_PARTICIPLE), "putting")
+
+    def test_synthetic_comparison(self):
+        self.assertEqual(InflectionService.inflect("big", "a", COMPARATIVE), "bigger")
+        self.assertEqual(InflectionService.inflect("large", "a", SUPERLATIVE), "largest")
+        self.assertEqual(InflectionService.inflect("happy", "a", COMPARATIVE), "happier")
+        self.assertEqual(InflectionService.inflect("happy", "a", SUPERLATIVE), "happiest")
+
+
+class FallbackToLLMTest(unittest.TestCase):
+    def test_two_syllable_adjectives_use_more_most(self):
+        for lemma in ("famous", "careful", "modern"):
+            self.assertIsNone(InflectionService.inflect(lemma, "a", COMPARATIVE), lemma)
+            self.assertIsNone(InflectionService.inflect(lemma, "a", SUPERLATIVE), lemma)
+
+    def test_participial_adjectives(self):
+        for lemma in ("boring", "interesting", "tired", "bored"):
+            self.assertIsNone(InflectionService.inflect(lemma, "a", COMPARATIVE), lemma)
+            self.assertIsNone(InflectionService.inflect(lemma, "a", SUPERLATIVE), lemma)
+        self.assertEqual(InflectionService.inflect("red", "a", COMPARATIVE), "redder")
+
+    def test_identical_past_verbs(self):
+        for lemma in ("put", "hit", "cut", "set"):
+            self.assertIsNone(InflectionService.inflect(lemma, "v", PAST), lemma)
+
+    def test_mass_nouns(self):
+        for lemma in ("information", "advice", "furniture", "kindness", "software"):
+            self.assertIsNone(InflectionService.inflect(lemma, "n", PLURAL), lemma)
+
+    def test_transform_like_keeps_unknown_positions(self):
+        self.assertEqual(InflectionService.transform_like("bigger", "a", ["large", "famous"]), ["larger", None])
+        self.assertEqual(InflectionService.transform_like("decided", "v", ["settle", "put"]), ["settled", None])
+
+
+if __name__ == "__main__":
+    unittest.main()
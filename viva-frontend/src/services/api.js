@@ -48,6 +48,15 @@ api.interceptors.response.use(
   }
 );
 
+// 生成 Idempotency-Key：同一次提交（包括失败后的重试）用同一个 key，后端只会创建一篇作文
+export function newIdempotencyKey() {
+  if (window.crypto?.randomUUID) {
+    return window.crypto.randomUUID();
+  }
+  // 非 https 环境没有 randomUUID
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}-${Math.random().toString(36).slice(2)}`;
+}
+
 // 全局 Toast 显示函数
 function showGlobalToast(message, type = 'error') {
   // 创建一个事件来触发 Toast
@@ -63,8 +72,8 @@ export default {
     return api.get('/essays');
   },
 
-  // 提交新文章
-  submitEssay(content, image = null) {
+  // 提交新文章；idempotencyKey 由调用方为每次提交生成一个（newIdempotencyKey），重试时传入同一个
+  submitEssay(content, image = null, idempotencyKey = null) {
     const formData = new FormData();
     formData.append('content', content);
     
@@ -72,13 +81,69 @@ export default {
       formData.append('image', image);
     }
 
-    return api.post('/submitEssay', formData, {
-      headers: {
-        'Content-Type': 'multipart/form-data',
-      },
-    });
+    const headers = {
+      'Content-Type': 'multipart/form-data',
+    };
+    if (idempotencyKey) {
+      headers['Idempotency-Key'] = idempotencyKey;
+    }
+    return api.post('/submitEssay', formData, { headers });
+  },
+
+
+  // 获取作文后台处理任务的进度
+  getEssayJob(job_id) {
+    return api.get(`/essayJobs/${job_id}`);
+  },
+
+  // 获取作文最新的后台处理任务，打开作文时用来判断是否还在处理
+  getLatestEssayJob(essay_id) {
+    return api.get(`/essays/${essay_id}/job`);
   },
 
+  // 重新处理失败的作文任务
+  retryEssayJob(job_id) {
+    return api.post(`/essayJobs/${job_id}/retry`);
+  },
+
+  // 订阅作文处理进度（SSE），每个句子完成就回调一次 onEvent(event, data)
+  // EventSource 不能带 Authorization 头，所以用 fetch 读取事件流；signal 用于关闭页面时停止订阅
+  // 接口返回错误（401、404 等）时抛出带 status 的错误，不会静默结束
+  async streamEssayJob(job_id, onEvent, signal = null) {
+    const token = localStorage.getItem('jwt_token');
+    const response = await fetch(`${API_URL}/essayJobs/${job_id}/events`, {
+      headers: token ? { 'Authorization': `Bearer ${token}` } : {},
+      credentials: 'include',
+      signal
+    });
+    if (!response.ok) {
+      if (response.status === 401) {
+        localStorage.removeItem('jwt_token');
+        useUserStore().logout();
+        showGlobalToast('登录已过期，请重新登录', 'error');
+      }
+      const error = new Error(`Essay job stream failed with status ${response.status}`);
+      error.status = response.status;
+      throw error;
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const chunks = buffer.split('\n\n');
+      buffer = chunks.pop();
+      for (const chunk of chunks) {
+        const event = chunk.match(/^event: (.*)$/m)?.[1];
+        const data = chunk.match(/^data: (.*)$/m)?.[1];
+        if (event && data) {
+          onEvent(event, JSON.parse(data));
+        }
+      }
+    }
+  },
 
   // 获取句子列表
   getEssaySentenceIds(essay_id) {